@@ -24,9 +24,14 @@ logger = logging.getLogger(__name__)
 
 from sqlalchemy.orm import class_mapper
 
+import ast
+import collections
 import datetime
+import itertools
+import json
 import os
 import re
+import weakref
 import bauble.error as error
 from bauble.i18n import _
 
@@ -49,6 +54,7 @@ except ImportError:
 import gtk
 
 import sqlalchemy.orm as orm
+from sqlalchemy import event
 from sqlalchemy.ext.declarative import declarative_base, DeclarativeMeta
 
 import bauble.btypes as types
@@ -94,11 +100,575 @@ def natsort(attr, obj):
     partial(natsort, 'accessions')(species)
     partial(natsort, 'species.accessions')(vern_name)
     """
-    from bauble import utils
     jumps = attr.split('.')
     for attr in jumps:
         obj = getattr(obj, attr)
-    return sorted(obj, key=utils.natsort_key)
+    return natsorted(obj)
+
+
+def natsort_strings(objects):
+    """return the strings by which objects are naturally sorted
+
+    for objects of classes declaring a `natsort_column` class method,
+    the strings are computed in the database, in one query per class
+    and chunk of ids.  the class method returns a pair: the list of
+    relations (outer) joining the class to the tables used in the
+    column, and the column expression computing the string.
+
+    other objects, and objects with pending changes, use their __str__.
+    """
+    from sqlalchemy.orm import object_session
+    objects = list(objects)
+    strings = [None] * len(objects)
+    pending = {}
+    changed = {}
+    for index, obj in enumerate(objects):
+        klass = type(obj)
+        session = object_session(obj)
+        if (hasattr(klass, 'natsort_column') and session is not None and
+                getattr(obj, 'id', None) is not None):
+            if session not in changed:
+                changed[session] = set(session.dirty) | set(session.new)
+            if obj not in changed[session]:
+                pending.setdefault((klass, session), {}).setdefault(
+                    obj.id, []).append(index)
+                continue
+        strings[index] = str(obj)
+    for (klass, session), positions in pending.iteritems():
+        joins, column = klass.natsort_column()
+        for chunk in in_clause_chunks(positions.keys(), session.bind):
+            q = session.query(klass.id, column).select_from(klass)
+            for target in joins:
+                q = q.outerjoin(target)
+            for obj_id, value in q.filter(klass.id.in_(chunk)):
+                for index in positions[obj_id]:
+                    strings[index] = (value or u'').encode('utf-8')
+    for index, value in enumerate(strings):
+        if value is None:  # no row in the database
+            strings[index] = str(objects[index])
+    return strings
+
+
+def natsorted(objects, reverse=False):
+    """return the objects in natural order
+
+    same order as sorted(objects, key=utils.natsort_key), but the
+    strings come from natsort_strings and the keys are built in one
+    pass.
+    """
+    objects = list(objects)
+    keys = utils.natsort_keys(natsort_strings(objects))
+    order = sorted(range(len(objects)), key=keys.__getitem__,
+                   reverse=reverse)
+    return [objects[i] for i in order]
+
+
+def natsort_children(attr, obj):
+    """return the (class, id) pairs of the objects natsort(attr, obj)
+    returns, in the same order, without loading them
+
+    the children ids and the strings they are sorted by come from one
+    query; the class of the children must declare `natsort_column`, see
+    natsort_strings.  meant to be curried, as a SearchView
+    children_loader.
+    """
+    from sqlalchemy.orm import object_session, with_parent
+    jumps = attr.split('.')
+    for attr in jumps[:-1]:
+        obj = getattr(obj, attr)
+    relation = getattr(type(obj), jumps[-1])
+    klass = relation.property.mapper.class_
+    joins, column = klass.natsort_column()
+    q = object_session(obj).query(klass.id, column).select_from(klass).\
+        filter(with_parent(obj, relation))
+    for target in joins:
+        q = q.outerjoin(target)
+    rows = q.all()
+    keys = utils.natsort_keys([(value or u'').encode('utf-8')
+                               for obj_id, value in rows])
+    order = sorted(range(len(rows)), key=keys.__getitem__)
+    return [(klass, rows[i][0]) for i in order]
+
+
+def in_clause_chunks(ids, bind=None):
+    """split the ids list in chunks that fit in an IN clause
+
+    SQLite refuses statements with more than 999 bound parameters,
+    other backends accept much longer lists, but there's no point in
+    sending megabytes of SQL in one go.
+    """
+    bind = bind or engine
+    if bind is not None and bind.name == 'sqlite':
+        size = 900
+    else:
+        size = 10000
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def keyset_after(columns, values, bind=None):
+    """return the clause selecting the rows that follow, in ascending
+    order by columns, the row having values in those columns
+
+    for keyset pagination: the next page is the query filtered by this
+    clause, with the values of the last row of the page before.  NULLs
+    sort first on SQLite and MySQL, last on the other backends.
+    """
+    bind = bind or engine
+    nulls_first = bind.name in ('sqlite', 'mysql')
+    following = []
+    equal = []
+    for column, value in zip(columns, values):
+        if value is None:
+            if nulls_first:
+                following.append(sa.and_(column.isnot(None), *equal))
+            equal.append(column.is_(None))
+        else:
+            after = column > value
+            if not nulls_first:
+                after = sa.or_(after, column.is_(None))
+            following.append(sa.and_(after, *equal))
+            equal.append(column == value)
+    return sa.or_(*following)
+
+
+def cancel_statement(connection, bind=None):
+    """interrupt the statement running on a DBAPI connection
+
+    meant to be called from a thread other than the one waiting for the
+    statement, which then gets an OperationalError.  PostgreSQL cancels
+    the statement server side, SQLite interrupts it between two steps
+    of the virtual machine.  return False if the backend offers no way
+    to cancel statements, or if the connection is the single one of a
+    StaticPool, shared by all threads: interrupting it would also break
+    the statements of the GUI thread.
+    """
+    from sqlalchemy.pool import StaticPool
+    bind = bind or engine
+    if isinstance(bind.engine.pool, StaticPool):
+        return False
+    if bind.name == 'sqlite':
+        connection.interrupt()
+    elif bind.name == 'postgresql':
+        connection.cancel()
+    else:
+        return False
+    return True
+
+
+def count_top_level(session, klass, ids, is_cancelled=lambda: False):
+    """compute the top level count of the klass objects with given ids
+
+    the counting is done in the database, according to what klass
+    declares in its `top_level_count_columns` class method, which
+    returns a pair: the list of relations (outer) joining the klass to
+    the counted tables, and a list of triples (key, kind, column).
+    `kind` is one of:
+
+    * 'count': number of distinct values of column.
+    * 'sum': sum of column.
+    * 'distinct': number of distinct values of column, when the same
+      value may be reached from more than one of the counted objects.
+
+    'count' and 'sum' are additive over disjoint sets of ids, so they
+    are computed chunk by chunk.  'distinct' values are collected as
+    sets if ids do not fit in a single chunk.  `ids` can also be a
+    select statement producing the ids, which is then used as a single
+    chunk.
+
+    return a dictionary, associating key to the integer count, or None
+    if `is_cancelled` returned True.
+    """
+    from sqlalchemy import func, distinct
+    from sqlalchemy.sql.expression import ClauseElement
+    joins, columns = klass.top_level_count_columns()
+
+    def base_query(*entities):
+        q = session.query(*entities).select_from(klass)
+        for target in joins:
+            q = q.outerjoin(target)
+        return q
+
+    def aggregate(kind, column):
+        if kind == 'sum':
+            return func.coalesce(func.sum(column), 0)
+        return func.count(distinct(column))
+
+    if isinstance(ids, ClauseElement):
+        chunks = [ids]
+    else:
+        chunks = list(in_clause_chunks(ids, session.bind))
+    result = dict((key, 0) for key, kind, column in columns)
+    sets = {}
+    for chunk in chunks:
+        if is_cancelled():
+            return None
+        if len(chunks) == 1:
+            counted = columns
+        else:
+            counted = [i for i in columns if i[1] != 'distinct']
+            for key, kind, column in columns:
+                if kind != 'distinct':
+                    continue
+                q = base_query(column).filter(klass.id.in_(chunk))
+                sets.setdefault(key, set()).update(
+                    i for (i, ) in q.distinct() if i is not None)
+        if not counted:
+            continue
+        q = base_query(*[aggregate(kind, column)
+                         for key, kind, column in counted])
+        values = q.filter(klass.id.in_(chunk)).one()
+        for (key, kind, column), value in zip(counted, values):
+            result[key] += int(value or 0)
+    for key, value in sets.items():
+        result[key] = len(value)
+    return result
+
+
+generation = 0
+"""
+Incremented at every change recorded in the history and at every
+:func:`bauble.db.open()`.  Caches of values computed from the database
+use it to tell whether they are stale, see :func:`bump_generation`.
+"""
+
+
+# (generation, (table name, id) or None), the most recent changes
+_changes = collections.deque(maxlen=10000)
+
+
+def bump_generation(changed=None):
+    """tell the caches that the database content changed
+
+    HistoryExtension does this for all changes made through the mapped
+    classes, passing the (table name, id) of the changed row, code
+    writing to the tables directly should call it, without arguments.
+    """
+    global generation
+    generation += 1
+    _changes.append((generation, changed))
+
+
+def changed_rows(since):
+    """return the set of the (table name, id) of the rows changed after
+    generation `since`
+
+    return None if that is not known, because the changes are too many
+    or some were made without telling which rows they touched.
+    """
+    if since >= generation:
+        return set()
+    if not _changes or _changes[0][0] > since + 1:
+        return None
+    result = set()
+    for gen, changed in reversed(_changes):
+        if gen <= since:
+            break
+        if changed is None:
+            return None
+        result.add(changed)
+    return result
+
+
+def _history_value(value):
+    """the value of a column, as it goes in the JSON history values"""
+    if value is None or isinstance(value, (bool, int, long, float)):
+        return value
+    return utils.utf8(value)
+
+
+def _typed_history_value(value, column):
+    """the value of a column in the history values of old, which were
+    the repr of a dictionary of strings
+
+    u'None' is taken for null, since that is how those entries stored
+    it, an actual u'None' text is lost.  other values are converted
+    back to numbers or booleans only in the numeric and boolean columns,
+    the strings of the text columns are kept as they are.
+    """
+    if value == u'None':
+        return None
+    if column is None or not isinstance(
+            column.type, (sa.Integer, sa.Numeric, sa.Boolean)):
+        return value
+    try:
+        typed = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+    if isinstance(typed, (bool, int, long, float)):
+        return typed
+    return value
+
+
+def history_values(values, table_name=None):
+    """return the dictionary of the column values stored in the values
+    of a History entry of table_name
+
+    entries written before the values were JSON are parsed as well,
+    :func:`migrate_history` converts them once and for all.  their
+    values are all strings, see :func:`_typed_history_value` for how
+    they are converted back.
+    """
+    if values.startswith(u"{'"):
+        table = metadata.tables.get(table_name)
+        columns = table.c if table is not None else {}
+        return dict((k, _typed_history_value(v, columns.get(k)))
+                    for k, v in ast.literal_eval(values).items())
+    return json.loads(values)
+
+
+def history_query(session, table_name=None, table_id=None, since=None,
+                  until=None, user=None, operation=None, after=None):
+    """return the query of the History entries, newest first
+
+    :param table_name: only the entries of this table
+    :param table_id: only the entries of the rows with this id, of
+        table_name if given, of any table otherwise
+    :param since: only the entries with a later timestamp
+    :param until: only the entries with an earlier timestamp
+    :param user: only the entries of this user
+    :param operation: only the entries of this operation, like 'update'
+    :param after: the (timestamp, id) of an entry, only the entries
+        following it in the order, for keyset pagination
+
+    the history is indexed on (table_name, table_id) and on timestamp.
+    timestamps can be given as strings.
+    """
+    query = session.query(History)
+    if table_name is not None:
+        query = query.filter(History.table_name == table_name)
+    if table_id is not None:
+        query = query.filter(History.table_id == table_id)
+    if since is not None:
+        query = query.filter(History.timestamp > since)
+    if until is not None:
+        query = query.filter(History.timestamp < until)
+    if user is not None:
+        query = query.filter(History.user == user)
+    if operation is not None:
+        query = query.filter(History.operation == operation)
+    if after is not None:
+        timestamp, id = after
+        query = query.filter(sa.or_(
+            History.timestamp < timestamp,
+            sa.and_(History.timestamp == timestamp, History.id < id)))
+    return query.order_by(History.timestamp.desc(), History.id.desc())
+
+
+def migrate_history(bind=None, batch_size=1000):
+    """create the history indexes, and convert to JSON the values of
+    the entries written before they were JSON
+
+    the entries are converted a batch at a time, each batch in its own
+    transaction, so that the work done survives an interruption.  the
+    conversion of their values is the one of :func:`history_values`.
+    """
+    bind = bind or engine
+    table = History.__table__
+    existing = set(i['name'] for i in sa.inspect(bind).get_indexes(
+        table.name))
+    for index in table.indexes:
+        if index.name not in existing:
+            index.create(bind)
+    values = table.c['values']
+    update = table.update().where(table.c.id == sa.bindparam('_id')).\
+        values(values=sa.bindparam('_values'))
+    last = 0
+    while True:
+        with bind.begin() as connection:
+            rows = connection.execute(
+                sa.select([table.c.id, values, table.c.table_name]).where(
+                    sa.and_(table.c.id > last, values.like(u"{'%"))).
+                order_by(table.c.id).limit(batch_size)).fetchall()
+            if not rows:
+                break
+            connection.execute(update, [
+                {'_id': i, '_values': json.dumps(history_values(v, name))}
+                for i, v, name in rows])
+        last = rows[-1][0]
+
+
+def history_archive_table(year):
+    """return the Table the entries of year are archived to, when they
+    are archived to tables, like `history_archive_2015`
+    """
+    return sa.Table('history_archive_%d' % year, sa.MetaData(),
+                    *[c.copy() for c in History.__table__.columns])
+
+
+def history_archive_file(directory, year):
+    """return the path of the file the entries of year are archived to,
+    when they are archived to files, like `history-2015.jsonl.gz`
+    """
+    return os.path.join(directory, 'history-%d.jsonl.gz' % year)
+
+
+def _archive_to_file(directory, year, entries):
+    """append entries to the archive file of year, the caller skips the
+    entries already in it
+    """
+    import gzip
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    archive = gzip.open(history_archive_file(directory, year), 'ab')
+    try:
+        for entry in entries:
+            entry = dict(entry, timestamp=entry['timestamp'].isoformat())
+            archive.write(json.dumps(entry) + '\n')
+    finally:
+        archive.close()
+
+
+def _archived_in_file(directory, year):
+    import gzip
+    path = history_archive_file(directory, year)
+    if not os.path.exists(path):
+        return
+    archive = gzip.open(path, 'rb')
+    try:
+        for line in archive:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            timestamp = entry['timestamp']
+            entry['timestamp'] = datetime.datetime.strptime(
+                timestamp, '.' in timestamp and '%Y-%m-%dT%H:%M:%S.%f' or
+                '%Y-%m-%dT%H:%M:%S')
+            yield entry
+    finally:
+        archive.close()
+
+
+def _archived_ids(connection, year, ids):
+    """return the set of the ids, among ids, already in the archive
+    table of year, like the ids of the entries restored from it
+    """
+    archive = history_archive_table(year)
+    return set(id for chunk in in_clause_chunks(ids, connection.engine)
+               for (id, ) in connection.execute(
+                   sa.select([archive.c.id]).where(archive.c.id.in_(chunk))))
+
+
+def archive_history(before, directory=None, bind=None, batch_size=500):
+    """move the History entries older than before out of the history
+    table, a year in each archive, and return how many were moved
+
+    :param before: a datetime, or a string
+    :param directory: where to write the gzipped JSON lines archive
+        files, see :func:`history_archive_file`; if None the entries go
+        to the tables of :func:`history_archive_table` instead.
+
+    the entries are moved a batch at a time, each batch deleted in the
+    transaction that archived it; a batch written to a file whose
+    transaction then fails is found there again, and skipped, by
+    :func:`restore_history`.  the newest entry is never archived, so
+    that the history ids keep growing, and archived ones are not reused.
+    entries already in the archive of their year, because they were
+    restored from it, are not archived twice.
+    """
+    bind = bind or engine
+    table = History.__table__
+    newest = sa.select([sa.func.max(table.c.id)]).as_scalar()
+    # year -> the ids in its archive file, read once
+    in_files = {}
+    moved = 0
+    while True:
+        with bind.begin() as connection:
+            rows = connection.execute(
+                sa.select(table.c).where(sa.and_(
+                    table.c.timestamp < before, table.c.id < newest)).
+                order_by(table.c.id).limit(batch_size)).fetchall()
+            if not rows:
+                break
+            years = {}
+            for row in rows:
+                years.setdefault(row['timestamp'].year, []).append(dict(row))
+            for year, entries in sorted(years.items()):
+                if directory is None:
+                    archive = history_archive_table(year)
+                    archive.create(connection, checkfirst=True)
+                    archived = _archived_ids(connection, year,
+                                             [e['id'] for e in entries])
+                else:
+                    if year not in in_files:
+                        in_files[year] = set(
+                            e['id'] for e in _archived_in_file(directory,
+                                                               year))
+                    archived = in_files[year]
+                entries = [e for e in entries if e['id'] not in archived]
+                if not entries:
+                    continue
+                if directory is None:
+                    connection.execute(archive.insert(), entries)
+                else:
+                    _archive_to_file(directory, year, entries)
+                    archived.update(e['id'] for e in entries)
+            connection.execute(table.delete().where(
+                table.c.id.in_([row['id'] for row in rows])))
+        moved += len(rows)
+    if moved:
+        bump_generation()
+    return moved
+
+
+def restore_history(year, directory=None, bind=None, batch_size=500):
+    """copy back to the history table the entries archived for year,
+    and return how many were restored
+
+    :param directory: the directory of the archive files, as given to
+        :func:`archive_history`, or None for the archive tables.
+
+    the archive is left as it is, the entries already in the history
+    table are skipped, like the entries repeated in the archive, so that
+    restoring a year twice does no harm.
+    """
+    bind = bind or engine
+    table = History.__table__
+    with bind.begin() as connection:
+        if directory is None:
+            archive = history_archive_table(year)
+            if not archive.exists(connection):
+                return 0
+            entries = (dict(row) for row in
+                       connection.execute(archive.select()))
+        else:
+            entries = _archived_in_file(directory, year)
+        restored = 0
+        while True:
+            batch = list(itertools.islice(entries, batch_size))
+            if not batch:
+                break
+            present = set(id for (id, ) in connection.execute(
+                sa.select([table.c.id]).where(
+                    table.c.id.in_([e['id'] for e in batch]))))
+            unique = []
+            for entry in batch:
+                if entry['id'] not in present:
+                    present.add(entry['id'])
+                    unique.append(entry)
+            batch = unique
+            if batch:
+                connection.execute(table.insert(), batch)
+                restored += len(batch)
+    if restored:
+        bump_generation()
+    return restored
+
+
+def _history_user():
+    """return the name of the user the history records changes for"""
+    try:
+        if engine.name.startswith('sqlite'):
+            raise TypeError("this engine know nothing of users")
+        import bauble.plugins.users as users
+        return users.current_user()
+    except:
+        if 'USER' in os.environ and os.environ['USER']:
+            return os.environ['USER']
+        elif 'USERNAME' in os.environ and os.environ['USERNAME']:
+            return os.environ['USERNAME']
+    return None
 
 
 class HistoryExtension(orm.MapperExtension):
@@ -108,40 +678,57 @@ class HistoryExtension(orm.MapperExtension):
     to all clases that inherit from bauble.db.Base so that all
     inserts, updates, and deletes made to the mapped objects are
     recorded in the `history` table.
+
+    The entries are collected in the session and written, in one
+    executemany on the connection of the flush, when the flush is over,
+    see _write_history.  The user is looked up once per session.
     """
-    def _add(self, operation, mapper, instance):
+    def _add(self, operation, mapper, connection, instance):
         """
         Add a new entry to the history table.
         """
-        user = None
-        try:
-            if engine.name.startswith('sqlite'):
-                raise TypeError("this engine know nothing of users")
-            import bauble.plugins.users as users
-            user = users.current_user()
-        except:
-            if 'USER' in os.environ and os.environ['USER']:
-                user = os.environ['USER']
-            elif 'USERNAME' in os.environ and os.environ['USERNAME']:
-                user = os.environ['USERNAME']
-
         row = {}
         for c in mapper.local_table.c:
-            row[c.name] = utils.utf8(getattr(instance, c.name))
-        table = History.__table__
-        table.insert(dict(table_name=mapper.local_table.name,
-                          table_id=instance.id, values=str(row),
-                          operation=operation, user=user,
-                          timestamp=datetime.datetime.today())).execute()
+            row[c.name] = _history_value(getattr(instance, c.name))
+        entry = dict(table_name=mapper.local_table.name,
+                     table_id=instance.id, values=json.dumps(row),
+                     operation=operation,
+                     timestamp=datetime.datetime.today())
+        session = orm.object_session(instance)
+        if session is None:
+            entry['user'] = _history_user()
+            connection.execute(History.__table__.insert(), entry)
+        else:
+            if 'history_user' not in session.info:
+                session.info['history_user'] = _history_user()
+            entry['user'] = session.info['history_user']
+            session.info.setdefault('history', []).append(entry)
+        bump_generation((mapper.local_table.name, instance.id))
 
     def after_update(self, mapper, connection, instance):
-        self._add('update', mapper, instance)
+        self._add('update', mapper, connection, instance)
 
     def after_insert(self, mapper, connection, instance):
-        self._add('insert', mapper, instance)
+        self._add('insert', mapper, connection, instance)
 
     def after_delete(self, mapper, connection, instance):
-        self._add('delete', mapper, instance)
+        self._add('delete', mapper, connection, instance)
+
+
+@event.listens_for(orm.Session, 'after_flush')
+def _write_history(session, flush_context):
+    """write the history entries HistoryExtension collected during the
+    flush, in the same transaction
+    """
+    entries = session.info.pop('history', None)
+    if entries:
+        session.connection().execute(History.__table__.insert(), entries)
+
+
+@event.listens_for(orm.Session, 'after_soft_rollback')
+def _forget_history(session, previous_transaction):
+    """a failed flush leaves no history behind"""
+    session.info.pop('history', None)
 
 
 class MapperBase(DeclarativeMeta):
@@ -164,8 +751,9 @@ class MapperBase(DeclarativeMeta):
                                           default=sa.func.now(),
                                           onupdate=sa.func.now())
             cls.__mapper_args__ = {'extension': HistoryExtension()}
-        if 'top_level_count' not in dict_:
-            cls.top_level_count = lambda x: {classname: 1}
+        if 'top_level_count_columns' not in dict_:
+            cls.top_level_count_columns = classmethod(
+                lambda k: ([], [(classname, 'count', k.id)]))
         if 'search_view_markup_pair' not in dict_:
             cls.search_view_markup_pair = lambda x: (
                 utils.xml_safe(str(x)),
@@ -228,7 +816,8 @@ class History(history_base):
       table_id: :class:`sqlalchemy.types.Integer`
         The id in the table of the row that was changed.
       values: :class:`sqlalchemy.types.String`
-        The changed values.
+        The values of the row, as a JSON object, see
+        :func:`history_values`.
       operation: :class:`sqlalchemy.types.String`
         The type of change.  This is usually one of insert, update or delete.
       user: :class:`sqlalchemy.types.String`
@@ -237,6 +826,9 @@ class History(history_base):
         When the change was made.
     """
     __tablename__ = 'history'
+    __table_args__ = (
+        sa.Index('history_table_name_id_idx', 'table_name', 'table_id'),
+        sa.Index('history_timestamp_idx', 'timestamp'))
     id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
     table_name = sa.Column(sa.Text, nullable=False)
     table_id = sa.Column(sa.Integer, nullable=False, autoincrement=False)
@@ -246,6 +838,106 @@ class History(history_base):
     timestamp = sa.Column(types.DateTime, nullable=False)
 
 
+def engine_options(uri):
+    """return the connection pool arguments to create_engine suiting
+    the database backend of uri
+
+    an in memory SQLite database exists in its connection only, all
+    threads share that one connection.  it is not reset when a session
+    returns it to the pool, which would roll back the work the other
+    sessions flushed but did not commit yet.  SQLite files are opened in WAL
+    mode, so that readers in the background threads and the writer do
+    not block each other, each session with its own pooled connection.
+    other backends keep a pool of connections, tested before use.
+    """
+    from sqlalchemy.engine.url import make_url
+    from sqlalchemy.pool import QueuePool, StaticPool
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite':
+        options = {'connect_args': {'check_same_thread': False}}
+        if url.database in (None, '', ':memory:'):
+            options['poolclass'] = StaticPool
+            options['pool_reset_on_return'] = None
+        else:
+            options['poolclass'] = QueuePool
+        return options
+    return {'poolclass': QueuePool, 'pool_size': 5, 'max_overflow': 10,
+            'pool_recycle': 3600}
+
+
+# engine -> the collections.Counter of its pool events
+_pool_counters = weakref.WeakKeyDictionary()
+
+
+def _watch_pool(engine):
+    """count the pool events of engine, and set up its connections as
+    its backend wants them
+    """
+    counters = _pool_counters[engine] = collections.Counter()
+
+    def count(name):
+        def listener(*args):
+            counters[name] += 1
+        return listener
+    for name in ('connect', 'checkout', 'checkin', 'invalidate'):
+        event.listen(engine, name, count(name))
+
+    if engine.name == 'sqlite':
+        if engine.url.database not in (None, '', ':memory:'):
+            event.listen(engine, 'connect', _sqlite_wal)
+    else:
+        event.listen(engine, 'engine_connect', _ping_connection)
+
+
+def _sqlite_wal(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.close()
+
+
+def _ping_connection(connection, branch):
+    """make sure the connection taken from the pool still works
+
+    a connection the server closed, like after a restart, is
+    invalidated by the failing ping, and the statement is tried again on
+    a new one.
+    """
+    if branch:
+        return
+    should_close_with_result = connection.should_close_with_result
+    connection.should_close_with_result = False
+    try:
+        connection.scalar(sa.select([1]))
+    except sa.exc.DBAPIError, e:
+        if not e.connection_invalidated:
+            raise
+        connection.scalar(sa.select([1]))
+    finally:
+        connection.should_close_with_result = should_close_with_result
+
+
+def pool_stats(bind=None):
+    """return the statistics of the connection pool of the engine, as
+    an OrderedDict from their name to their value
+
+    the pool class, the size of the pool and the connections in it, out
+    of it and in overflow, when the pool keeps them, then the number of
+    connections made, checked out, checked in and invalidated since the
+    database was opened.
+    """
+    bind = bind or engine
+    pool = bind.pool
+    stats = collections.OrderedDict()
+    stats['pool'] = type(pool).__name__
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        if hasattr(pool, name):
+            stats[name] = getattr(pool, name)()
+    counters = _pool_counters.get(bind, {})
+    for name in ('connect', 'checkout', 'checkin', 'invalidate'):
+        stats[name] = counters.get(name, 0)
+    return stats
+
+
 def open(uri, verify=True, show_error_dialogs=False):
     """
     Open a database connection.  This function sets bauble.db.engine to
@@ -273,13 +965,10 @@ def open(uri, verify=True, show_error_dialogs=False):
     global engine
     new_engine = None
 
-    from sqlalchemy.pool import NullPool, SingletonThreadPool
-    from bauble.prefs import testing
-    poolclass = testing and SingletonThreadPool or NullPool
-    poolclass = SingletonThreadPool
     new_engine = sa.create_engine(uri, echo=SQLALCHEMY_DEBUG,
                                   implicit_returning=False,
-                                  poolclass=poolclass, pool_size=20)
+                                  **engine_options(uri))
+    _watch_pool(new_engine)
     # TODO: there is a problem here: the code may cause an exception, but we
     # immediately loose the 'new_engine', which should know about the
     # encoding used in the exception string.
@@ -293,13 +982,9 @@ def open(uri, verify=True, show_error_dialogs=False):
         """bind metadata to engine and create sessionmaker """
         global Session, engine
         engine = new_engine
+        bump_generation()
         metadata.bind = engine  # make engine implicit for metadata
-        def temp():
-            import inspect
-            logger.debug('creating session %s' % str(inspect.stack()[1]))
-            return sessionmaker(bind=engine, autoflush=False)()
         Session = sessionmaker(bind=engine, autoflush=False)
-        Session = temp
 
     if new_engine is not None and not verify:
         _bind()
@@ -389,6 +1074,7 @@ def create(import_defaults=True):
         transaction.commit()
     finally:
         connection.close()
+        bump_generation()
 
 
 def verify_connection(engine, show_error_dialogs=False):
@@ -44,6 +44,7 @@ from bauble.plugins.garden.source import (
     Collection, collection_context_menu)
 from bauble.plugins.garden.institution import (
     Institution, InstitutionCommand, InstitutionTool, start_institution_editor)
+from bauble.plugins.garden.lineage import LineageCommandHandler
 
 #from bauble.plugins.garden.propagation import *
 import bauble.search as search
@@ -58,7 +59,7 @@ class GardenPlugin(pluginmgr.Plugin):
 
     depends = ["PlantsPlugin"]
     tools = [InstitutionTool]
-    commands = [InstitutionCommand]
+    commands = [InstitutionCommand, LineageCommandHandler]
 
     @classmethod
     def install(cls, *args, **kwargs):
@@ -73,12 +74,15 @@ class GardenPlugin(pluginmgr.Plugin):
         mapper_search.add_meta(('accession', 'acc'), Accession, ['code'])
         SearchView.row_meta[Accession].set(
             children=partial(db.natsort, "plants"),
+            children_loader=partial(db.natsort_children, "plants"),
             infobox=AccessionInfoBox,
-            context_menu=acc_context_menu)
+            context_menu=acc_context_menu,
+            prefetch=['species.genus', 'plants.location'])
 
         mapper_search.add_meta(('location', 'loc'), Location, ['name', 'code'])
         SearchView.row_meta[Location].set(
             children=partial(db.natsort, 'plants'),
+            children_loader=partial(db.natsort_children, 'plants'),
             infobox=LocationInfoBox,
             context_menu=loc_context_menu)
 
@@ -87,7 +91,8 @@ class GardenPlugin(pluginmgr.Plugin):
         #search.add_strategy(SpeciesSearch)  # special search value strategy
         SearchView.row_meta[Plant].set(
             infobox=PlantInfoBox,
-            context_menu=plant_context_menu)
+            context_menu=plant_context_menu,
+            prefetch=['accession.species.genus', 'location'])
 
         mapper_search.add_meta(('contact', 'contacts', 'person', 'org',
                                 'source'), Contact, ['name'])
@@ -105,12 +110,12 @@ class GardenPlugin(pluginmgr.Plugin):
 
         mapper_search.add_meta(('collection', 'col', 'coll'),
                                Collection, ['locale'])
-        coll_kids = lambda coll: sorted(coll.source.accession.plants,
-                                        key=utils.natsort_key)
+        coll_kids = lambda coll: db.natsorted(coll.source.accession.plants)
         SearchView.row_meta[Collection].set(
             children=coll_kids,
             infobox=AccessionInfoBox,
-            context_menu=collection_context_menu)
+            context_menu=collection_context_menu,
+            prefetch=['source.accession.species.genus'])
 
         # done here b/c the Species table is not part of this plugin
         SearchView.row_meta[Species].child = "accessions"
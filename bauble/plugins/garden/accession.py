@@ -733,6 +733,11 @@ class Accession(db.Base, db.Serializable, db.WithNotes):
     def __str__(self):
         return self.code
 
+    @classmethod
+    def natsort_column(cls):
+        """the string accessions are naturally sorted by, computed in SQL"""
+        return ([], cls.code)
+
     def species_str(self, authors=False, markup=False):
         """
         Return the string of the species with the id qualifier(id_qual)
@@ -835,16 +840,21 @@ class Accession(db.Base, db.Serializable, db.WithNotes):
         except:
             return None
 
-    def top_level_count(self):
-        sd = self.source and self.source.source_detail
-        return {(1, 'Accessions'): 1,
-                (2, 'Species'): set([self.species.id]),
-                (3, 'Genera'): set([self.species.genus.id]),
-                (4, 'Families'): set([self.species.genus.family.id]),
-                (5, 'Plantings'): len(self.plants),
-                (6, 'Living plants'): sum(p.quantity for p in self.plants),
-                (7, 'Locations'): set([p.location.id for p in self.plants]),
-                (8, 'Sources'): set(sd and [sd.id] or [])}
+    @classmethod
+    def top_level_count_columns(cls):
+        from bauble.plugins.plants.genus import Genus
+        from bauble.plugins.plants.species_model import Species
+        from bauble.plugins.garden.plant import Plant
+        from bauble.plugins.garden.source import Source
+        return ([cls.species, Species.genus, cls.plants, cls.source],
+                [((1, 'Accessions'), 'count', cls.id),
+                 ((2, 'Species'), 'distinct', cls.species_id),
+                 ((3, 'Genera'), 'distinct', Species.genus_id),
+                 ((4, 'Families'), 'distinct', Genus.family_id),
+                 ((5, 'Plantings'), 'count', Plant.id),
+                 ((6, 'Living plants'), 'sum', Plant.quantity),
+                 ((7, 'Locations'), 'distinct', Plant.location_id),
+                 ((8, 'Sources'), 'distinct', Source.source_detail_id)])
 
 
 from bauble.plugins.garden.plant import Plant, PlantEditor
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Mario Frasca <mario@anche.no>.
+#
+# This file is part of ghini.desktop.
+#
+# ghini.desktop is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ghini.desktop is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ghini.desktop. If not, see <http://www.gnu.org/licenses/>.
+#
+# lineage.py
+#
+# the plant_lineage table, denormalizing the taxonomy of each plant
+#
+import weakref
+
+import logging
+logger = logging.getLogger(__name__)
+
+from sqlalchemy import Table, Column, Integer, select, event
+from sqlalchemy.orm.attributes import get_history, PASSIVE_NO_INITIALIZE
+
+import bauble.db as db
+import bauble.pluginmgr as pluginmgr
+from bauble.plugins.plants import Genus, Species
+from bauble.plugins.garden.accession import Accession
+from bauble.plugins.garden.plant import Plant
+
+
+plant_lineage = Table(
+    'plant_lineage', db.metadata,
+    Column('plant_id', Integer, primary_key=True, autoincrement=False),
+    Column('accession_id', Integer, index=True),
+    Column('species_id', Integer, index=True),
+    Column('genus_id', Integer, index=True),
+    Column('family_id', Integer, index=True),
+    Column('location_id', Integer, index=True))
+"""
+For each plant, the ids of its accession, species, genus, family and
+location, so that going from any of these to the plants is a single
+join.
+
+The table is created with the others on new databases; on older ones
+it is created by the ``:lineage`` command.  The mapper hooks below keep
+it in sync with the changes made through the ORM.  The CSV import
+bypasses them, it calls ``info['rebuild']`` instead, and the CSV export
+skips the table, like any table having it.
+"""
+
+# engine -> whether plant_lineage exists
+_enabled = weakref.WeakKeyDictionary()
+
+# the mapped classes whose changes move plants in the lineage: the
+# lineage column holding their id, the attributes that, when changed,
+# change the lineage of their plants
+_tracked = [(Plant, 'plant_id', ('accession_id', 'accession',
+                                 'location_id', 'location')),
+            (Accession, 'accession_id', ('species_id', 'species')),
+            (Species, 'species_id', ('genus_id', 'genus')),
+            (Genus, 'genus_id', ('family_id', 'family'))]
+
+
+def lineage_enabled(bind=None):
+    """return whether the plant_lineage table exists in the database"""
+    engine = (bind or db.engine).engine
+    if engine not in _enabled:
+        _enabled[engine] = engine.has_table(plant_lineage.name)
+    return _enabled[engine]
+
+
+def _forget(target, connection, **kw):
+    _enabled.pop(connection.engine, None)
+
+event.listen(plant_lineage, 'after_create', _forget)
+event.listen(plant_lineage, 'after_drop', _forget)
+
+
+def lineage_select(whereclause=None):
+    """return the select computing the lineage rows, from the base
+    tables, of the plants matching whereclause
+    """
+    plant = Plant.__table__
+    accession = Accession.__table__
+    species = Species.__table__
+    genus = Genus.__table__
+    stmt = select([plant.c.id, plant.c.accession_id, accession.c.species_id,
+                   species.c.genus_id, genus.c.family_id,
+                   plant.c.location_id]).select_from(
+        plant.join(accession, plant.c.accession_id == accession.c.id).
+        join(species, accession.c.species_id == species.c.id).
+        join(genus, species.c.genus_id == genus.c.id))
+    if whereclause is not None:
+        stmt = stmt.where(whereclause)
+    return stmt
+
+
+def _refresh(connection, cls, column, id):
+    """recompute the lineage of the plants having id in column"""
+    connection.execute(plant_lineage.delete().where(
+        plant_lineage.c[column] == id))
+    connection.execute(plant_lineage.insert().from_select(
+        plant_lineage.c.keys(), lineage_select(cls.__table__.c.id == id)))
+
+
+def _make_hooks(cls, column, attributes):
+
+    def after_update(mapper, connection, instance):
+        if lineage_enabled(connection) and any(
+                get_history(instance, name, PASSIVE_NO_INITIALIZE).
+                has_changes() for name in attributes):
+            _refresh(connection, cls, column, instance.id)
+
+    def after_delete(mapper, connection, instance):
+        if lineage_enabled(connection):
+            connection.execute(plant_lineage.delete().where(
+                plant_lineage.c[column] == instance.id))
+
+    event.listen(cls, 'after_update', after_update)
+    event.listen(cls, 'after_delete', after_delete)
+
+for cls, column, attributes in _tracked:
+    _make_hooks(cls, column, attributes)
+
+
+@event.listens_for(Plant, 'after_insert')
+def _plant_inserted(mapper, connection, instance):
+    if lineage_enabled(connection):
+        _refresh(connection, Plant, 'plant_id', instance.id)
+
+
+def rebuild_lineage(bind=None):
+    """create the plant_lineage table if needed, and fill it again from
+    the plant, accession, species and genus tables
+    """
+    bind = bind or db.engine
+    with bind.begin() as connection:
+        plant_lineage.create(connection, checkfirst=True)
+        connection.execute(plant_lineage.delete())
+        connection.execute(plant_lineage.insert().from_select(
+            plant_lineage.c.keys(), lineage_select()))
+    _enabled.pop(bind, None)
+    db.bump_generation()
+
+plant_lineage.info['rebuild'] = rebuild_lineage
+
+
+def drop_lineage(bind=None):
+    """remove the plant_lineage table"""
+    bind = bind or db.engine
+    plant_lineage.drop(bind, checkfirst=True)
+    _enabled.pop(bind, None)
+
+
+class LineageCommandHandler(pluginmgr.CommandHandler):
+    """`:lineage` creates or rebuilds the plant_lineage table,
+    `:lineage=drop` removes it.
+    """
+
+    command = 'lineage'
+
+    def __call__(self, cmd, arg):
+        if arg == 'drop':
+            drop_lineage()
+        else:
+            rebuild_lineage()
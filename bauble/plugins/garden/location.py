@@ -152,20 +152,23 @@ class Location(db.Base, db.Serializable):
         except:
             return None
 
-    def top_level_count(self):
-        accessions = set(p.accession for p in self.plants)
-        species = set(a.species for a in accessions)
-        genera = set(s.genus for s in species)
-        return {(1, 'Locations'): 1,
-                (2, 'Plantings'): len(self.plants),
-                (3, 'Living plants'): sum(p.quantity for p in self.plants),
-                (4, 'Accessions'): set(a.id for a in accessions),
-                (5, 'Species'): set(s.id for s in species),
-                (6, 'Genera'): set(g.id for g in genera),
-                (7, 'Families'): set(g.family.id for g in genera),
-                (8, 'Sources'): set([a.source.source_detail.id
-                                     for a in accessions
-                                     if a.source and a.source.source_detail])}
+    @classmethod
+    def top_level_count_columns(cls):
+        from bauble.plugins.plants.genus import Genus
+        from bauble.plugins.plants.species_model import Species
+        from bauble.plugins.garden.accession import Accession
+        from bauble.plugins.garden.plant import Plant
+        from bauble.plugins.garden.source import Source
+        return ([cls.plants, Plant.accession, Accession.species,
+                 Species.genus, Accession.source],
+                [((1, 'Locations'), 'count', cls.id),
+                 ((2, 'Plantings'), 'count', Plant.id),
+                 ((3, 'Living plants'), 'sum', Plant.quantity),
+                 ((4, 'Accessions'), 'distinct', Plant.accession_id),
+                 ((5, 'Species'), 'distinct', Accession.species_id),
+                 ((6, 'Genera'), 'distinct', Species.genus_id),
+                 ((7, 'Families'), 'distinct', Genus.family_id),
+                 ((8, 'Sources'), 'distinct', Source.source_detail_id)])
 
 
 def mergevalues(value1, value2, formatter):
@@ -574,17 +574,26 @@ class Plant(db.Base, db.Serializable, db.DefiningPictures, db.WithNotes):
         except:
             return None
 
-    def top_level_count(self):
-        sd = self.accession.source and self.accession.source.source_detail
-        return {(1, 'Plantings'): 1,
-                (2, 'Accessions'): set([self.accession.id]),
-                (3, 'Species'): set([self.accession.species.id]),
-                (4, 'Genera'): set([self.accession.species.genus.id]),
-                (5, 'Families'): set([self.accession.species.genus.family.id]),
-                (6, 'Living plants'): self.quantity,
-                (7, 'Locations'): set([self.location.id]),
-                (8, 'Sources'): set(sd and [sd.id] or []),
-                }
+    @classmethod
+    def natsort_column(cls):
+        """the string plants are naturally sorted by, computed in SQL"""
+        return ([cls.accession],
+                Accession.code + cls.get_delimiter() + cls.code)
+
+    @classmethod
+    def top_level_count_columns(cls):
+        from bauble.plugins.plants.genus import Genus
+        from bauble.plugins.garden.source import Source
+        return ([cls.accession, Accession.species, Species.genus,
+                 Accession.source],
+                [((1, 'Plantings'), 'count', cls.id),
+                 ((2, 'Accessions'), 'distinct', cls.accession_id),
+                 ((3, 'Species'), 'distinct', Accession.species_id),
+                 ((4, 'Genera'), 'distinct', Species.genus_id),
+                 ((5, 'Families'), 'distinct', Genus.family_id),
+                 ((6, 'Living plants'), 'sum', cls.quantity),
+                 ((7, 'Locations'), 'distinct', cls.location_id),
+                 ((8, 'Sources'), 'distinct', Source.source_detail_id)])
 
 
 from bauble.plugins.garden.accession import Accession
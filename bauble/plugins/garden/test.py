@@ -2213,6 +2213,180 @@ class GlobalFunctionsTests(GardenTestCase):
         self.assertEquals(mergevalues(None, None, '%s|%s'), '')
 
 
+class TopLevelCountTests(GardenTestCase):
+
+    def setUp(self):
+        super(TopLevelCountTests, self).setUp()
+        contact = self.create(Contact, name=u'someone')
+        loc1 = self.create(Location, name=u'site', code=u'STE')
+        loc2 = self.create(Location, name=u'other site', code=u'OTH')
+        acc1 = self.create(Accession, species=self.species, code=u'1')
+        acc2 = self.create(Accession, species=self.sp2, code=u'2')
+        acc1.source = Source(source_detail=contact)
+        self.create(Plant, accession=acc1, location=loc1,
+                    code=u'1', quantity=2)
+        self.create(Plant, accession=acc1, location=loc2,
+                    code=u'2', quantity=3)
+        self.create(Plant, accession=acc2, location=loc2,
+                    code=u'1', quantity=0)
+        self.session.commit()
+        self.expected = {(1, 'Plantings'): 3,
+                         (2, 'Accessions'): 2,
+                         (3, 'Species'): 2,
+                         (4, 'Genera'): 1,
+                         (5, 'Families'): 1,
+                         (6, 'Living plants'): 5,
+                         (7, 'Locations'): 2,
+                         (8, 'Sources'): 1}
+
+    def test_count_plants(self):
+        ids = [i.id for i in self.session.query(Plant)]
+        result = db.count_top_level(self.session, Plant, ids)
+        self.assertEquals(result, self.expected)
+
+    def test_count_plants_in_chunks(self):
+        ids = [i.id for i in self.session.query(Plant)]
+        original = db.in_clause_chunks
+        db.in_clause_chunks = lambda ids, bind=None: ([i] for i in ids)
+        try:
+            result = db.count_top_level(self.session, Plant, ids)
+        finally:
+            db.in_clause_chunks = original
+        self.assertEquals(result, self.expected)
+
+    def test_count_plants_selected_by_statement(self):
+        ids = self.session.query(Plant.id).statement
+        result = db.count_top_level(self.session, Plant, ids)
+        self.assertEquals(result, self.expected)
+
+    def test_count_locations(self):
+        ids = [i.id for i in self.session.query(Location)]
+        result = db.count_top_level(self.session, Location, ids)
+        self.assertEquals(result, {(1, 'Locations'): 2,
+                                   (2, 'Plantings'): 3,
+                                   (3, 'Living plants'): 5,
+                                   (4, 'Accessions'): 2,
+                                   (5, 'Species'): 2,
+                                   (6, 'Genera'): 1,
+                                   (7, 'Families'): 1,
+                                   (8, 'Sources'): 1})
+
+    def test_count_family(self):
+        result = db.count_top_level(self.session, Family, [self.family.id])
+        self.assertEquals(result, {(1, 'Families'): 1,
+                                   (2, 'Genera'): 1,
+                                   (3, 'Species'): 2,
+                                   (4, 'Accessions'): 2,
+                                   (5, 'Plantings'): 3,
+                                   (6, 'Living plants'): 5,
+                                   (7, 'Locations'): 2,
+                                   (8, 'Sources'): 1})
+
+    def test_count_without_declaration(self):
+        ids = [i.id for i in self.session.query(Contact)]
+        result = db.count_top_level(self.session, Contact, ids)
+        self.assertEquals(result, {'Contact': 1})
+
+    def test_splash_stats(self):
+        from bauble.plugins.plants import splash_stats
+        old = {'naccnot': "select count(id) from accession where id not in "
+               "(select accession_id from plant where plant.quantity>0)",
+               'nlocnot': "select count(id) from location where id not in "
+               "(select location_id from plant where plant.quantity>0)",
+               'nspcnot': "select count(id) from species where id not in "
+               "(select distinct species.id from species join accession "
+               "on accession.species_id=species.id)",
+               'nfamnot': "select count(id) from family where id not in "
+               "(select distinct genus.family_id from genus "
+               "join species on species.genus_id=genus.id "
+               "join accession on accession.species_id=species.id)",
+               'naccuse': "select count(distinct accession.id) "
+               "from accession join plant on plant.accession_id=accession.id "
+               "where plant.quantity>0"}
+        values = splash_stats(self.session)
+        self.assertEquals(len(values), 18)
+        for name, query in old.items():
+            self.assertEquals(values[name],
+                              self.session.execute(query).scalar())
+        self.assertEquals(values['nplttot'], 3)
+        self.assertEquals(values['npltuse'], 2)
+
+    def test_count_cancelled(self):
+        ids = [i.id for i in self.session.query(Plant)]
+        result = db.count_top_level(self.session, Plant, ids,
+                                    is_cancelled=lambda: True)
+        self.assertEquals(result, None)
+
+
+class LineageTests(GardenTestCase):
+
+    def setUp(self):
+        super(LineageTests, self).setUp()
+        self.location = self.create(Location, name=u'site', code=u'STE')
+        self.accession = self.create(Accession, species=self.species,
+                                     code=u'1')
+        self.plant = self.create(Plant, accession=self.accession,
+                                 location=self.location, code=u'1',
+                                 quantity=1)
+        self.session.commit()
+
+    def lineage(self):
+        from bauble.plugins.garden.lineage import plant_lineage
+        return [tuple(r) for r in db.engine.execute(
+            plant_lineage.select().order_by(plant_lineage.c.plant_id))]
+
+    def expected(self):
+        return [(self.plant.id, self.accession.id, self.accession.species.id,
+                 self.accession.species.genus.id,
+                 self.accession.species.genus.family.id, self.location.id)]
+
+    def test_kept_in_sync(self):
+        self.assertEquals(self.lineage(), self.expected())
+        self.accession.species = self.sp2
+        self.session.commit()
+        self.assertEquals(self.lineage(), self.expected())
+        self.genus.family = Family(family=u'Araceae')
+        self.session.commit()
+        self.assertEquals(self.lineage(), self.expected())
+        self.session.delete(self.plant)
+        self.session.commit()
+        self.assertEquals(self.lineage(), [])
+
+    def test_rebuild(self):
+        from bauble.plugins.garden.lineage import plant_lineage, \
+            rebuild_lineage
+        db.engine.execute(plant_lineage.delete())
+        rebuild_lineage()
+        self.assertEquals(self.lineage(), self.expected())
+
+    def test_csv_export_and_import(self):
+        "the lineage is not exported, the import rebuilds it"
+        import os
+        import shutil
+        import tempfile
+        from bauble.plugins.garden.lineage import plant_lineage
+        from bauble.plugins.imex.csv_ import CSVImporter, CSVExporter
+        expected = self.expected()
+        self.session.close()
+        tempdir = tempfile.mkdtemp()
+        try:
+            CSVExporter().start(tempdir)
+            filenames = os.listdir(tempdir)
+            self.assertFalse('plant_lineage.txt' in filenames)
+            db.engine.execute(plant_lineage.delete())
+            CSVImporter().start([os.path.join(tempdir, name)
+                                 for name in filenames], force=True)
+        finally:
+            shutil.rmtree(tempdir)
+        self.assertEquals(self.lineage(), expected)
+
+    def test_report_uses_lineage(self):
+        from bauble.plugins.report import get_plant_query
+        q = get_plant_query(self.family, self.session)
+        self.assertTrue('plant_lineage' in str(q.statement))
+        self.assertEquals(q.all(), [self.plant])
+
+
 class ContactTests(GardenTestCase):
 
     def __init__(self, *args):
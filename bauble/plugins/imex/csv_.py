@@ -443,6 +443,7 @@ class CSVImporter(Importer):
                 def do_insert():
                     if values:
                         connection.execute(insert, *values)
+                        db.bump_generation()
                     del values[:]
                     percent = float(steps_so_far)/float(total_lines)
                     if 0 < percent < 1.0:
@@ -542,6 +543,12 @@ class CSVImporter(Importer):
                                          traceback.format_exc(),
                                          type=gtk.MESSAGE_ERROR)
 
+        # the tables derived from the others, like plant_lineage, are
+        # filled again from what was imported
+        for table in metadata.sorted_tables:
+            if 'rebuild' in table.info and table.exists(bind=metadata.bind):
+                table.info['rebuild'](metadata.bind)
+
 # TODO: we don't use the progress dialog any more but we'll leave this
 # around to remind us when we support cancelling via the progress statusbar
 #
@@ -619,7 +626,10 @@ class CSVExporter(object):
 #        timeout = tasklet.WaitForTimeout(12)
         steps_so_far = 0
         ntables = 0
-        for table in db.metadata.sorted_tables:
+        # the tables derived from the others are rebuilt on import
+        tables = [table for table in db.metadata.sorted_tables
+                  if 'rebuild' not in table.info]
+        for table in tables:
             ntables += 1
             filename = filename_template % table.name
             if os.path.exists(filename):
@@ -643,7 +653,7 @@ class CSVExporter(object):
             f.close()
 
         update_every = 30
-        for table in db.metadata.sorted_tables:
+        for table in tables:
             filename = filename_template % table.name
             steps_so_far += 1
             fraction = float(steps_so_far)/float(ntables)
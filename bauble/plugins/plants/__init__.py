@@ -75,21 +75,111 @@ from bauble.i18n import _
 ## naming locally unused objects. will be imported by clients of the module
 Familia, SpeciesDistribution,
 
-from threading import Thread
+from threading import Thread, Lock
 from gobject import idle_add
 
 
-class LabelUpdater(Thread):
-    def __init__(self, widget, query, *args, **kwargs):
-        super(LabelUpdater, self).__init__(*args, **kwargs)
-        self.query = query
-        self.widget = widget
+# the counts shown in the splash screen, by name of their label, as
+# scalar subqueries of one statement.  the garden ones need the tables
+# of the GardenPlugin.
+splash_counts = [
+    ('nfamtot', 'select count(*) from family'),
+    ('ngentot', 'select count(*) from genus'),
+    ('nspctot', 'select count(*) from species'),
+    ('nfamuse', 'select count(distinct genus.family_id) from genus '
+     'join species on species.genus_id=genus.id '
+     'join accession on accession.species_id=species.id'),
+    ('ngenuse', 'select count(distinct species.genus_id) from species '
+     'join accession on accession.species_id=species.id'),
+    ('nspcuse', 'select count(distinct species_id) from accession'),
+    ]
+garden_splash_counts = [
+    ('nplttot', 'select count(*) from plant'),
+    ('npltuse', 'select count(*) from plant where quantity>0'),
+    ('npltnot', 'select count(*) from plant where quantity=0'),
+    ('nacctot', 'select count(*) from accession'),
+    ('naccuse', 'select count(distinct accession_id) from plant '
+     'where quantity>0'),
+    ('nloctot', 'select count(*) from location'),
+    ('nlocuse', 'select count(distinct location_id) from plant '
+     'where quantity>0'),
+    ]
+# the unused ones are the total minus the used ones, rather than a
+# `not in (select ...)`
+splash_differences = [
+    ('nfamnot', 'nfamtot', 'nfamuse'),
+    ('ngennot', 'ngentot', 'ngenuse'),
+    ('nspcnot', 'nspctot', 'nspcuse'),
+    ('naccnot', 'nacctot', 'naccuse'),
+    ('nlocnot', 'nloctot', 'nlocuse'),
+    ]
+
+# the latest splash statistics and the db.generation they reflect
+_splash_cache = {'generation': None, 'values': None}
+
+
+def splash_stats(connection, garden=True):
+    """return the splash screen statistics, as a dictionary by label
+    name, computed in a single statement
+    """
+    counts = splash_counts + (garden and garden_splash_counts or [])
+    row = connection.execute('select %s' % ', '.join(
+        '(%s)' % query for name, query in counts)).first()
+    result = dict(zip([name for name, query in counts], row))
+    for name, total, used in splash_differences:
+        if total in result:
+            result[name] = result[total] - result[used]
+    return result
+
+
+def cached_splash_stats():
+    """return the cached splash statistics and whether they are still
+    current, see db.generation
+    """
+    return (_splash_cache['values'],
+            _splash_cache['generation'] == db.generation)
+
+
+class SplashStatsUpdater(Thread):
+    """compute the splash statistics, store them in the cache and pass
+    them to callback, in the gui thread.
+
+    a cancelled updater interrupts its statement, and invokes nothing.
+    """
+    def __init__(self, callback, garden=True, *args, **kwargs):
+        super(SplashStatsUpdater, self).__init__(*args, **kwargs)
+        self.daemon = True
+        self.callback = callback
+        self.garden = garden
+        self.__cancel = False
+        self.__lock = Lock()
+        self.__connection = None
+
+    def cancel(self):
+        with self.__lock:
+            self.__cancel = True
+            if self.__connection is not None:
+                db.cancel_statement(self.__connection)
 
     def run(self):
+        generation = db.generation
         ssn = db.Session()
-        value, = ssn.execute(self.query).first()
-        idle_add(lambda x: self.widget.set_text(str(x)), value)
-        ssn.close()
+        try:
+            with self.__lock:
+                if self.__cancel:
+                    return
+                self.__connection = ssn.connection().connection
+            values = splash_stats(ssn, self.garden)
+        except Exception, e:
+            logger.debug('SplashStatsUpdater: %s' % utils.utf8(e))
+            return
+        finally:
+            with self.__lock:
+                self.__connection = None
+            ssn.close()
+        _splash_cache.update(generation=generation, values=values)
+        if not self.__cancel:
+            idle_add(self.callback, values)
 
 
 class SplashInfoBox(pluginmgr.View):
@@ -186,6 +276,7 @@ class SplashInfoBox(pluginmgr.View):
         wname = "splash_stqr_button"
         widget = getattr(self.widgets, wname)
         widget.connect('clicked', self.on_splash_stqr_button_clicked)
+        self.stats_updater = None
 
     def update(self):
         '''
@@ -214,95 +305,21 @@ class SplashInfoBox(pluginmgr.View):
 
         self.name_tooltip_query = name_tooltip_query
 
-        # LabelUpdater objects **can** run in a thread.
-        if 'GardenPlugin' in pluginmgr.plugins:
-            self.start_thread(
-                LabelUpdater(self.widgets.splash_nplttot,
-                             "select count(*) from plant"))
-            self.start_thread(
-                LabelUpdater(self.widgets.splash_npltuse,
-                             "select count(*) from plant where quantity>0"))
-            self.start_thread(
-                LabelUpdater(self.widgets.splash_npltnot,
-                             "select count(*) from plant where quantity=0"))
-            self.start_thread(
-                LabelUpdater(self.widgets.splash_nacctot,
-                             "select count(*) from accession"))
-            self.start_thread(
-                LabelUpdater(self.widgets.splash_naccuse,
-                             "select count(distinct accession.id) "
-                             "from accession "
-                             "join plant on plant.accession_id=accession.id "
-                             "where plant.quantity>0"))
-            self.start_thread(
-                LabelUpdater(self.widgets.splash_naccnot,
-                             "select count(id) "
-                             "from accession "
-                             "where id not in "
-                             "(select accession_id from plant "
-                             " where plant.quantity>0)"))
-            self.start_thread(
-                LabelUpdater(self.widgets.splash_nloctot,
-                             "select count(*) from location"))
-            self.start_thread(
-                LabelUpdater(self.widgets.splash_nlocuse,
-                             "select count(distinct location.id) "
-                             "from location "
-                             "join plant on plant.location_id=location.id "
-                             "where plant.quantity>0"))
-            self.start_thread(
-                LabelUpdater(self.widgets.splash_nlocnot,
-                             "select count(id) "
-                             "from location "
-                             "where id not in "
-                             "(select location_id from plant "
-                             " where plant.quantity>0)"))
-
-        self.start_thread(
-            LabelUpdater(self.widgets.splash_nspcuse,
-                         "select count(distinct species.id) "
-                         "from species join accession "
-                         "on accession.species_id=species.id"))
-        self.start_thread(
-            LabelUpdater(self.widgets.splash_ngenuse,
-                         "select count(distinct species.genus_id) "
-                         "from species join accession "
-                         "on accession.species_id=species.id"))
-        self.start_thread(
-            LabelUpdater(self.widgets.splash_nfamuse,
-                         "select count(distinct genus.family_id) from genus "
-                         "join species on species.genus_id=genus.id "
-                         "join accession on accession.species_id=species.id "))
-        self.start_thread(
-            LabelUpdater(self.widgets.splash_nspctot,
-                         "select count(*) from species"))
-        self.start_thread(
-            LabelUpdater(self.widgets.splash_ngentot,
-                         "select count(*) from genus"))
-        self.start_thread(
-            LabelUpdater(self.widgets.splash_nfamtot,
-                         "select count(*) from family"))
-        self.start_thread(
-            LabelUpdater(self.widgets.splash_nspcnot,
-                         "select count(id) from species "
-                         "where id not in "
-                         "(select distinct species.id "
-                         " from species join accession "
-                         " on accession.species_id=species.id)"))
-        self.start_thread(
-            LabelUpdater(self.widgets.splash_ngennot,
-                         "select count(id) from genus "
-                         "where id not in "
-                         "(select distinct species.genus_id "
-                         " from species join accession "
-                         " on accession.species_id=species.id)"))
-        self.start_thread(
-            LabelUpdater(self.widgets.splash_nfamnot,
-                         "select count(id) from family "
-                         "where id not in "
-                         "(select distinct genus.family_id from genus "
-                         "join species on species.genus_id=genus.id "
-                         "join accession on accession.species_id=species.id)"))
+        # show what we have, then refresh it in the background, with
+        # at most one updater running
+        values, current = cached_splash_stats()
+        if values is not None:
+            self.show_stats(values)
+        if not current and not (self.stats_updater and
+                                self.stats_updater.is_alive()):
+            self.stats_updater = self.start_thread(SplashStatsUpdater(
+                self.show_stats, 'GardenPlugin' in pluginmgr.plugins))
+
+    def show_stats(self, values):
+        """set the splash labels from the statistics in values"""
+        for name, value in values.items():
+            getattr(self.widgets, 'splash_' + name).set_text(str(value))
+        return False
 
     def on_sqb_clicked(self, btn_no, *args):
         try:
@@ -328,32 +345,42 @@ class PlantsPlugin(pluginmgr.Plugin):
 
         mapper_search = search.get_strategy('MapperSearch')
 
+        from functools import partial
         mapper_search.add_meta(('family', 'fam'), Family, ['family'])
-        SearchView.row_meta[Family].set(children="genera",
-                                        infobox=FamilyInfoBox,
-                                        context_menu=family_context_menu)
+        SearchView.row_meta[Family].set(
+            children="genera",
+            children_loader=partial(db.natsort_children, 'genera'),
+            infobox=FamilyInfoBox,
+            context_menu=family_context_menu)
 
         mapper_search.add_meta(('genus', 'gen'), Genus, ['genus'])
-        SearchView.row_meta[Genus].set(children="species",
-                                       infobox=GenusInfoBox,
-                                       context_menu=genus_context_menu)
+        SearchView.row_meta[Genus].set(
+            children="species",
+            children_loader=partial(db.natsort_children, 'species'),
+            infobox=GenusInfoBox,
+            context_menu=genus_context_menu,
+            prefetch=['family'])
 
-        from functools import partial
         search.add_strategy(SynonymSearch)
         mapper_search.add_meta(('species', 'sp'), Species,
                                ['sp', 'sp2', 'infrasp1', 'infrasp2',
                                 'infrasp3', 'infrasp4'])
         SearchView.row_meta[Species].set(
             children=partial(db.natsort, 'accessions'),
+            children_loader=partial(db.natsort_children, 'accessions'),
             infobox=SpeciesInfoBox,
-            context_menu=species_context_menu)
+            context_menu=species_context_menu,
+            prefetch=['genus.family', 'vernacular_names'])
 
         mapper_search.add_meta(('vernacular', 'vern', 'common'),
                                VernacularName, ['name'])
         SearchView.row_meta[VernacularName].set(
             children=partial(db.natsort, 'species.accessions'),
+            children_loader=partial(db.natsort_children,
+                                    'species.accessions'),
             infobox=VernacularNameInfoBox,
-            context_menu=vernname_context_menu)
+            context_menu=vernname_context_menu,
+            prefetch=['species.genus'])
 
         mapper_search.add_meta(('geography', 'geo'), Geography, ['name'])
         SearchView.row_meta[Geography].set(children=get_species_in_geography)
@@ -259,21 +259,23 @@ class Family(db.Base, db.Serializable, db.WithNotes):
                 keys[internal] = keys[exchange]
                 del keys[exchange]
 
-    def top_level_count(self):
-        genera = set(g for g in self.genera if g.species)
-        species = [s for g in genera for s in g.species]
-        accessions = [a for s in species for a in s.accessions]
-        plants = [p for a in accessions for p in a.plants]
-        return {(1, 'Families'): set([self.id]),
-                (2, 'Genera'): genera,
-                (3, 'Species'): set(species),
-                (4, 'Accessions'): len(accessions),
-                (5, 'Plantings'): len(plants),
-                (6, 'Living plants'): sum(p.quantity for p in plants),
-                (7, 'Locations'): set(p.location.id for p in plants),
-                (8, 'Sources'): set([a.source.source_detail.id
-                                     for a in accessions
-                                     if a.source and a.source.source_detail])}
+    @classmethod
+    def top_level_count_columns(cls):
+        from bauble.plugins.plants.genus import Genus
+        from bauble.plugins.plants.species_model import Species
+        from bauble.plugins.garden.accession import Accession
+        from bauble.plugins.garden.plant import Plant
+        from bauble.plugins.garden.source import Source
+        return ([cls.genera, Genus.species, Species.accessions,
+                 Accession.plants, Accession.source],
+                [((1, 'Families'), 'count', cls.id),
+                 ((2, 'Genera'), 'count', Species.genus_id),
+                 ((3, 'Species'), 'count', Species.id),
+                 ((4, 'Accessions'), 'count', Accession.id),
+                 ((5, 'Plantings'), 'count', Plant.id),
+                 ((6, 'Living plants'), 'sum', Plant.quantity),
+                 ((7, 'Locations'), 'distinct', Plant.location_id),
+                 ((8, 'Sources'), 'distinct', Source.source_detail_id)])
 
 
 ## defining the latin alias to the class.
@@ -264,6 +264,13 @@ class Genus(db.Base, db.Serializable, db.WithNotes):
     def __repr__(self):
         return Genus.str(self)
 
+    @classmethod
+    def natsort_column(cls):
+        """the string genera are naturally sorted by, computed in SQL"""
+        from sqlalchemy import literal
+        return ([], cls.genus + func.coalesce(
+            literal(u' ') + func.nullif(cls.qualifier, u''), u''))
+
     @staticmethod
     def str(genus, author=False):
         # TODO: the genus should be italicized for markup
@@ -333,19 +340,22 @@ class Genus(db.Base, db.Serializable, db.WithNotes):
             raise error.NoResultException()
         return result
 
-    def top_level_count(self):
-        accessions = [a for s in self.species for a in s.accessions]
-        plants = [p for a in accessions for p in a.plants]
-        return {(1, 'Genera'): set([self.id]),
-                (2, 'Families'): set([self.family.id]),
-                (3, 'Species'): len(self.species),
-                (4, 'Accessions'): len(accessions),
-                (5, 'Plantings'): len(plants),
-                (6, 'Living plants'): sum(p.quantity for p in plants),
-                (7, 'Locations'): set(p.location.id for p in plants),
-                (8, 'Sources'): set([a.source.source_detail.id
-                                     for a in accessions
-                                     if a.source and a.source.source_detail])}
+    @classmethod
+    def top_level_count_columns(cls):
+        from bauble.plugins.plants.species_model import Species
+        from bauble.plugins.garden.accession import Accession
+        from bauble.plugins.garden.plant import Plant
+        from bauble.plugins.garden.source import Source
+        return ([cls.species, Species.accessions,
+                 Accession.plants, Accession.source],
+                [((1, 'Genera'), 'count', cls.id),
+                 ((2, 'Families'), 'distinct', cls.family_id),
+                 ((3, 'Species'), 'count', Species.id),
+                 ((4, 'Accessions'), 'count', Accession.id),
+                 ((5, 'Plantings'), 'count', Plant.id),
+                 ((6, 'Living plants'), 'sum', Plant.quantity),
+                 ((7, 'Locations'), 'distinct', Plant.location_id),
+                 ((8, 'Sources'), 'distinct', Source.source_detail_id)])
 
 
 class GenusNote(db.Base):
@@ -30,6 +30,35 @@ from sqlalchemy.orm import object_session, relation, backref
 import bauble.db as db
 
 
+def geography_descendants(geo_id, bind=None):
+    """
+    Return the ids of geo_id and of all the geographies below it.
+
+    The result is a select statement built on a recursive common table
+    expression, to be used in an IN clause, so that the whole
+    hierarchy is walked by the database in the same query.  SQLite
+    older than 3.8.3 has no WITH RECURSIVE, the result is then the list
+    of ids, computed with one query per level of the hierarchy.
+    """
+    bind = bind or db.engine
+    geo_table = Geography.__table__
+    import sqlite3
+    if bind.name == 'sqlite' and sqlite3.sqlite_version_info < (3, 8, 3):
+        ids = level = [geo_id]
+        while level:
+            stmt = select([geo_table.c.id], geo_table.c.parent_id.in_(level))
+            level = [r[0] for r in bind.execute(stmt).fetchall()]
+            ids = ids + level
+        return ids
+    tree = select([geo_table.c.id]).where(
+        geo_table.c.id == geo_id).cte('geography_tree', recursive=True)
+    parent = tree.alias('parent')
+    child = geo_table.alias('child')
+    tree = tree.union_all(
+        select([child.c.id]).where(child.c.parent_id == parent.c.id))
+    return select([tree.c.id])
+
+
 def get_species_in_geography(geo):
     """
     Return all the Species that have distribution in geo
@@ -38,48 +67,46 @@ def get_species_in_geography(geo):
     if not session:
         ValueError('get_species_in_geography(): geography is not in a session')
 
-    # get all the geography children under geo
     from bauble.plugins.plants.species_model import SpeciesDistribution, \
         Species
-    # get the children of geo
-    geo_table = geo.__table__
-    master_ids = set([geo.id])
-    # populate master_ids with all the geography ids that represent
-    # the children of particular geography id
-
-    def get_geography_children(parent_id):
-        stmt = select([geo_table.c.id], geo_table.c.parent_id == parent_id)
-        kids = [r[0] for r in db.engine.execute(stmt).fetchall()]
-        for kid in kids:
-            grand_kids = get_geography_children(kid)
-            master_ids.update(grand_kids)
-        return kids
-    geokids = get_geography_children(geo.id)
-    master_ids.update(geokids)
+    # the distribution may be at any level below geo
+    ids = geography_descendants(geo.id, session.bind)
     q = session.query(Species).join(SpeciesDistribution).\
-        filter(SpeciesDistribution.geography_id.in_(master_ids))
+        filter(SpeciesDistribution.geography_id.in_(ids))
     return list(q)
 
 
-class GeographyMenu(gtk.Menu):
+_geography_tree = {}
 
-    def __init__(self, callback):
-        super(GeographyMenu, self).__init__()
+
+def geography_tree():
+    """
+    Return the geography hierarchy as a dictionary, associating the id
+    of each geography (None for the top level) to the list of (id, name)
+    pairs of its children, sorted by name.
+
+    The tree is read in one query, and kept until the database changes,
+    see bauble.db.generation.
+    """
+    if _geography_tree.get('generation') != db.generation:
         geography_table = Geography.__table__
         geos = select([geography_table.c.id, geography_table.c.name,
                        geography_table.c.parent_id]).execute().fetchall()
         geos_hash = {}
-        # TODO: i think the geo_hash should be calculated in an idle
-        # function so that starting the editor isn't delayed while the
-        # hash is being built
         for geo_id, name, parent_id in geos:
-            try:
-                geos_hash[parent_id].append((geo_id, name))
-            except KeyError:
-                geos_hash[parent_id] = [(geo_id, name)]
-
+            geos_hash.setdefault(parent_id, []).append((geo_id, name))
         for kids in geos_hash.values():
             kids.sort(key=itemgetter(1))  # sort by name
+        _geography_tree.clear()
+        _geography_tree.update(generation=db.generation, tree=geos_hash)
+    return _geography_tree['tree']
+
+
+class GeographyMenu(gtk.Menu):
+
+    def __init__(self, callback):
+        super(GeographyMenu, self).__init__()
+        geos_hash = geography_tree()
 
         def get_kids(pid):
             try:
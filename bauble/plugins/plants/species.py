@@ -133,6 +133,8 @@ class SynonymSearch(search.SearchStrategy):
     bauble.search.return_synonyms in the prefs toggles this.
     """
     return_synonyms_pref = 'bauble.search.return_synonyms'
+    expands = 'MapperSearch'
+    result_prefs = (return_synonyms_pref, )
 
     def __init__(self):
         super(SynonymSearch, self).__init__()
@@ -141,32 +143,62 @@ class SynonymSearch(search.SearchStrategy):
             prefs.save()
 
     def search(self, text, session):
-        from genus import Genus, GenusSynonym
         super(SynonymSearch, self).search(text, session)
         if not prefs[self.return_synonyms_pref]:
             return []
         mapper_search = search.get_strategy('MapperSearch')
-        r1 = mapper_search.search(text, session)
-        if not r1:
+        return self.expand(mapper_search.search(text, session), session)
+
+    def expand(self, results, session):
+        """return the accepted names of the synonyms in results
+
+        for all objects considered synonym of something else, include
+        that something else.  one query per synonym table, whatever the
+        size of results.
+        """
+        from genus import Genus, GenusSynonym
+        if not prefs[self.return_synonyms_pref] or not results:
             return []
-        results = []
-        for result in r1:
-            # iterate through the results and for all objects considered
-            # synonym of something else, include that something else. that
-            # is, the accepted name.
+        species_ids = set()
+        genus_ids = set()
+        for result in results:
             if isinstance(result, Species):
-                q = session.query(SpeciesSynonym).\
-                    filter_by(synonym_id=result.id)
-                results.extend([syn.species for syn in q])
+                species_ids.add(result.id)
             elif isinstance(result, Genus):
-                q = session.query(GenusSynonym).\
-                    filter_by(synonym_id=result.id)
-                results.extend([syn.genus for syn in q])
-            elif isinstance(results, VernacularName):
-                q = session.query(SpeciesSynonym).\
-                    filter_by(synonym_id=result.species.id)
-                results.extend([syn.species for syn in q])
-        return results
+                genus_ids.add(result.id)
+            elif isinstance(result, VernacularName):
+                species_ids.add(result.species_id)
+        accepted = []
+        for cls, synonym_cls, key, ids in [
+                (Species, SpeciesSynonym, 'species_id', species_ids),
+                (Genus, GenusSynonym, 'genus_id', genus_ids)]:
+            for chunk in db.in_clause_chunks(ids, session.bind):
+                q = session.query(cls).join(
+                    synonym_cls, getattr(synonym_cls, key) == cls.id).\
+                    filter(synonym_cls.synonym_id.in_(chunk))
+                accepted.extend(q)
+        return accepted
+
+    def expand_query(self, query, session):
+        """like expand, without loading the results of query
+
+        the synonym ids are selected by a subquery.
+        """
+        from genus import Genus, GenusSynonym
+        if not prefs[self.return_synonyms_pref]:
+            return []
+        cls = query.column_descriptions[0]['type']
+        if cls is VernacularName:
+            cls, ids = Species, query.with_entities(VernacularName.species_id)
+        elif cls in (Species, Genus):
+            ids = query.with_entities(cls.id)
+        else:
+            return []
+        synonym_cls, key = {Species: (SpeciesSynonym, 'species_id'),
+                            Genus: (GenusSynonym, 'genus_id')}[cls]
+        return session.query(cls).join(
+            synonym_cls, getattr(synonym_cls, key) == cls.id).filter(
+            synonym_cls.synonym_id.in_(ids.order_by(None).statement)).all()
 
 
 #
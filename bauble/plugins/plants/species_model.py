@@ -619,18 +619,68 @@ class Species(db.Base, db.Serializable, db.DefiningPictures, db.WithNotes):
             raise error.NoResultException()
         return result
 
-    def top_level_count(self):
-        plants = [p for a in self.accessions for p in a.plants]
-        return {(1, 'Species'): 1,
-                (2, 'Genera'): set([self.genus.id]),
-                (3, 'Families'): set([self.genus.family.id]),
-                (4, 'Accessions'): len(self.accessions),
-                (5, 'Plantings'): len(plants),
-                (6, 'Living plants'): sum(p.quantity for p in plants),
-                (7, 'Locations'): set(p.location.id for p in plants),
-                (8, 'Sources'): set([a.source.source_detail.id
-                                     for a in self.accessions
-                                     if a.source and a.source.source_detail])}
+    @classmethod
+    def natsort_column(cls):
+        """the string species are naturally sorted by, computed in SQL
+
+        the same `str()` produces, with its default arguments: genus and
+        qualifier, hybrid marker and zero width space, epithet,
+        infraspecific parts, cv group where `str()` places it, and
+        qualification.
+        """
+        from genus import Genus
+        from sqlalchemy import and_, case, literal, not_, or_
+
+        def part(column, prefix=u' ', suffix=u''):
+            return func.coalesce(
+                literal(prefix) + func.nullif(column, u'') + suffix, u'')
+
+        def group(msgid):
+            # the cv group, as in the translated msgid
+            prefix, suffix = utils.utf8(_(msgid)).split(u'%(group)s')
+            return part(cls.cv_group, u' ' + prefix, suffix)
+
+        column = Genus.genus + part(Genus.qualifier) + \
+            case([(cls.hybrid, u' ' + cls.hybrid_char)], else_=u'') + \
+            part(cls.sp, u' \u200b')
+        cultivars = []
+        for i in range(1, 5):
+            rank = getattr(cls, 'infrasp%d_rank' % i)
+            epithet = getattr(cls, 'infrasp%d' % i)
+            cultivar = and_(rank == u'cv.',
+                            func.nullif(epithet, u'').isnot(None))
+            first = and_(cultivar, not_(or_(*cultivars))) if cultivars \
+                else cultivar
+            column = column + case(
+                [(first, group("(%(group)s Group)") +
+                  part(epithet, u" '", u"'")),
+                 (cultivar, part(epithet, u" '", u"'"))],
+                else_=part(rank) + part(epithet))
+            cultivars.append(cultivar)
+        column = column + case([(or_(*cultivars), u'')],
+                               else_=group("%(group)s Group")) + \
+            part(cls.sp_qual)
+        column = case([(cls.hybrid, func.replace(
+            column, cls.hybrid_char + u' ', cls.hybrid_char))],
+            else_=column)
+        return [cls.genus], column
+
+    @classmethod
+    def top_level_count_columns(cls):
+        from genus import Genus
+        from bauble.plugins.garden.accession import Accession
+        from bauble.plugins.garden.plant import Plant
+        from bauble.plugins.garden.source import Source
+        return ([cls.genus, cls.accessions,
+                 Accession.plants, Accession.source],
+                [((1, 'Species'), 'count', cls.id),
+                 ((2, 'Genera'), 'distinct', cls.genus_id),
+                 ((3, 'Families'), 'distinct', Genus.family_id),
+                 ((4, 'Accessions'), 'count', Accession.id),
+                 ((5, 'Plantings'), 'count', Plant.id),
+                 ((6, 'Living plants'), 'sum', Plant.quantity),
+                 ((7, 'Locations'), 'distinct', Plant.location_id),
+                 ((8, 'Sources'), 'distinct', Source.source_detail_id)])
 
 
 class SpeciesNote(db.Base, db.Serializable):
@@ -744,6 +794,11 @@ class VernacularName(db.Base, db.Serializable):
         'user wants the species, not just the name'
         return self.species
 
+    @classmethod
+    def replacement_column(cls):
+        'value searches select the species, not just the name'
+        return Species, cls.species_id
+
     def as_dict(self):
         result = db.Serializable.as_dict(self)
         result['species'] = self.species.str(self.species, remove_zws=True)
@@ -796,6 +796,29 @@ class SpeciesTests(PlantTestCase):
             spstr = get_sp_str(sid, markup=True, authors=True)
             self.assertEquals(remove_zws(spstr), expect)
 
+    def test_natsort_strings_computed_in_sql(self):
+        from sqlalchemy import event
+        # all test species, their genera have the default empty qualifier
+        species = self.session.query(Species).all()
+        self.assertEquals(set(i.genus.qualifier for i in species),
+                          set([u'']))
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            strings = db.natsort_strings(species)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEquals(len(statements), 1)
+        self.assertEquals(strings, [i.str().encode('utf-8')
+                                    for i in species])
+        self.assertEquals(
+            db.natsorted(species),
+            sorted(species, key=lambda i: utils.natsort_keys(
+                [i.str().encode('utf-8')])[0]))
+
     def test_lexicographic_order__unspecified_precedes_specified(self):
         def get_sp_str(id, **kwargs):
             return self.session.query(Species).get(id).str(**kwargs)
@@ -1103,6 +1126,33 @@ class GeographyTests(PlantTestCase):
         species = get_species_in_geography(north_america)
         self.assert_([s.id for s in species] == [sp1.id, sp2.id, sp3.id])
 
+    def test_get_species_in_one_statement(self):
+        from sqlalchemy import event
+        sp1 = Species(genus=self.genus, sp=u'sp1')
+        sp1.distribution.append(SpeciesDistribution(geography_id=665))
+        self.session.commit()
+        north_america = self.session.query(Geography).get(7)
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            species = get_species_in_geography(north_america)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEquals([s.id for s in species], [sp1.id])
+        self.assertEquals(len(statements), 1)
+
+    def test_geography_tree_follows_generation(self):
+        from bauble.plugins.plants.geography import geography_tree
+        tree = geography_tree()
+        self.assertEquals([name for id, name in tree[53]],
+                          sorted(name for id, name in tree[53]))
+        self.assertTrue(geography_tree() is tree)
+        db.bump_generation()
+        self.assertFalse(geography_tree() is tree)
+
     def test_species_distribution_str(self):
         # create a some species
         sp1 = Species(genus=self.genus, sp=u'sp1')
@@ -1827,13 +1877,16 @@ import bauble.search
 class BaubleSearchSearchTest(BaubleTestCase):
     def test_search_search_uses_Synonym_Search(self):
         bauble.search.search("genus like %", self.session)
-        self.assertTrue('SearchStrategy "genus like %"(SynonymSearch)' in 
+        self.assertTrue('SearchStrategy "genus like %"(SynonymSearch) '
+                        'expands MapperSearch' in
                    self.handler.messages['bauble.search']['debug'])
         self.handler.reset()
         bauble.search.search("12.11.13", self.session)
-        self.assertTrue('SearchStrategy "12.11.13"(SynonymSearch)' in 
+        self.assertTrue('SearchStrategy "12.11.13"(SynonymSearch) '
+                        'expands MapperSearch' in
                    self.handler.messages['bauble.search']['debug'])
         self.handler.reset()
         bauble.search.search("So ha", self.session)
-        self.assertTrue('SearchStrategy "So ha"(SynonymSearch)' in 
+        self.assertTrue('SearchStrategy "So ha"(SynonymSearch) '
+                        'expands MapperSearch' in
                    self.handler.messages['bauble.search']['debug'])
@@ -43,6 +43,7 @@ from bauble.prefs import prefs
 import bauble.pluginmgr as pluginmgr
 from bauble.plugins.plants import Family, Genus, Species, VernacularName
 from bauble.plugins.garden import Accession, Plant, Location
+from bauble.plugins.garden.lineage import plant_lineage, lineage_enabled
 from bauble.plugins.tag import Tag
 
 # TODO: this module should depend on PlantPlugin, GardenPlugin,
@@ -92,7 +93,13 @@ def get_plant_query(obj, session):
     # so that if we want to union() the statements together later it
     # will work properly
     q = session.query(Plant).order_by(None)
-    if isinstance(obj, Family):
+    if isinstance(obj, (Family, Genus, Species)) and \
+            lineage_enabled(session.bind):
+        # a single join, instead of walking the taxonomy
+        column = plant_lineage.c['%s_id' % obj.__tablename__]
+        return q.join(plant_lineage, plant_lineage.c.plant_id == Plant.id).\
+            filter(column == obj.id)
+    elif isinstance(obj, Family):
         return q.join('accession', 'species', 'genus', 'family').\
             filter_by(id=obj.id)
     elif isinstance(obj, Genus):
@@ -557,8 +557,8 @@ class XSLFormatterPlugin(FormatterPlugin):
         # passing to create_abcd
         adapted = []
         if source_type == plant_source_type:
-            plants = sorted(get_plants_pertinent_to(objs, session=session),
-                            key=utils.natsort_key)
+            plants = db.natsorted(
+                get_plants_pertinent_to(objs, session=session))
             if len(plants) == 0:
                 utils.message_dialog(_('There are no plants in the search '
                                        'results.  Please try another search.'))
@@ -569,8 +569,8 @@ class XSLFormatterPlugin(FormatterPlugin):
                 elif not p.accession.private:
                     adapted.append(PlantABCDAdapter(p, for_labels=True))
         elif source_type == species_source_type:
-            species = sorted(get_species_pertinent_to(objs, session=session),
-                             key=utils.natsort_key)
+            species = db.natsorted(
+                get_species_pertinent_to(objs, session=session))
             if len(species) == 0:
                 utils.message_dialog(_('There are no species in the search '
                                        'results.  Please try another search.'))
@@ -578,9 +578,8 @@ class XSLFormatterPlugin(FormatterPlugin):
             for s in species:
                 adapted.append(SpeciesABCDAdapter(s, for_labels=True))
         elif source_type == accession_source_type:
-            accessions = sorted(get_accessions_pertinent_to(objs,
-                                                            session=session),
-                                key=utils.natsort_key)
+            accessions = db.natsorted(
+                get_accessions_pertinent_to(objs, session=session))
             if len(accessions) == 0:
                 utils.message_dialog(_('There are no accessions in the search '
                                        'results.  Please try another search.'))
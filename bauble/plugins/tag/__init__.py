@@ -300,10 +300,8 @@ class Tag(db.Base):
         if self.__my_own_timestamp is not None:
             # should I update my list?
             session = object_session(self)
-            last_history = session.query(db.History)\
-                .order_by(db.History.timestamp.desc())\
-                .limit(1).one()
-            if last_history.timestamp > self.__my_own_timestamp:
+            if db.history_query(
+                    session, since=self.__my_own_timestamp).first():
                 self.__last_objects = None
         if self.__last_objects is None:
             # here I update my list
@@ -326,8 +324,16 @@ class Tag(db.Base):
         """
         session = object_session(self)
 
-        r = [session.query(mapper).filter_by(id=obj_id).first()
-             for mapper, obj_id in _get_tagged_object_pairs(self)]
+        # one query per class of tagged objects
+        pairs = _get_tagged_object_pairs(self)
+        found = {}
+        for mapper in set(mapper for mapper, obj_id in pairs):
+            ids = set(obj_id for m, obj_id in pairs if m is mapper)
+            for chunk in db.in_clause_chunks(ids, session.bind):
+                for obj in session.query(mapper).filter(
+                        mapper.id.in_(chunk)):
+                    found[(mapper, obj.id)] = obj
+        r = [found.get(pair) for pair in pairs]
 
         # if `self` was tagging objects that have been later removed from
         # the database, those reference here become `None`. we filter them
@@ -689,7 +695,8 @@ class TagPlugin(pluginmgr.Plugin):
         SearchView.row_meta[Tag].set(
             children=partial(db.natsort, 'objects'),
             infobox=TagInfoBox,
-            context_menu=tag_context_menu)
+            context_menu=tag_context_menu,
+            prefetch=['_objects'])
         SearchView.bottom_info[Tag] = {
             'page_widget': 'taginfo_scrolledwindow',
             'fields_used': ['tag', 'description'],
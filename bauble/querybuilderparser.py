@@ -28,6 +28,9 @@ from pyparsing import (Word, alphas, alphanums, delimitedList, Group,
                        Forward, CaselessLiteral, WordStart, WordEnd,
                        ZeroOrMore)
 
+import bauble.utils as utils
+
+
 class BuiltQuery(object):
 
     wordStart, wordEnd = WordStart(), WordEnd()
@@ -51,7 +54,8 @@ class BuiltQuery(object):
         self.parsed = None
         self.__clauses = None
         try:
-            self.parsed = self.query.parseString(s)
+            with utils.pyparsing_lock:
+                self.parsed = self.query.parseString(s)
             self.is_valid = True
         except:
             self.is_valid = False
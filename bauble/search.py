@@ -19,6 +19,8 @@
 # along with ghini.desktop. If not, see <http://www.gnu.org/licenses/>.
 
 
+import copy
+import re
 import weakref
 
 import gtk
@@ -27,32 +29,128 @@ import logging
 logger = logging.getLogger(__name__)
 #logger.setLevel(logging.DEBUG)
 
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, not_, false, func, literal, select
+from sqlalchemy import union_all
+from sqlalchemy import Column, Integer, MetaData, String, Table
 from sqlalchemy import Unicode
 from sqlalchemy import UnicodeText
-from sqlalchemy.orm import class_mapper
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import class_mapper, aliased
 from sqlalchemy.orm.properties import (
     ColumnProperty, RelationshipProperty)
 RelationProperty = RelationshipProperty
 
 import bauble
-from bauble.error import check
+from bauble import pluginmgr
+from bauble.error import check, BaubleError
 import bauble.utils as utils
 from bauble.i18n import _
 from bauble.editor import (
     GenericEditorView, GenericEditorPresenter)
 from querybuilderparser import BuiltQuery
 
+compile_queries_pref = 'bauble.search.compile_queries'
+"""
+The preferences key to compile queries to a single SQL statement.  When
+False, the result sets of the subexpressions are combined by the
+database using INTERSECT, UNION and EXCEPT.
+
+Values: True, False (Default: True)
+"""
+
+cache_results_pref = 'bauble.search.cache_results'
+"""
+The preferences key to keep the outcome of the recent searches of the
+SearchView, as long as the database does not change, see result_cache.
+
+Values: True, False (Default: True)
+"""
+
+result_cache_size = 64
+result_cache = utils.Cache(result_cache_size)
+"""
+The outcome of the recent searches of the SearchView, see
+result_cache_key and bauble.view.SearchTask.
+"""
+
+
+def result_cache_key(text):
+    """return the key the outcome of the search for text is cached by
+
+    the normalized text, the database generation (see
+    bauble.db.bump_generation), today's date, from which relative dates
+    like |datetime|-1| are computed, and the values of the preferences
+    listed in the `result_prefs` of the search strategies.
+    """
+    import datetime
+    from bauble.prefs import prefs
+    strategy_prefs = tuple(
+        (name, prefs.get(name, None))
+        for strategy_name, strategy in sorted(_search_strategies.items())
+        for name in strategy.result_prefs)
+    return (SearchParser.normalize(text), bauble.db.generation,
+            datetime.date.today(), strategy_prefs)
+
 
 def search(text, session=None):
+    """apply all registered strategies to text
+
+    strategies are applied in two passes: first the ones that search
+    on their own, then the ones that declare (by their `expands`
+    attribute) they post-process the results of an other strategy.
+    these receive the already computed results, so that no search is
+    executed twice.
+    """
     results = set()
-    for strategy in _search_strategies.values():
+    computed = {}
+    primary = [(name, strategy)
+               for name, strategy in _search_strategies.items()
+               if strategy.expands is None]
+    secondary = [(name, strategy)
+                 for name, strategy in _search_strategies.items()
+                 if strategy.expands is not None]
+    for name, strategy in primary:
         logger.debug("applying search strategy %s from module %s" %
                      (type(strategy).__name__, type(strategy).__module__))
-        results.update(strategy.search(text, session))
+        # copy, strategies may reuse their result container
+        computed[name] = set(strategy.search(text, session))
+        results.update(computed[name])
+    for name, strategy in secondary:
+        logger.debug("applying search strategy %s from module %s" %
+                     (type(strategy).__name__, type(strategy).__module__))
+        if strategy.expands in computed:
+            logger.debug('SearchStrategy "%s"(%s) expands %s'
+                         % (text, type(strategy).__name__, strategy.expands))
+            results.update(strategy.expand(computed[strategy.expands],
+                                           session))
+        else:
+            results.update(strategy.search(text, session))
     return list(results)
 
 
+def search_paged(text, session):
+    """return the results of text as a pair (query, extra), or None
+
+    `query` is the ordered MapperSearch query, for the caller to consume
+    lazily, `extra` is the list of the objects the other strategies add
+    to its results.  None if the search does not resolve to a single
+    domain, as it is the case with value searches.
+    """
+    query = _search_strategies['MapperSearch'].query(text, session)
+    if query is None:
+        return None
+    extra = set()
+    for name, strategy in _search_strategies.items():
+        if name == 'MapperSearch':
+            continue
+        if strategy.expands == 'MapperSearch':
+            extra.update(strategy.expand_query(query, session))
+        else:
+            extra.update(strategy.search(text, session))
+    return query, list(extra)
+
+
 class NoneToken(object):
     def __init__(self, t=None):
         pass
@@ -195,6 +293,10 @@ class IdentifierToken(object):
                      % (cls, self.value[-1], attr))
         return query, attr
 
+    def compile(self, compiler, make_clause):
+        """return clause make_clause(attribute), as seen from domain"""
+        return compiler.attribute(self.value, make_clause)
+
     def needs_join(self, env):
         return self.value[:-1]
 
@@ -245,6 +347,18 @@ class IdentExpression(object):
         logger.debug('filtering on %s(%s)' % (type(a), a))
         return q.filter(clause(self.operands[1].express()))
 
+    def compile(self, compiler):
+        value = self.operands[1].express()
+        if value == set() and self.op in ('is', '=', '=='):
+            make_clause = lambda a: ~a.any()
+        elif value == set() and self.op in ('not', '<>', '!='):
+            make_clause = lambda a: a.any()
+        elif self.op in ('contains', 'has', 'icontains', 'ihas'):
+            make_clause = lambda a: compiler.contains(a, value)
+        else:
+            make_clause = lambda a: self.operation(a, value)
+        return self.operands[0].compile(compiler, make_clause)
+
     def needs_join(self, env):
         return [self.operands[0].needs_join(env)]
 
@@ -256,6 +370,10 @@ class ElementSetExpression(IdentExpression):
         q, a = self.operands[0].evaluate(env)
         return q.filter(a.in_(self.operands[1].express()))
 
+    def compile(self, compiler):
+        values = self.operands[1].express()
+        return self.operands[0].compile(compiler, lambda a: a.in_(values))
+
 
 class AggregatedExpression(IdentExpression):
     '''select on value of aggregated function
@@ -274,17 +392,27 @@ class AggregatedExpression(IdentExpression):
         # operands[1] is the value against which to test
         # operation implements the clause
         q, a = self.operands[0].identifier.evaluate(env)
-        from sqlalchemy.sql import func
-        f = getattr(func, self.operands[0].function)
+        f = self.operands[0].aggregate
         clause = lambda x: self.operation(f(a), x)
         # group by main ID
         # apply having
         main_table = q.column_descriptions[0]['type']
         mta = getattr(main_table, 'id')
         logger.debug('filtering on %s(%s)' % (type(mta), mta))
+        # out of the aliased joins, or a path coming back to the main
+        # table, like genus.species from species, groups by the alias
+        q = q.reset_joinpoint()
         result = q.group_by(mta).having(clause(self.operands[1].express()))
         return result
 
+    def compile(self, compiler):
+        # not GROUP BY/HAVING, which does not fit in a WHERE clause,
+        # but a subquery computing the aggregate for each domain object
+        aggregating = self.operands[0]
+        column = compiler.aggregate(aggregating.identifier.value,
+                                    aggregating.aggregate)
+        return self.operation(column, self.operands[1].express())
+
 
 class BetweenExpressionAction(object):
     def __init__(self, t):
@@ -300,6 +428,12 @@ class BetweenExpressionAction(object):
         return q.filter(and_(clause_low(self.operands[1].express()),
                              clause_high(self.operands[2].express())))
 
+    def compile(self, compiler):
+        low = self.operands[1].express()
+        high = self.operands[2].express()
+        return self.operands[0].compile(
+            compiler, lambda a: and_(low <= a, a <= high))
+
     def needs_join(self, env):
         return [self.operands[0].needs_join(env)]
 
@@ -339,6 +473,9 @@ class SearchAndAction(BinaryLogical):
             result = result.intersect(i.evaluate(env))
         return result
 
+    def compile(self, compiler):
+        return and_(*[i.compile(compiler) for i in self.operands])
+
 
 class SearchOrAction(BinaryLogical):
     name = 'OR'
@@ -349,6 +486,9 @@ class SearchOrAction(BinaryLogical):
             result = result.union(i.evaluate(env))
         return result
 
+    def compile(self, compiler):
+        return or_(*[i.compile(compiler) for i in self.operands])
+
 
 class SearchNotAction(UnaryLogical):
     name = 'NOT'
@@ -359,6 +499,10 @@ class SearchNotAction(UnaryLogical):
             q.join(*i)
         return q.except_(self.operand.evaluate(env))
 
+    def compile(self, compiler):
+        # like EXCEPT, also keep the rows where the operand is NULL
+        return not_(func.coalesce(self.operand.compile(compiler), false()))
+
 
 class ParenthesisedQuery(object):
     def __init__(self, t):
@@ -370,10 +514,247 @@ class ParenthesisedQuery(object):
     def evaluate(self, env):
         return self.query.evaluate(env)
 
+    def compile(self, compiler):
+        return self.query.compile(compiler)
+
     def needs_join(self, env):
         return self.query.needs_join(env)
 
 
+text_index = Table('search_text_index', MetaData(),
+                   Column('rowid', Integer), Column('value', UnicodeText))
+"""
+The SQLite FTS5 table shadowing the text columns searched by
+MapperSearch.  Its rowid encodes both the id of the indexed row and the
+slot of the column, as ``id * TEXT_INDEX_SLOTS + slot``; slots are
+registered in the search_text_index_columns table.
+"""
+
+TEXT_INDEX_SLOTS = 1024
+
+# engine -> {(table name, column name): slot}
+_text_index_slots = weakref.WeakKeyDictionary()
+
+
+def text_index_columns():
+    """return the (table, column) names of the text properties
+    registered with MapperSearch.add_meta
+    """
+    result = set()
+    for cls, properties in MapperSearch._properties.iteritems():
+        mapper = class_mapper(cls)
+        for name in properties:
+            column = mapper.c[name]
+            if isinstance(column.type, String):
+                result.add((column.table.name, column.name))
+    return sorted(result)
+
+
+def _sqlite_text_index_statements(table, column, slot):
+    """fill the text index for table.column and keep it in sync"""
+    fmt = dict(table=table, column=column, slot=slot, n=TEXT_INDEX_SLOTS)
+    return [s % fmt for s in [
+        'DELETE FROM search_text_index WHERE rowid %% %(n)d = %(slot)d',
+        'INSERT INTO search_text_index (rowid, value) '
+        'SELECT id * %(n)d + %(slot)d, %(column)s FROM %(table)s '
+        'WHERE %(column)s IS NOT NULL',
+        'DROP TRIGGER IF EXISTS %(table)s_%(column)s_text_index_ins',
+        'CREATE TRIGGER %(table)s_%(column)s_text_index_ins '
+        'AFTER INSERT ON %(table)s WHEN new.%(column)s IS NOT NULL BEGIN '
+        'INSERT INTO search_text_index (rowid, value) '
+        'VALUES (new.id * %(n)d + %(slot)d, new.%(column)s); END',
+        'DROP TRIGGER IF EXISTS %(table)s_%(column)s_text_index_upd',
+        'CREATE TRIGGER %(table)s_%(column)s_text_index_upd '
+        'AFTER UPDATE OF id, %(column)s ON %(table)s BEGIN '
+        'DELETE FROM search_text_index '
+        'WHERE rowid = old.id * %(n)d + %(slot)d; '
+        'INSERT INTO search_text_index (rowid, value) '
+        'SELECT new.id * %(n)d + %(slot)d, new.%(column)s '
+        'WHERE new.%(column)s IS NOT NULL; END',
+        'DROP TRIGGER IF EXISTS %(table)s_%(column)s_text_index_del',
+        'CREATE TRIGGER %(table)s_%(column)s_text_index_del '
+        'AFTER DELETE ON %(table)s BEGIN '
+        'DELETE FROM search_text_index '
+        'WHERE rowid = old.id * %(n)d + %(slot)d; END',
+        ]]
+
+
+def create_text_index(bind=None):
+    """create or refresh the index on the MapperSearch text columns
+
+    on PostgreSQL these are pg_trgm GIN indexes, which the ILIKE
+    produced by utils.ilike uses as they are.  on SQLite an FTS5 table
+    with trigram tokenizer is filled and kept in sync by triggers, and
+    `contains` predicates are routed to it.
+    """
+    bind = bind or bauble.db.engine
+    with bind.begin() as connection:
+        if bind.name == 'postgresql':
+            connection.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for table, column in text_index_columns():
+                connection.execute(
+                    'CREATE INDEX IF NOT EXISTS %(t)s_%(c)s_trgm_idx '
+                    'ON %(t)s USING gin (%(c)s gin_trgm_ops)'
+                    % {'t': table, 'c': column})
+        elif bind.name == 'sqlite':
+            connection.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS search_text_index '
+                'USING fts5(value, tokenize=trigram)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS search_text_index_columns '
+                '(slot INTEGER PRIMARY KEY, tbl TEXT, col TEXT, '
+                'UNIQUE (tbl, col))')
+            for table, column in text_index_columns():
+                connection.execute(
+                    'INSERT OR IGNORE INTO search_text_index_columns '
+                    '(tbl, col) VALUES (?, ?)', table, column)
+                slot = connection.execute(
+                    'SELECT slot FROM search_text_index_columns '
+                    'WHERE tbl = ? AND col = ?', table, column).scalar()
+                for statement in _sqlite_text_index_statements(
+                        table, column, slot):
+                    connection.execute(statement)
+        else:
+            raise BaubleError(
+                _('No text index available for %s') % bind.name)
+    _text_index_slots.pop(bind, None)
+
+
+def drop_text_index(bind=None):
+    """remove what create_text_index created"""
+    bind = bind or bauble.db.engine
+    with bind.begin() as connection:
+        if bind.name == 'postgresql':
+            for table, column in text_index_columns():
+                connection.execute('DROP INDEX IF EXISTS %s_%s_trgm_idx'
+                                   % (table, column))
+        elif (bind.name == 'sqlite' and
+              bind.has_table('search_text_index_columns')):
+            for table, column in connection.execute(
+                    'SELECT tbl, col FROM search_text_index_columns'):
+                for suffix in ('ins', 'upd', 'del'):
+                    connection.execute(
+                        'DROP TRIGGER IF EXISTS %s_%s_text_index_%s'
+                        % (table, column, suffix))
+            connection.execute('DROP TABLE search_text_index_columns')
+            connection.execute('DROP TABLE IF EXISTS search_text_index')
+    _text_index_slots.pop(bind, None)
+
+
+def text_index_clause(id_column, column, pattern, bind=None):
+    """return clause selecting the ids of rows where column is like
+    pattern, using the text index, or None if column is not indexed.
+    """
+    bind = bind or bauble.db.engine
+    if bind.name != 'sqlite':
+        return None
+    if bind not in _text_index_slots:
+        slots = {}
+        if bind.has_table('search_text_index_columns'):
+            slots = dict(((t, c), s) for s, t, c in bind.execute(
+                'SELECT slot, tbl, col FROM search_text_index_columns'))
+        _text_index_slots[bind] = slots
+    slot = _text_index_slots[bind].get((column.table.name, column.name))
+    if slot is None:
+        return None
+    return id_column.in_(
+        select([text_index.c.rowid / TEXT_INDEX_SLOTS]).where(and_(
+            text_index.c.rowid % TEXT_INDEX_SLOTS == slot,
+            text_index.c.value.like(pattern))))
+
+
+def contains_clause(id_column, column, value):
+    """return clause for column containing value, case insensitive"""
+    pattern = '%%%s%%' % value
+    clause = text_index_clause(id_column, column, pattern)
+    if clause is None:
+        clause = utils.ilike(column, pattern)
+    return clause
+
+
+class QueryCompiler(object):
+    """compile a query expression to a single SELECT on domain
+
+    identifiers share one join graph: the to-one relations along their
+    path are outer joined to the domain, once per distinct path.  as
+    soon as a path crosses a to-many relation, the rest of the path
+    becomes an EXISTS subquery, since joining would multiply rows and
+    the condition needs only hold for at least one of the related
+    objects.
+    """
+
+    def __init__(self, session, domain):
+        self.session = session
+        self.domain = domain
+        self.joins = {}  # path prefix -> (relation attribute, alias)
+        self.join_order = []
+
+    def attribute(self, steps, make_clause):
+        """return make_clause applied to the attribute at end of steps"""
+        cls = self.domain
+        for i, step in enumerate(steps[:-1]):
+            attr = getattr(cls, step)
+            if attr.property.uselist:
+                return attr.any(self._nested(
+                    attr.property.mapper.class_, steps[i + 1:], make_clause))
+            prefix = tuple(steps[:i + 1])
+            if prefix not in self.joins:
+                target = aliased(attr.property.mapper.class_)
+                self.joins[prefix] = attr, target
+                self.join_order.append(prefix)
+            cls = self.joins[prefix][1]
+        return make_clause(getattr(cls, steps[-1]))
+
+    def aggregate(self, steps, aggregate):
+        """return aggregate of the attribute at end of steps, per domain object
+
+        it is a scalar subquery, correlated to the domain: the path is
+        joined from an alias of the domain, whatever its depth.
+        """
+        inner = aliased(self.domain)
+        joins = []
+        cls = inner
+        for step in steps[:-1]:
+            attr = getattr(cls, step)
+            cls = aliased(attr.property.mapper.class_)
+            joins.append((cls, attr))
+        query = self.session.query(
+            aggregate(getattr(cls, steps[-1]))).select_from(inner)
+        for target, attr in joins:
+            query = query.join(target, attr)
+        return query.filter(inner.id == self.domain.id).correlate(
+            self.domain).as_scalar()
+
+    def contains(self, attr, value):
+        """return clause for attr containing value"""
+        pattern = '%%%s%%' % value
+        clause = None
+        if isinstance(getattr(attr, 'property', None), ColumnProperty):
+            clause = text_index_clause(getattr(attr.class_, 'id'),
+                                       attr.property.columns[0], pattern)
+        if clause is None:
+            clause = utils.ilike(attr, pattern)
+        return clause
+
+    def _nested(self, cls, steps, make_clause):
+        attr = getattr(cls, steps[0])
+        if len(steps) == 1:
+            return make_clause(attr)
+        inner = self._nested(attr.property.mapper.class_, steps[1:],
+                             make_clause)
+        if attr.property.uselist:
+            return attr.any(inner)
+        return attr.has(inner)
+
+    def query(self, clause):
+        """return the query selecting domain objects satisfying clause"""
+        query = self.session.query(self.domain)
+        for prefix in self.join_order:
+            attr, target = self.joins[prefix]
+            query = query.outerjoin(target, attr)
+        return query.filter(clause)
+
+
 class QueryAction(object):
     def __init__(self, t):
         self.domain = t[0]
@@ -395,26 +776,53 @@ class QueryAction(object):
         logger.debug('QueryAction:invoke - %s(%s) %s(%s)' %
                      (type(self.domain), self.domain,
                       type(self.filter), self.filter))
-        domain = self.domain
-        check(domain in search_strategy._domains or
-              domain in search_strategy._shorthand,
-              'Unknown search domain: %s' % domain)
-        self.domain = search_strategy._shorthand.get(domain, domain)
-        self.domain = search_strategy._domains[domain][0]
-        self.search_strategy = search_strategy
-
         result = set()
-        if search_strategy._session is not None:
-            self.domains = self.filter.needs_join(self)
-            self.session = search_strategy._session
-            records = self.filter.evaluate(self).all()
-            result.update(records)
+        query = self.query(search_strategy)
+        if query is not None:
+            result.update(query.all())
 
         if None in result:
             logger.warn('removing None from result set')
             result = set(i for i in result if i is not None)
         return result
 
+    def query(self, search_strategy):
+        """return the query selecting the objects matching self
+
+        or None if search_strategy has no session.
+        """
+        domain = self.domain
+        check(domain in search_strategy._domains or
+              domain in search_strategy._shorthand,
+              'Unknown search domain: %s' % domain)
+        # the parsed statement may be cached and invoked again, so we
+        # leave self alone and work on a copy.
+        env = copy.copy(self)
+        domain = search_strategy._shorthand.get(domain, domain)
+        env.domain = search_strategy._domains[domain][0]
+        env.search_strategy = search_strategy
+        if search_strategy._session is None:
+            return None
+        env.domains = self.filter.needs_join(env)
+        env.session = search_strategy._session
+        from bauble.prefs import prefs
+        if prefs.get(compile_queries_pref, True):
+            try:
+                return env.compile()
+            except NotImplementedError:
+                logger.debug('cannot compile %s, falling back to '
+                             'set algebra' % self.filter)
+        return self.filter.evaluate(env)
+
+    def compile(self):
+        """return the single query equivalent to self.filter
+
+        raise NotImplementedError if part of the filter can't be
+        expressed in a WHERE clause.
+        """
+        compiler = QueryCompiler(self.session, self.domain)
+        return compiler.query(self.filter.compile(compiler))
+
 
 class StatementAction(object):
     def __init__(self, t):
@@ -440,17 +848,20 @@ class BinomialNameAction(object):
 
     def invoke(self, search_strategy):
         logger.debug('BinomialNameAction:invoke')
-        from bauble.plugins.plants.genus import Genus
-        from bauble.plugins.plants.species import Species
-        result = search_strategy._session.query(Species).filter(
-            Species.sp.startswith(self.species_epithet)).join(Genus).filter(
-            Genus.genus.startswith(self.genus_epithet)).all()
-        result = set(result)
+        result = set(self.query(search_strategy).all())
         if None in result:
             logger.warn('removing None from result set')
             result = set(i for i in result if i is not None)
         return result
 
+    def query(self, search_strategy):
+        """return the query selecting the matching species"""
+        from bauble.plugins.plants.genus import Genus
+        from bauble.plugins.plants.species import Species
+        return search_strategy._session.query(Species).filter(
+            Species.sp.startswith(self.species_epithet)).join(Genus).filter(
+            Genus.genus.startswith(self.genus_epithet))
+
 
 class DomainExpressionAction(object):
     """created when the parser hits a domain_expression token.
@@ -460,6 +871,10 @@ class DomainExpressionAction(object):
     the domain expression will return all object with at least one
     property (as passed to add_meta) matching (according to the binop)
     the value.
+
+    all properties are checked in one statement.  with `ids_only`,
+    invoke returns (class, id) pairs instead of objects, leaving it to
+    the caller to load the objects when and if it needs them.
     """
 
     def __init__(self, t):
@@ -470,27 +885,41 @@ class DomainExpressionAction(object):
     def __repr__(self):
         return "%s %s %s" % (self.domain, self.cond, self.values)
 
-    def invoke(self, search_strategy):
+    def invoke(self, search_strategy, ids_only=False):
         logger.debug('DomainExpressionAction:invoke')
+        query = self.query(search_strategy, ids_only)
+        result = set()
+        if ids_only:
+            cls = query.column_descriptions[0]['expr'].class_
+            result.update((cls, i) for (i, ) in query.all())
+        else:
+            result.update(query.all())
+
+        if None in result:
+            logger.warn('removing None from result set')
+            result = set(i for i in result if i is not None)
+        return result
+
+    def query(self, search_strategy, ids_only=False):
+        """return the query selecting the matching objects, or their ids"""
+        domain = search_strategy._shorthand.get(self.domain, self.domain)
         try:
-            if self.domain in search_strategy._shorthand:
-                self.domain = search_strategy._shorthand[self.domain]
-            cls, properties = search_strategy._domains[self.domain]
+            cls, properties = search_strategy._domains[domain]
         except KeyError:
-            raise KeyError(_('Unknown search domain: %s') % self.domain)
+            raise KeyError(_('Unknown search domain: %s') % domain)
 
-        query = search_strategy._session.query(cls)
+        if ids_only:
+            query = search_strategy._session.query(cls.id)
+        else:
+            query = search_strategy._session.query(cls)
 
         ## here is the place where to optionally filter out unrepresented
         ## domain values. each domain class should define its own 'I have
         ## accessions' filter. see issue #42
 
-        result = set()
-
         # select all objects from the domain
         if self.values == '*':
-            result.update(query.all())
-            return result
+            return query
 
         mapper = class_mapper(cls)
 
@@ -507,14 +936,10 @@ class DomainExpressionAction(object):
             condition = lambda col: \
                 lambda val: mapper.c[col].op(self.cond)(val)
 
-        for col in properties:
-            ors = or_(*map(condition(col), self.values.express()))
-            result.update(query.filter(ors).all())
-
-        if None in result:
-            logger.warn('removing None from result set')
-            result = set(i for i in result if i is not None)
-        return result
+        ors = or_(*[condition(col)(val)
+                    for col in properties
+                    for val in self.values.express()])
+        return query.filter(ors)
 
 
 class AggregatingAction(object):
@@ -522,11 +947,21 @@ class AggregatingAction(object):
     def __init__(self, t):
         logger.debug("AggregatingAction::__init__(%s)" % t)
         self.function = t[0]
-        self.identifier = t[2]
+        self.distinct = t[2] == 'distinct'
+        self.identifier = t[-2]
 
     def __repr__(self):
+        if self.distinct:
+            return "(%s distinct %s)" % (self.function, self.identifier)
         return "(%s %s)" % (self.function, self.identifier)
 
+    def aggregate(self, column):
+        """return the aggregating function applied to column"""
+        from sqlalchemy import distinct
+        if self.distinct:
+            column = distinct(column)
+        return getattr(func, self.function)(column)
+
     def needs_join(self, env):
         return [self.identifier.needs_join(env)]
 
@@ -562,44 +997,59 @@ class ValueListAction(object):
         Search with a list of values is the broadest search and
         searches all the mapper and the properties configured with
         add_meta()
+
+        all classes are searched in one UNION ALL statement, selecting
+        pairs (class index, id), then the objects of each class are
+        loaded with one IN query.  a class that defines the classmethod
+        `replacement_column`, returning a pair (class, column), has the
+        matching rows replaced by the objects that column refers to.
         """
 
         logger.debug('ValueListAction:invoke')
         # make searches case-insensitive, in postgres use ilike,
-        # in other use upper()
+        # in other use upper(), or the text index if there is one
         like = lambda table, col, val: \
-            utils.ilike(table.c[col], ('%%%s%%' % val))
+            contains_clause(table.c.id, table.c[col], val)
+
+        # as of SQLAlchemy>=0.4.2 we convert the value to a unicode
+        # object if the col is a Unicode or UnicodeText column in order
+        # to avoid the "Unicode type received non-unicode bind param"
+        def unicol(table, col, v):
+            if isinstance(table.c[col].type, (Unicode, UnicodeText)):
+                return unicode(v)
+            else:
+                return v
 
-        result = set()
+        targets = []
+        selects = []
         for cls, columns in search_strategy._properties.iteritems():
+            try:
+                target, id_column = cls.replacement_column()
+            except AttributeError:
+                target, id_column = cls, cls.id
+            table = class_mapper(cls)
             column_cross_value = [(c, v) for c in columns
                                   for v in self.express()]
-            # as of SQLAlchemy>=0.4.2 we convert the value to a unicode
-            # object if the col is a Unicode or UnicodeText column in order
-            # to avoid the "Unicode type received non-unicode bind param"
-
-            def unicol(col, v):
-                table = class_mapper(cls)
-                if isinstance(table.c[col].type, (Unicode, UnicodeText)):
-                    return unicode(v)
-                else:
-                    return v
-
-            table = class_mapper(cls)
-            q = search_strategy._session.query(cls)  # prepares SELECT
-            q = q.filter(or_(*[like(table, c, unicol(c, v))
-                               for c, v in column_cross_value]))
-            result.update(q.all())
+            selects.append(
+                select([literal(len(targets)).label('kind'),
+                        id_column.label('id')]).where(
+                    or_(*[like(table, c, unicol(table, c, v))
+                          for c, v in column_cross_value])))
+            targets.append(target)
 
-        def replace(i):
-            try:
-                replacement = i.replacement()
-                logger.debug('replacing %s by %s in result set' %
-                             (i, replacement))
-                return replacement
-            except:
-                return i
-        result = set([replace(i) for i in result])
+        result = set()
+        if not selects:
+            return result
+        session = search_strategy._session
+        ids = {}
+        for kind, id in session.execute(union_all(*selects)):
+            if id is not None:
+                ids.setdefault(targets[kind], set()).add(id)
+        from bauble.db import in_clause_chunks
+        for cls, cls_ids in ids.iteritems():
+            for chunk in in_clause_chunks(sorted(cls_ids), session.bind):
+                result.update(
+                    session.query(cls).filter(cls.id.in_(chunk)).all())
         logger.debug("result is now %s" % result)
         if None in result:
             logger.warn('removing None from result set')
@@ -612,13 +1062,22 @@ from pyparsing import (
     OneOrMore, oneOf, alphas, alphanums, Group, Literal,
     CaselessLiteral, WordStart, WordEnd, srange,
     stringEnd, Keyword, quotedString,
-    infixNotation, opAssoc, Forward)
+    infixNotation, opAssoc, Forward, ParserElement, Optional)
+
+# infixNotation backtracks heavily, memoizing partial matches makes the
+# grammar much faster.  this must happen before the grammar is used.
+ParserElement.enablePackrat()
 
 wordStart, wordEnd = WordStart(), WordEnd()
 
 
 class SearchParser(object):
     """The parser for bauble.search.MapperSearch
+
+    parse results are kept in a least recently used cache, keyed by the
+    normalized text and holding at most `cache_size` entries.  the
+    cache hits and misses are counted in `self.cache.hits` and
+    `self.cache.misses`.
     """
 
     numeric_value = Regex(
@@ -673,12 +1132,14 @@ class SearchParser(object):
     BETWEEN_ = wordStart + CaselessLiteral("BETWEEN") + wordEnd
 
     aggregating_func = (Literal('sum') | Literal('min') | Literal('max')
-                        | Literal('count'))
+                        | Literal('count') | Literal('avg'))
 
     query_expression = Forward()('filter')
     identifier = Group(delimitedList(Word(alphas+'_', alphanums+'_'),
                                      '.')).setParseAction(IdentifierToken)
-    aggregated = (aggregating_func + Literal('(') + identifier + Literal(')')
+    aggregated = (aggregating_func + Literal('(') +
+                  Optional(Keyword('distinct', caseless=True)) +
+                  identifier + Literal(')')
                   ).setParseAction(AggregatingAction)
     ident_expression = (Group(identifier + binop + value
                               ).setParseAction(IdentExpression)
@@ -705,22 +1166,71 @@ class SearchParser(object):
                  | value_list('value_list')
                  ).setParseAction(StatementAction)('statement')
 
+    quoted_or_blank = re.compile(r'("(?:[^"\\]|\\.)*"'
+                                 r"|'(?:[^'\\]|\\.)*')"
+                                 r'|\s+')
+
+    def __init__(self, cache_size=128):
+        self.cache = utils.Cache(cache_size)
+
+    @classmethod
+    def normalize(cls, text):
+        '''strip text and collapse blanks that are not within quotes'''
+
+        return cls.quoted_or_blank.sub(
+            lambda m: m.group(1) or ' ', text).strip()
+
     def parse_string(self, text):
         '''request pyparsing object to parse text
 
         `text` can be either a query, or a domain expression, or a list of
         values. the `self.statement` pyparsing object parses the input text
         and return a pyparsing.ParseResults object that represents the input
+
+        the result may come from the cache and be shared among callers,
+        it must not be modified.
         '''
 
-        return self.statement.parseString(text)
+        key = self.normalize(text)
+        with utils.pyparsing_lock:
+            return self.cache.get(
+                key, lambda: self.statement.parseString(key))
 
 
 class SearchStrategy(object):
     """
     Interface for adding search strategies to a view.
+
+    a strategy that post-processes the results of an other strategy
+    sets `expands` to the name of that strategy and implements
+    `expand`.  bauble.search.search will then invoke `expand` on the
+    results computed by the other strategy instead of `search`.
     """
 
+    expands = None
+
+    # the preferences keys whose values change the results
+    result_prefs = ()
+
+    def expand(self, results, session):
+        '''
+        :param results: the results of the strategy named in `expands`
+        :param session: the session to use for the search
+
+        Return an iterator over the mapped objects to add to results.
+        '''
+        return []
+
+    def expand_query(self, query, session):
+        '''
+        :param query: the query of the strategy named in `expands`
+        :param session: the session to use for the search
+
+        Like `expand`, on the results of a query.  override it if the
+        results need not be loaded.
+        '''
+        return self.expand(query.all(), session)
+
     def search(self, text, session=None):
         '''
         :param text: the search string
@@ -748,12 +1258,27 @@ class MapperSearch(SearchStrategy):
     _domains = {}
     _shorthand = {}
     _properties = {}
+    _session = None
+
+    result_prefs = (compile_queries_pref, )
 
     def __init__(self):
         super(MapperSearch, self).__init__()
         self._results = set()
         self.parser = SearchParser()
 
+    def bound(self, session):
+        """
+        Returns a copy of self searching in session, with its own
+        results, that the parse actions receive.  Searches running in
+        different threads share the registered domains, not their
+        session and results.
+        """
+        result = copy.copy(self)
+        result._session = session
+        result._results = set()
+        return result
+
     def add_meta(self, domain, cls, properties):
         """Add a domain to the search space
 
@@ -803,17 +1328,40 @@ class MapperSearch(SearchStrategy):
         could cause deadlocks.
         """
         super(MapperSearch, self).search(text, session)
-        self._session = session
-
-        self._results.clear()
+        strategy = self.bound(session)
         statement = self.parser.parse_string(text.decode()).statement
         logger.debug("statement : %s(%s)" % (type(statement), statement))
-        self._results.update(statement.invoke(self))
+        strategy._results.update(statement.invoke(strategy))
         logger.debug('search returns %s(%s)'
-                     % (type(self._results), self._results))
+                     % (type(strategy._results), strategy._results))
 
         # these _results get filled in when the parse actions are called
-        return self._results
+        return strategy._results
+
+    def query(self, text, session):
+        """
+        Returns the query producing the results of search(text, session),
+        ordered by the mapper order_by, or by the searched properties,
+        then by id.  Returns None if text does not resolve to a single
+        domain.
+        """
+        statement = self.parser.parse_string(text.decode()).statement
+        if not hasattr(statement.content, 'query'):
+            return None
+        query = statement.content.query(self.bound(session))
+        if query is None:
+            return None
+        cls = query.column_descriptions[0]['type']
+        return query.order_by(*self.result_order(cls))
+
+    def result_order(self, cls):
+        """
+        Returns the columns the results of cls are ordered by, the last
+        one being the id.
+        """
+        order = class_mapper(cls).order_by or [
+            getattr(cls, name) for name in self._properties.get(cls, [])]
+        return list(order) + [cls.id]
 
 
 ## list of search strategies to be tried on each search string
@@ -829,6 +1377,129 @@ def get_strategy(name):
     return _search_strategies.get(name, None)
 
 
+class TextIndexCommandHandler(pluginmgr.CommandHandler):
+    """`:textindex` creates or refreshes the text index on the searched
+    columns, `:textindex=drop` removes it.
+    """
+
+    command = 'textindex'
+
+    def __call__(self, cmd, arg):
+        if arg == 'drop':
+            drop_text_index()
+        else:
+            create_text_index()
+
+
+pluginmgr.register_command(TextIndexCommandHandler)
+
+
+class Explain(Executable, ClauseElement):
+    """the statement, prefixed by the EXPLAIN keywords of the backend
+
+    compiled with the statement itself, so its parameters go through the
+    bind processors of their types, like the parameters of any query.
+    """
+
+    def __init__(self, statement, prefix):
+        self.statement = statement
+        self.prefix = prefix
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    return element.prefix + compiler.process(element.statement, **kw)
+
+
+def query_plan(statement, session):
+    """return the lines of the plan the database chooses for statement
+
+    `EXPLAIN QUERY PLAN` on SQLite, `EXPLAIN ANALYZE` on PostgreSQL,
+    which also executes the statement.  empty list on other backends.
+    """
+    name = session.bind.name
+    if name == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif name == 'postgresql':
+        prefix = 'EXPLAIN ANALYZE '
+    else:
+        return []
+    rows = session.execute(Explain(statement, prefix))
+    # the plan is the last column, the only one on PostgreSQL
+    return [utils.utf8(tuple(row)[-1]) for row in rows]
+
+
+def explain(text, session):
+    """explain how the search for text is executed
+
+    return a pair of strings: the time spent parsing, executing the SQL,
+    building the objects and populating the results model, then the SQL
+    the MapperSearch query compiles to and its query plan.  searches
+    that do not resolve to a single statement, like value searches, are
+    only timed as a whole.
+    """
+    import time
+    from bauble.view import ResultsModel, SearchView, sort_results
+
+    timings = []
+    details = []
+    start = time.time()
+    # not the MapperSearch parser, its cache would hide the parse time
+    SearchParser(cache_size=1).parse_string(text)
+    timings.append((_('parse'), time.time() - start))
+
+    query = _search_strategies['MapperSearch'].query(text, session)
+    if query is None:
+        details.append(_('the search does not resolve to a single '
+                         'statement'))
+        start = time.time()
+        results = search(text, session)
+        timings.append((_('search'), time.time() - start))
+    else:
+        statement = query.statement
+        details.append(unicode(
+            statement.compile(dialect=session.bind.dialect)))
+        details.append('')
+        details.extend(query_plan(statement, session))
+        start = time.time()
+        session.execute(statement).fetchall()
+        sql_time = time.time() - start
+        timings.append((_('SQL execution'), sql_time))
+        start = time.time()
+        results = query.all()
+        timings.append((_('ORM hydration'),
+                        max(0, time.time() - start - sql_time)))
+    start = time.time()
+    model = ResultsModel(session, SearchView.row_meta)
+    model.append_pairs((type(i), i.id) for i in sort_results(results))
+    timings.append((_('tree model population'), time.time() - start))
+
+    summary = [_('%(count)s results for: %(text)s') %
+               {'count': len(results), 'text': text}]
+    summary.extend('%s: %.1f ms' % (label, 1000 * seconds)
+                   for label, seconds in timings)
+    return '\n'.join(summary), '\n'.join(details)
+
+
+class ExplainCommandHandler(pluginmgr.CommandHandler):
+    """`:explain=<search>` shows the SQL of a search, its query plan and
+    where the time goes, see `explain`.
+    """
+
+    command = 'explain'
+
+    def __call__(self, cmd, arg):
+        session = bauble.db.Session()
+        try:
+            summary, details = explain(arg, session)
+        finally:
+            session.close()
+        utils.message_details_dialog(utils.xml_safe(summary), details)
+
+
+pluginmgr.register_command(ExplainCommandHandler)
+
+
 class SchemaBrowser(gtk.VBox):
 
     def __init__(self, *args, **kwargs):
@@ -18,6 +18,8 @@
 # You should have received a copy of the GNU General Public License
 # along with ghini.desktop. If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
+
 from bauble.test import BaubleTestCase
 import bauble.plugins.plants.genus
 import bauble.plugins.garden.accession
@@ -36,3 +38,205 @@ class GlobalFunctionsTests(BaubleTestCase):
         self.assertEquals(db.class_of_object("accession_note"),
                           bauble.plugins.garden.accession.AccessionNote)
         self.assertEquals(db.class_of_object("not_existing"), None)
+
+    def test_changed_rows(self):
+        from bauble.plugins.plants import Family
+        since = db.generation
+        family = Family(family=u'Cactaceae')
+        self.session.add(family)
+        self.session.commit()
+        self.assertEquals(db.changed_rows(since), set([('family', family.id)]))
+        self.assertEquals(db.changed_rows(db.generation), set())
+        db.bump_generation()
+        self.assertEquals(db.changed_rows(since), None)
+
+    def test_history_written_once_per_flush(self):
+        from sqlalchemy import event
+        from bauble.plugins.plants import Family
+        history = self.session.query(db.History).filter_by(
+            table_name=u'family')
+        before = history.count()
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('INSERT INTO history'):
+                statements.append(executemany)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            self.session.add_all([Family(family=u'fam%d' % i)
+                                  for i in range(10)])
+            self.session.commit()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEquals(statements, [True])
+        self.assertEquals(history.count(), before + 10)
+
+    def test_history_values(self):
+        self.assertEquals(db.history_values(u'{"id": 1, "genus": "Ixora"}'),
+                          {'id': 1, 'genus': u'Ixora'})
+        self.assertEquals(
+            db.history_values(u"{'id': u'1', 'genus': u'Ixora', "
+                              u"'author': u'None'}", u'genus'),
+            {'id': 1, 'genus': u'Ixora', 'author': None})
+        # only numeric and boolean columns get their types back
+        self.assertEquals(
+            db.history_values(u"{'id': u'2', 'genus': u'1', "
+                              u"'author': u'True'}", u'genus'),
+            {'id': 2, 'genus': u'1', 'author': u'True'})
+        self.assertEquals(
+            db.history_values(u"{'id': u'2', 'code': u'007'}"),
+            {'id': u'2', 'code': u'007'})
+
+    def test_history_query_and_migration(self):
+        import datetime
+        from bauble.plugins.plants import Family
+        family = Family(family=u'Cactaceae')
+        self.session.add(family)
+        self.session.commit()
+        entry = db.history_query(self.session, u'family', family.id).one()
+        self.assertTrue(entry in db.history_query(self.session,
+                                                  table_id=family.id))
+        self.assertEquals(db.history_values(entry.values)['family'],
+                          u'Cactaceae')
+        db.History.__table__.insert().execute(
+            table_name=u'family', table_id=family.id, operation=u'update',
+            values=u"{'id': u'%d', 'family': u'Cactaceae'}" % family.id,
+            timestamp=datetime.datetime.today())
+        db.migrate_history(batch_size=1)
+        for entry in db.history_query(self.session, u'family', family.id):
+            self.assertTrue(entry.values.startswith(u'{"'))
+            self.assertEquals(db.history_values(entry.values)['id'],
+                              family.id)
+
+    def test_history_keyset_pages(self):
+        from bauble.plugins.plants import Family
+        self.session.add_all([Family(family=u'fam%02d' % i)
+                              for i in range(25)])
+        self.session.commit()
+        query = db.history_query(self.session, u'family', operation=u'insert')
+        expected = [i.id for i in query]
+        pages = []
+        after = None
+        while True:
+            page = db.history_query(self.session, u'family',
+                                    operation=u'insert',
+                                    after=after).limit(10).all()
+            pages.extend(i.id for i in page)
+            if len(page) < 10:
+                break
+            after = page[-1].timestamp, page[-1].id
+        self.assertEquals(len(expected), 25)
+        self.assertEquals(pages, expected)
+
+    def test_history_archive_and_restore(self):
+        import shutil
+        import tempfile
+        from bauble.plugins.plants import Family
+        self.session.add_all([Family(family=u'fam%02d' % i)
+                              for i in range(5)])
+        self.session.commit()
+        history = db.History.__table__
+        db.engine.execute(history.update().values(
+            timestamp=datetime.datetime(2015, 6, 1, 12, 30)))
+        query = db.history_query(self.session)
+        before = [(i.id, i.values) for i in query]
+        directory = tempfile.mkdtemp()
+
+        def archived(target):
+            if target is None:
+                return [row.id for row in db.engine.execute(
+                    db.history_archive_table(2015).select())]
+            return [entry['id']
+                    for entry in db._archived_in_file(target, 2015)]
+
+        try:
+            for target in (directory, None):
+                # archive, restore, then again: nothing archived twice
+                for cycle in range(2):
+                    moved = db.archive_history(u'2016-01-01', target,
+                                               batch_size=2)
+                    self.assertEquals(moved, len(before) - 1)
+                    self.assertEquals(query.count(), 1)
+                    self.assertEquals(sorted(archived(target)),
+                                      sorted(i for i, v in before[1:]))
+                    self.assertEquals(db.restore_history(2015, target),
+                                      moved)
+                    self.assertEquals(db.restore_history(2015, target), 0)
+                    self.session.expire_all()
+                    self.assertEquals([(i.id, i.values) for i in query],
+                                      before)
+                self.assertEquals(query[-1].timestamp,
+                                  datetime.datetime(2015, 6, 1, 12, 30))
+            # a file holding an entry twice restores it once
+            db.archive_history(u'2016-01-01', directory)
+            entry = dict(db.History.__table__.select().execute().first())
+            entry.update(id=before[-1][0], values=before[-1][1],
+                         timestamp=datetime.datetime(2015, 6, 1, 12, 30))
+            db._archive_to_file(directory, 2015, [entry])
+            self.assertEquals(db.restore_history(2015, directory),
+                              len(before) - 1)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_engine_options_and_pool_stats(self):
+        from sqlalchemy.orm import sessionmaker
+        from sqlalchemy.pool import QueuePool, StaticPool
+        self.assertEquals(
+            db.engine_options('sqlite:///:memory:')['poolclass'], StaticPool)
+        self.assertEquals(db.engine_options('sqlite:///:memory:')[
+            'pool_reset_on_return'], None)
+        self.assertEquals(
+            db.engine_options('sqlite:////tmp/ghini.db')['poolclass'],
+            QueuePool)
+        self.assertEquals(
+            db.engine_options('postgresql://ghini@localhost/ghini')[
+                'poolclass'], QueuePool)
+        self.assertTrue(isinstance(db.Session, sessionmaker))
+        stats = db.pool_stats()
+        self.assertEquals(stats['pool'], 'StaticPool')
+        checkouts = stats['checkout']
+        db.engine.execute('select 1').close()
+        self.assertEquals(db.pool_stats()['checkout'], checkouts + 1)
+
+    def test_cancel_statement_spares_static_pool(self):
+        import os
+        import tempfile
+        from sqlalchemy import create_engine
+        connection = db.engine.raw_connection()
+        try:
+            self.assertFalse(db.cancel_statement(connection.connection))
+            self.assertEquals(connection.execute('select 1').fetchall(),
+                              [(1, )])
+        finally:
+            connection.close()
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        url = 'sqlite:///%s' % path
+        other = create_engine(url, **db.engine_options(url))
+        try:
+            connection = other.raw_connection()
+            self.assertTrue(db.cancel_statement(connection.connection,
+                                                other))
+            connection.close()
+        finally:
+            other.dispose()
+            os.remove(path)
+
+    def test_keyset_after(self):
+        from bauble.plugins.garden import Location
+        self.session.add_all(
+            [Location(code=u'L%02d' % i, name=i % 3 and u'bed' or None,
+                      description=i % 2 and u'desc%d' % (i % 5) or None)
+             for i in range(20)])
+        self.session.commit()
+        columns = [Location.name, Location.description, Location.id]
+        query = self.session.query(*columns).order_by(*columns)
+        expected = query.all()
+        pages = query.limit(3).all()
+        while True:
+            page = query.filter(db.keyset_after(columns, pages[-1])).\
+                limit(3).all()
+            pages.extend(page)
+            if len(page) < 3:
+                break
+        self.assertEquals(pages, expected)
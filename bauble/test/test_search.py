@@ -599,17 +599,15 @@ class SearchTests(BaubleTestCase):
         results = mapper_search.search(s, self.session)
         self.assertEqual(results, set([]))
 
+        # each search returns its own set, the None comparisons agree,
+        # and the empty string is one of the values not None
         s = 'genus where author is not None'
         resultsNone = mapper_search.search(s, self.session)
-        s = 'genus where NOT author = ""'
-        resultsEmptyString = mapper_search.search(s, self.session)
-        self.assertEqual(resultsNone, resultsEmptyString)
-
         s = 'genus where author != None'
-        resultsNone = mapper_search.search(s, self.session)
+        self.assertEqual(mapper_search.search(s, self.session), resultsNone)
         s = 'genus where NOT author = ""'
         resultsEmptyString = mapper_search.search(s, self.session)
-        self.assertEqual(resultsNone, resultsEmptyString)
+        self.assertTrue(resultsEmptyString.issubset(resultsNone))
 
     def test_search_by_query22id(self):
         "query with MapperSearch, joined tables, test on id of dependent table"
@@ -693,6 +691,65 @@ class SearchTests(BaubleTestCase):
         results = mapper_search.search(s, self.session)
         self.assertEqual(results, set([pp]))
 
+    def test_domain_expression_single_statement(self):
+        """all searchable columns are checked in one statement"""
+
+        from sqlalchemy import event
+        from bauble.plugins.garden.location import Location
+        l1 = Location(name=u'Greenhouse', code=u'GH1')
+        l2 = Location(name=u'GH2 house', code=u'Z')
+        l3 = Location(name=u'Other', code=u'X')
+        self.session.add_all([l1, l2, l3])
+        self.session.commit()
+
+        mapper_search = search.get_strategy('MapperSearch')
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            results = mapper_search.search('loc like GH%', self.session)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual(results, set([l1, l2]))
+        self.assertEqual(len(statements), 1)
+
+    def test_domain_expression_ids_only(self):
+        from bauble.plugins.garden.location import Location
+        l1 = Location(name=u'Greenhouse', code=u'GH1')
+        l2 = Location(name=u'Other', code=u'X')
+        self.session.add_all([l1, l2])
+        self.session.commit()
+
+        mapper_search = search.get_strategy('MapperSearch').bound(
+            self.session)
+        statement = mapper_search.parser.parse_string('loc=GH1').statement
+        results = statement.content.invoke(mapper_search, ids_only=True)
+        self.assertEqual(results, set([(Location, l1.id)]))
+        statement = mapper_search.parser.parse_string('loc=*').statement
+        results = statement.content.invoke(mapper_search, ids_only=True)
+        self.assertEqual(results, set([(Location, l1.id), (Location, l2.id)]))
+
+    def test_searches_do_not_share_session_and_results(self):
+        from sqlalchemy.orm import object_session
+        from bauble.plugins.garden.location import Location
+        l1 = Location(name=u'Greenhouse', code=u'GH1')
+        l2 = Location(name=u'Other', code=u'X')
+        self.session.add_all([l1, l2])
+        self.session.commit()
+
+        mapper_search = search.get_strategy('MapperSearch')
+        other = db.Session()
+        try:
+            first = mapper_search.search('loc=GH1', self.session)
+            second = mapper_search.search('loc=X', other)
+            self.assertEqual(first, set([l1]))
+            self.assertEqual([(i.code, object_session(i) is other)
+                              for i in second], [(u'X', True)])
+        finally:
+            other.close()
+
     def test_between_evaluate(self):
         'use BETWEEN value and value'
         Family = self.Family
@@ -783,6 +840,39 @@ class SearchTests(BaubleTestCase):
         results = mapper_search.search(s, self.session)
         self.assertEqual(results, set([sp]))
 
+    def test_search_by_values_one_union(self):
+        """values are looked for in one statement, then loaded per class"""
+
+        from sqlalchemy import event
+        from bauble.plugins.plants.species_model import Species
+        from bauble.plugins.plants.species_model import VernacularName
+        from bauble.plugins.garden.location import Location
+        sp = Species(sp=u"coccinea", genus=self.genus)
+        vn = VernacularName(name=u"coral", language=u"es", species=sp)
+        loc = Location(name=u'coral garden', code=u'CG')
+        self.session.add_all([sp, vn, loc])
+        self.session.commit()
+
+        mapper_search = search.get_strategy('MapperSearch')
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            results = mapper_search.search('coral family1', self.session)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual(results, set([sp, loc, self.family]))
+        # statements before the union only look for the text index
+        unions = [i for i, s in enumerate(statements) if 'UNION ALL' in s]
+        self.assertEqual(len(unions), 1)
+        self.assertFalse([s for s in statements[:unions[0]]
+                          if 'search_text_index' not in s])
+        # one IN query per class: species, location, family
+        self.assertEqual(len([s for s in statements[unions[0] + 1:]
+                              if ' IN (' in s]), 3)
+
 
 class InOperatorSearch(BaubleTestCase):
     def __init__(self, *args):
@@ -1206,3 +1296,397 @@ class BaubleSearchSearchTest(BaubleTestCase):
         search.search("So ha", self.session)
         self.assertTrue('SearchStrategy "So ha"(MapperSearch)' in 
                    self.handler.messages['bauble.search']['debug'])
+
+    def test_search_search_runs_Mapper_Search_once(self):
+        prefs.prefs['bauble.search.return_synonyms'] = True
+        search.search("genus like %", self.session)
+        messages = self.handler.messages['bauble.search']['debug']
+        self.assertEquals(
+            messages.count('SearchStrategy "genus like %"(MapperSearch)'), 1)
+
+    def test_search_search_expands_synonyms(self):
+        from bauble.plugins.plants.family import Family
+        from bauble.plugins.plants.genus import Genus
+        prefs.prefs['bauble.search.return_synonyms'] = True
+        f3 = Family(family=u'fam3', qualifier=u's. lat.')
+        g3 = Genus(family=f3, genus=u'Ixora')
+        g4 = Genus(family=f3, genus=u'Schetti')
+        self.session.add_all([f3, g3, g4])
+        g4.accepted = g3
+        self.session.commit()
+        results = search.search("Schetti", self.session)
+        self.assertEquals(sorted(i.genus for i in results),
+                          [u'Ixora', u'Schetti'])
+
+
+class SearchTestsSetAlgebra(SearchTests):
+    "run SearchTests on the INTERSECT/UNION/EXCEPT path"
+
+    def setUp(self):
+        super(SearchTestsSetAlgebra, self).setUp()
+        prefs.prefs[search.compile_queries_pref] = False
+
+
+class InOperatorSearchSetAlgebra(InOperatorSearch):
+    "run InOperatorSearch on the INTERSECT/UNION/EXCEPT path"
+
+    def setUp(self):
+        super(InOperatorSearchSetAlgebra, self).setUp()
+        prefs.prefs[search.compile_queries_pref] = False
+
+
+class CompiledQueryTests(BaubleTestCase):
+    queries = [
+        'genus where genus=Citrus',
+        'genus where species.sp=medica',
+        'genus where not species.sp=medica',
+        'genus where species.sp!=medica',
+        'genus where species=Empty',
+        'genus where species!=Empty',
+        'species where genus.family.family=Rutaceae',
+        'species where genus.family.family=Sapotaceae and sp like zap%',
+        'species where genus.family.family=Rutaceae or genus.genus=Pouteria',
+        'species where not sp_author=L.',
+        'species where not genus.family.qualifier=""',
+        'family where genera.species.sp contains zap',
+        'family where genera.species.genus.genus=Manilkara',
+        'species where genus.family.family=Rutaceae '
+        'and not (sp=medica or sp_author=L.)',
+        'genus where id in 1,3',
+        'species where id between 2 and 4',
+        'genus where count(species.id) > 2',
+        'genus where avg(species.id) >= 4',
+        'family where count(genera.species.id) > 2',
+        'family where count(distinct genera.species.sp_author) = 1',
+        'species where genus.family.family=Sapotaceae '
+        'and sum(genus.species.id) > 8',
+        ]
+
+    def setUp(self):
+        super(CompiledQueryTests, self).setUp()
+        from bauble.plugins.plants import Family, Genus, Species
+        f1 = Family(family=u'Rutaceae', qualifier=u'')
+        g1 = Genus(family=f1, genus=u'Citrus')
+        sp1 = Species(sp=u"medica", genus=g1, sp_author=u'L.')
+        sp2 = Species(sp=u"maxima", genus=g1)
+        sp3 = Species(sp=u"aurantium", genus=g1, sp_author=u'L.')
+        f2 = Family(family=u'Sapotaceae')
+        g2 = Genus(family=f2, genus=u'Manilkara')
+        sp4 = Species(sp=u'zapota', genus=g2)
+        sp5 = Species(sp=u'zapotilla', genus=g2, sp_author=u'Jacq.')
+        g3 = Genus(family=f2, genus=u'Pouteria')
+        sp6 = Species(sp=u'stipitata', genus=g3)
+        f3 = Family(family=u'Musaceae')
+        g4 = Genus(family=f3, genus=u'Musa')
+        self.session.add_all([f1, f2, f3, g1, g2, g3, g4,
+                              sp1, sp2, sp3, sp4, sp5, sp6])
+        self.session.commit()
+
+    def search(self, s, compile_queries):
+        prefs.prefs[search.compile_queries_pref] = compile_queries
+        mapper_search = search.get_strategy('MapperSearch')
+        return sorted(i.id for i in mapper_search.search(s, self.session))
+
+    def test_compiled_and_set_algebra_agree(self):
+        for s in self.queries:
+            self.assertEqual(self.search(s, True), self.search(s, False),
+                             s)
+
+    def test_compiled_is_single_statement(self):
+        from bauble.plugins.plants import Species
+        sp = search.SearchParser()
+        results = sp.parse_string(
+            'species where genus.family.family=Rutaceae '
+            'and not genus.genus=Musa or sp contains zap')
+        action = results.statement.content
+        action.session = self.session
+        action.domain = Species
+        sql = str(action.compile()).upper()
+        for keyword in ('INTERSECT', 'UNION', 'EXCEPT'):
+            self.assertFalse(keyword in sql, sql)
+
+    def test_to_many_is_exists(self):
+        from bauble.plugins.plants import Family
+        sp = search.SearchParser()
+        results = sp.parse_string('family where genera.species.sp=medica')
+        action = results.statement.content
+        action.session = self.session
+        action.domain = Family
+        sql = str(action.compile()).upper()
+        self.assertTrue('EXISTS' in sql, sql)
+        self.assertFalse('JOIN' in sql, sql)
+
+    def test_aggregates_fall_back(self):
+        s = 'genus where count(species.id) > 2'
+        self.assertEqual(self.search(s, True), self.search(s, False))
+        self.assertEqual(len(self.search(s, True)), 1)
+
+    def test_aggregates_are_correlated_subqueries(self):
+        from bauble.plugins.plants import Family
+        sp = search.SearchParser()
+        results = sp.parse_string(
+            'family where count(distinct genera.species.sp_author) > 0 '
+            'and not family=Musaceae')
+        action = results.statement.content
+        action.session = self.session
+        action.domain = Family
+        sql = str(action.compile()).upper()
+        for keyword in ('GROUP BY', 'HAVING', 'INTERSECT', 'EXCEPT'):
+            self.assertFalse(keyword in sql, sql)
+        self.assertTrue('COUNT(DISTINCT' in sql, sql)
+
+
+class ParseCacheTests(BaubleTestCase):
+    def test_normalize(self):
+        self.assertEqual(
+            search.SearchParser.normalize(
+                '  genus  where genus = "a  b"\tand  sp=\'c  d\' '),
+            'genus where genus = "a  b" and sp=\'c  d\'')
+
+    def test_cache_hits_normalized_text(self):
+        sp = search.SearchParser()
+        first = sp.parse_string('genus where genus=Ficus')
+        second = sp.parse_string('  genus   where genus=Ficus ')
+        self.assertTrue(first is second)
+        self.assertEqual((sp.cache.hits, sp.cache.misses), (1, 1))
+
+    def test_cache_is_bounded(self):
+        sp = search.SearchParser(cache_size=2)
+        for s in ['genus where id=1', 'genus where id=2',
+                  'genus where id=3']:
+            sp.parse_string(s)
+        self.assertEqual(len(sp.cache.storage), 2)
+
+    def test_parse_errors_are_not_cached(self):
+        sp = search.SearchParser()
+        # the statement parses a prefix of the text, so 'genus where'
+        # is a list of values, '=' has no parsable prefix at all
+        self.assertRaises(ParseException, sp.parse_string, '=')
+        self.assertEqual(len(sp.cache.storage), 0)
+
+    def test_cached_statement_can_be_reused(self):
+        from bauble.plugins.plants.family import Family
+        from bauble.plugins.plants.genus import Genus
+        family = Family(family=u'family1')
+        self.session.add_all([family, Genus(family=family, genus=u'genus1')])
+        self.session.commit()
+        mapper_search = search.get_strategy('MapperSearch')
+        for s in ('gen where genus=genus1', 'gen like genus%'):
+            first = mapper_search.search(s, self.session)
+            self.assertEqual([i.genus for i in first], [u'genus1'])
+            second = mapper_search.search(s, self.session)
+            self.assertEqual([i.genus for i in second], [u'genus1'])
+            statement = mapper_search.parser.parse_string(s).statement
+            self.assertEqual(statement.content.domain, 'gen')
+
+
+class TextIndexTests(BaubleTestCase):
+    def setUp(self):
+        super(TextIndexTests, self).setUp()
+        from sqlalchemy.exc import OperationalError
+        from bauble.plugins.plants.family import Family
+        from bauble.plugins.plants.genus import Genus
+        self.Genus = Genus
+        family = Family(family=u'Rubiaceae')
+        self.ixora = Genus(family=family, genus=u'Ixora')
+        self.coffea = Genus(family=family, genus=u'Coffea')
+        self.session.add_all([family, self.ixora, self.coffea])
+        self.session.commit()
+        try:
+            search.create_text_index()
+        except OperationalError:
+            raise SkipTest('sqlite without fts5 trigram tokenizer')
+
+    def search(self, s):
+        mapper_search = search.get_strategy('MapperSearch')
+        return mapper_search.search(s, self.session)
+
+    def compiled_sql(self, s):
+        results = search.SearchParser().parse_string(s)
+        action = results.statement.content
+        action.session = self.session
+        action.domain = self.Genus
+        return str(action.compile())
+
+    def test_contains_uses_index(self):
+        self.assertTrue('search_text_index' in
+                        self.compiled_sql('genus where genus contains xor'))
+        self.assertFalse('search_text_index' in
+                         self.compiled_sql('genus where genus = Ixora'))
+        self.assertEqual(self.search('genus where genus contains XOR'),
+                         set([self.ixora]))
+        self.assertEqual(self.search('genus where family.family has ubi'),
+                         set([self.ixora, self.coffea]))
+
+    def test_value_list_uses_index(self):
+        self.assertEqual(self.search('offe'), set([self.coffea]))
+
+    def test_index_follows_changes(self):
+        self.coffea.genus = u'Psychotria'
+        self.session.add(self.Genus(family=self.ixora.family,
+                                    genus=u'Coffeoides'))
+        self.session.delete(self.ixora)
+        self.session.commit()
+        self.assertEqual(
+            [i.genus for i in self.search('genus where genus contains off')],
+            [u'Coffeoides'])
+        self.assertEqual(self.search('genus where genus contains xor'),
+                         set())
+        self.assertEqual(
+            [i.genus for i in self.search('genus where genus has chot')],
+            [u'Psychotria'])
+
+    def test_drop(self):
+        search.drop_text_index()
+        self.assertFalse('search_text_index' in
+                         self.compiled_sql('genus where genus contains xor'))
+        self.assertEqual(self.search('genus where genus contains xor'),
+                         set([self.ixora]))
+
+    def test_indexed_columns(self):
+        columns = search.text_index_columns()
+        self.assertTrue(('genus', 'genus') in columns)
+        self.assertTrue(('family', 'family') in columns)
+
+
+class SearchPagedTests(BaubleTestCase):
+    def setUp(self):
+        super(SearchPagedTests, self).setUp()
+        from bauble.plugins.plants import Family, Genus, Species
+        family = Family(family=u'Rubiaceae')
+        self.genera = [Genus(family=family, genus=name)
+                       for name in (u'Psychotria', u'Coffea', u'Ixora')]
+        sp = Species(genus=self.genera[1], sp=u'arabica')
+        self.session.add_all([family, sp] + self.genera)
+        self.session.commit()
+
+    def test_query_is_ordered(self):
+        query, extra = search.search_paged('genus where id>0', self.session)
+        self.assertEqual([i.genus for i in query],
+                         [u'Coffea', u'Ixora', u'Psychotria'])
+        self.assertEqual(extra, [])
+
+    def test_same_results_as_search(self):
+        for s in ['genus where id>0', 'genus like %o%', 'gen=*',
+                  'species where genus.genus=Coffea', 'Coffea arabica']:
+            query, extra = search.search_paged(s, self.session)
+            self.assertEqual(set(query).union(extra),
+                             set(search.search(s, self.session)), s)
+
+    def test_value_search_not_paged(self):
+        self.assertEqual(search.search_paged('Coffea', self.session), None)
+
+
+class ResultCacheTests(BaubleTestCase):
+    def setUp(self):
+        super(ResultCacheTests, self).setUp()
+        from bauble.plugins.plants import Family, Genus
+        self.Genus = Genus
+        self.family = Family(family=u'Rubiaceae')
+        self.session.add_all([self.family] + [
+            Genus(family=self.family, genus=name)
+            for name in (u'Psychotria', u'Coffea', u'Ixora')])
+        self.session.commit()
+
+    def count_statements(self, func):
+        from sqlalchemy import event
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            result = func()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        return len(statements), result
+
+    def task(self, text, paged_above=1000):
+        from bauble.view import SearchTask
+        task = SearchTask(text, paged_above, None)
+        n, result = self.count_statements(lambda: task.search(self.session))
+        return n, task
+
+    def test_repeated_search_uses_cache(self):
+        s = 'genus where genus like %o% and family.family=Rubiaceae'
+        n, first = self.task(s)
+        self.assertTrue(n > 0)
+        n, second = self.task('  ' + s)
+        self.assertEqual(n, 0)
+        self.assertEqual(second.pairs, first.pairs)
+
+    def test_repeated_paged_search_uses_cache(self):
+        s = 'genus where genus like %o%'
+        n, first = self.task(s, paged_above=1)
+        n, second = self.task(s, paged_above=1)
+        self.assertEqual(n, 0)
+        self.assertEqual((second.extra, second.total), ([], 3))
+        self.assertTrue(second.query.session is self.session)
+        self.assertEqual([i.genus for i in second.query],
+                         [i.genus for i in first.query])
+
+    def test_changes_invalidate(self):
+        s = 'genus where genus like %o%'
+        self.assertEqual(len(self.task(s)[1].pairs), 3)
+        self.session.add(self.Genus(family=self.family, genus=u'Rondeletia'))
+        self.session.commit()
+        self.assertEqual(len(self.task(s)[1].pairs), 4)
+
+    def test_key_follows_date_and_prefs(self):
+        import datetime
+        s = 'genus where _created > |datetime|-1|'
+        key = search.result_cache_key(s)
+        self.assertTrue(datetime.date.today() in key)
+        compiled = prefs.prefs.get(search.compile_queries_pref, True)
+        prefs.prefs[search.compile_queries_pref] = not compiled
+        try:
+            self.assertNotEqual(search.result_cache_key(s), key)
+        finally:
+            prefs.prefs[search.compile_queries_pref] = compiled
+
+    def test_disabled_by_pref(self):
+        prefs.prefs[search.cache_results_pref] = False
+        self.task('genus where genus like %o%')
+        size = len(search.result_cache.storage)
+        self.task('genus where genus like %e%')
+        self.assertEqual(len(search.result_cache.storage), size)
+
+
+class ExplainTests(BaubleTestCase):
+    def setUp(self):
+        super(ExplainTests, self).setUp()
+        from bauble.plugins.plants import Family, Genus
+        family = Family(family=u'Rubiaceae')
+        self.session.add_all([family] + [
+            Genus(family=family, genus=name)
+            for name in (u'Psychotria', u'Coffea', u'Ixora')])
+        self.session.commit()
+
+    def test_explain_query(self):
+        summary, details = search.explain(
+            'genus where family.family=Rubiaceae and genus like %o%',
+            self.session)
+        self.assertTrue(summary.startswith('3 results'), summary)
+        for label in ('parse', 'SQL execution', 'ORM hydration',
+                      'tree model population'):
+            self.assertTrue(label in summary, label)
+        self.assertTrue('SELECT' in details, details)
+        if db.engine.name == 'sqlite':
+            self.assertTrue('SCAN' in details or 'SEARCH' in details,
+                            details)
+
+    def test_query_plan_processes_parameters(self):
+        "Enum and date parameters go through their bind processors"
+        import datetime
+        from bauble.plugins.garden import Accession
+        query = self.session.query(Accession).filter(
+            Accession.prov_type == u'Wild',
+            Accession.date_accd > datetime.date(2000, 1, 1))
+        plan = search.query_plan(query.statement, self.session)
+        if db.engine.name in ('sqlite', 'postgresql'):
+            self.assertTrue(plan)
+
+    def test_explain_value_search(self):
+        summary, details = search.explain('Coffea', self.session)
+        self.assertTrue(summary.startswith('1 results'), summary)
+        self.assertTrue('single statement' in details, details)
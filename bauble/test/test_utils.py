@@ -107,6 +107,26 @@ class CacheTest(TestCase):
         self.assertEquals(invoked, [1, 1, 1])
         self.assertEquals(sorted(cache.storage.keys()), [1, 4])
 
+    def test_cache_counts_hits_and_misses(self):
+        from bauble.utils import Cache
+
+        cache = Cache(2)
+        cache.get(1, lambda: 1)
+        cache.get(1, lambda: 1)
+        cache.get(2, lambda: 2)
+        cache.get(1, lambda: 1)
+        self.assertEquals((cache.hits, cache.misses), (2, 2))
+
+    def test_cache_clear(self):
+        from bauble.utils import Cache
+
+        cache = Cache(2)
+        cache.get(1, lambda: 1)
+        cache.clear()
+        self.assertEquals(cache.storage, {})
+        self.assertEquals(cache.get(1, lambda: 2), 2)
+        self.assertEquals((cache.hits, cache.misses), (0, 2))
+
 
 class GlobalFuncs(TestCase):
     def test_safe_int_valid(self):
@@ -123,3 +143,16 @@ class GlobalFuncs(TestCase):
 
     def test_safe_numeric_valid_not(self):
         self.assertEquals(utils.safe_numeric('123a.2'), 0)
+
+    def test_natsort_key(self):
+        items = ['a10', 'a9', 'a9.5', 'b', '2010.0012.1', '2010.0002.10', '']
+        self.assertEquals(
+            sorted(items, key=utils.natsort_key),
+            ['', '2010.0002.10', '2010.0012.1', 'a9', 'a9.5', 'a10', 'b'])
+
+    def test_natsort_keys_one_pass(self):
+        items = ['a10', 'a9', 'a9.5', 'b', '2010.0012.1', 'x..9', '007a']
+        self.assertEquals(utils.natsort_keys(items),
+                          [utils.natsort_key(i) for i in items])
+        self.assertEquals(utils.natsort_keys(['a9.5b'])[0],
+                          ([(1, 'a'), (0, 9.5), (1, 'b')], 'a9.5b'))
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2015 Mario Frasca <mario@anche.no>
+#
+# This file is part of ghini.desktop.
+#
+# ghini.desktop is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ghini.desktop is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ghini.desktop. If not, see <http://www.gnu.org/licenses/>.
+#
+# test for bauble.view
+#
+
+from sqlalchemy import event
+
+import bauble.db as db
+from bauble.test import BaubleTestCase
+from bauble.view import ResultsModel, SearchTask, SearchView
+
+
+class ResultsModelTests(BaubleTestCase):
+
+    def setUp(self):
+        super(ResultsModelTests, self).setUp()
+        from bauble.plugins.plants import Family, Genus
+        self.Family = Family
+        self.Genus = Genus
+        self.families = [Family(family=u'fam%02d' % i) for i in range(120)]
+        self.genus = Genus(family=self.families[0], genus=u'Ixora')
+        self.session.add_all(self.families + [self.genus])
+        self.session.commit()
+        self.ids = [i.id for i in self.families]
+        self.session.expunge_all()
+
+    def count_statements(self, func):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            func()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        return len(statements)
+
+    def test_values_are_loaded_in_batches(self):
+        model = ResultsModel(self.session, SearchView.row_meta)
+        model.append_pairs((self.Family, i) for i in self.ids)
+        self.assertEqual(len(model), 120)
+        self.assertEqual(model.loaded(), [])
+        n = self.count_statements(
+            lambda: [model[(i, )][0] for i in range(model.batch_size)])
+        self.assertEqual(n, 1)
+        self.assertEqual(len(model.loaded()), model.batch_size)
+        self.assertEqual(model[(3, )][0].family, u'fam03')
+
+    def test_cache_is_bounded(self):
+        model = ResultsModel(self.session, SearchView.row_meta)
+        model.cache_size = 10
+        model.batch_size = 5
+        model.append_pairs((self.Family, i) for i in self.ids)
+        for i in range(len(model)):
+            self.assertEqual(model[(i, )][0].id, self.ids[i])
+        self.assertEqual(len(model.loaded()), 10)
+
+    def test_placeholder_and_children(self):
+        model = ResultsModel(self.session, SearchView.row_meta)
+        model.append_pairs([(self.Family, self.ids[0])])
+        parent = model.get_iter((0, ))
+        self.assertTrue(model.iter_has_child(parent))
+        self.assertEqual(model.iter_n_children(parent), 1)
+        model.remove(model.iter_nth_child(parent, 0))
+        self.assertFalse(model.iter_has_child(parent))
+        genus = self.session.query(self.Genus).one()
+        model.append(parent, [genus])
+        self.assertEqual(model[(0, 0)][0], genus)
+        self.assertEqual(model.get_path(model.find(genus)[0]), (0, 0))
+
+    def test_children_pairs(self):
+        family = self.session.query(self.Family).get(self.ids[0])
+        aloe = self.Genus(family=family, genus=u'Aloe')
+        self.session.add(aloe)
+        self.session.commit()
+        ixora = self.session.query(self.Genus).filter_by(genus=u'Ixora').one()
+        # the commit expired the family, load it before counting
+        self.session.refresh(family)
+        pairs = []
+        n = self.count_statements(
+            lambda: pairs.extend(db.natsort_children('genera', family)))
+        self.assertEqual(n, 1)
+        self.assertEqual(pairs, [(self.Genus, aloe.id),
+                                 (self.Genus, ixora.id)])
+        self.session.expunge_all()
+        model = ResultsModel(self.session, SearchView.row_meta)
+        model.append_pairs([(self.Family, family.id)])
+        parent = model.get_iter((0, ))
+        model.remove(model.iter_nth_child(parent, 0))
+        model.append_pairs(pairs, parent)
+        self.assertEqual(model.iter_n_children(parent), 2)
+        self.assertEqual(model.loaded(), [])
+        self.assertEqual(model[(0, 1)][0].genus, u'Ixora')
+
+    def test_remove_renumbers(self):
+        model = ResultsModel(self.session, SearchView.row_meta)
+        model.append_pairs((self.Family, i) for i in self.ids[:3])
+        model.remove(model.get_iter((0, )))
+        self.assertEqual([row[0].id for row in model], self.ids[1:3])
+        self.assertEqual(model.get_path(model.get_iter((1, ))), (1, ))
+
+    def test_refresh_forgets_changed_rows(self):
+        model = ResultsModel(self.session, SearchView.row_meta)
+        model.append_pairs((self.Family, i) for i in self.ids[:3])
+        objs = [model[(i, )][0] for i in range(3)]
+        stale = model.refresh(set([('family', self.ids[1])]))
+        self.assertEqual(stale, [objs[1]])
+        self.assertEqual(len(model.loaded()), 2)
+        self.assertEqual(model[(1, )][0].id, self.ids[1])
+
+    def test_deleted_object_is_none(self):
+        model = ResultsModel(self.session, SearchView.row_meta)
+        model.append_pairs([(self.Family, self.ids[-1]),
+                            (self.Family, max(self.ids) + 1)])
+        self.assertEqual(model[(1, )][0], None)
+
+    def test_prefetch_loaded_with_batch(self):
+        row_meta = SearchView.ViewMeta()
+        row_meta[self.Family].set(prefetch=['genera'])
+        model = ResultsModel(self.session, row_meta)
+        model.append_pairs((self.Family, i) for i in self.ids)
+        n = self.count_statements(lambda: model[(0, )][0])
+        self.assertEqual(n, 2)
+        n = self.count_statements(
+            lambda: [model[(i, )][0].genera for i in range(model.batch_size)])
+        self.assertEqual(n, 0)
+        self.assertEqual(model[(0, )][0].genera[0].genus, u'Ixora')
+
+
+class SearchTaskTests(BaubleTestCase):
+
+    def setUp(self):
+        super(SearchTaskTests, self).setUp()
+        from bauble.plugins.plants import Family
+        self.Family = Family
+        families = [Family(family=u'fam%02d' % i) for i in range(120)]
+        self.session.add_all(families)
+        self.session.commit()
+        self.ids = [i.id for i in families]
+
+    def test_search_gives_sorted_pairs(self):
+        task = SearchTask('fam=fam01', 1000, None)
+        task.search(self.session)
+        self.assertEqual(task.pairs, [(self.Family, self.ids[1])])
+        self.assertEqual(task.query, None)
+        task = SearchTask('family where family like fam1%', 1000, None)
+        task.search(self.session)
+        self.assertEqual([id for cls, id in task.pairs],
+                         self.ids[10:20] + self.ids[100:])
+
+    def test_search_above_threshold_gives_query(self):
+        task = SearchTask('family where family like fam%', 100, None)
+        task.search(self.session)
+        self.assertEqual(task.pairs, [])
+        self.assertEqual(task.total, 120)
+        self.assertEqual(task.extra, [])
+        self.assertEqual(task.query.count(), 120)
+
+    def test_cancelled_task_does_not_call_back(self):
+        called = []
+        task = SearchTask('fam=fam01', 1000, called.append)
+        task.cancel()
+        task.run()
+        self.assertEqual(called, [])
+
+
+class HistoryCommandHandlerTests(BaubleTestCase):
+
+    def test_bad_filters(self):
+        from bauble.error import BaubleError
+        from bauble.view import HistoryCommandHandler
+        handler = HistoryCommandHandler()
+        for arg in ('id:abc', 'colour:red'):
+            self.assertRaises(BaubleError, handler, 'history', arg)
@@ -279,7 +279,8 @@ class GUI(object):
         if text == '':
             return
         self.add_to_history(text)
-        tokens = self.cmd_parser.parseString(text)
+        with utils.pyparsing_lock:
+            tokens = self.cmd_parser.parseString(text)
         cmd = None
         arg = None
         try:
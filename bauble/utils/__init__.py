@@ -46,6 +46,14 @@ from bauble.error import check
 from bauble import paths
 
 
+pyparsing_lock = threading.RLock()
+"""
+held while parsing with pyparsing: the search grammar turns on its
+packrat cache, which is global to all pyparsing grammars, and not
+thread safe.
+"""
+
+
 def read_in_chunks(file_object, chunk_size=1024):
     """read a chunk from a stream
 
@@ -71,26 +79,49 @@ class Cache:
     internally, the cache is stored in a dictionary, the key is the name of
     the image, the value is a pair with first the timestamp of the last usage
     of that key and second the value.
+
+    `hits` and `misses` count how many `get` calls were served from the
+    cache, and how many had to invoke the getter.
+
+    the cache can be shared by threads, the getter is invoked without
+    holding the lock, so two threads missing the same key both invoke
+    it.
     '''
 
     def __init__(self, size):
         self.size = size
         self.storage = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
 
     def get(self, key, getter, on_hit=lambda x: None):
-        if key in self.storage:
-            value = self.storage[key][1]
+        import time
+        with self.lock:
+            hit = key in self.storage
+            if hit:
+                self.hits += 1
+                value = self.storage[key][1]
+                self.storage[key] = time.time(), value
+            else:
+                self.misses += 1
+        if hit:
             on_hit(value)
-        else:
-            if len(self.storage) == self.size:
+            return value
+        value = getter()
+        with self.lock:
+            if key not in self.storage and len(self.storage) >= self.size:
                 # remove the oldest entry
                 k = min(zip(self.storage.values(), self.storage.keys()))[1]
                 del self.storage[k]
-            value = getter()
-        import time
-        self.storage[key] = time.time(), value
+            self.storage[key] = time.time(), value
         return value
 
+    def clear(self):
+        """forget all cached values, keeping the hit and miss counts"""
+        with self.lock:
+            self.storage.clear()
+
 
 class ImageLoader(threading.Thread):
     cache = Cache(12)  # class-global cached results
@@ -339,6 +370,12 @@ def clear_model(obj_with_model):
     if model is None:
         return
 
+    if isinstance(model, gtk.GenericTreeModel):
+        # custom models hold no gtk rows, just detach and clear them
+        obj_with_model.set_model(None)
+        model.clear()
+        return
+
     ncols = model.get_n_columns()
 
     def del_cb(model, path, iter, data=None):
@@ -905,21 +942,35 @@ def natsort_key(obj):
     generic objects as well.
 
     use like: sorted(some_list, key=utils.natsort_key)
+
+    when sorting many database objects prefer db.natsorted, which can
+    get the strings from the database instead of calling __str__.
     """
 
-    item = str(obj)
-    chunks = __natsort_rx.split(item)
-    for ii in range(len(chunks)):
-        if chunks[ii] and chunks[ii][0] in '0123456789':
-            if '.' in chunks[ii]:
-                numtype = float
-            else:
-                numtype = int
-            # wrap in tuple with '0' to explicitly specify numbers come first
-            chunks[ii] = (0, numtype(chunks[ii]))
-        else:
-            chunks[ii] = (1, chunks[ii])
-    return (chunks, item)
+    return natsort_keys([str(obj)])[0]
+
+
+def natsort_keys(strings):
+    """
+    return the list of natsort_key values for the strings, in one pass
+
+    the regular expression split does the scanning, the string is then
+    cut in alternating text and number chunks without testing every
+    chunk again, which is what natsort_key used to do per object.
+    """
+
+    split = __natsort_rx.split
+    result = []
+    append = result.append
+    for item in strings:
+        chunks = split(item)
+        # split with a group alternates text and number, text first:
+        # numbers are wrapped with 0 so that they come first
+        chunks[::2] = [(1, i) for i in chunks[::2]]
+        chunks[1::2] = [(0, float(i) if '.' in i else int(i))
+                        for i in chunks[1::2]]
+        append((chunks, item))
+    return result
 
 
 def delete_or_expunge(obj):
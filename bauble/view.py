@@ -20,6 +20,7 @@
 #
 # Description: the default view
 #
+import datetime
 import itertools
 import os
 import sys
@@ -37,7 +38,8 @@ import threading
 
 from bauble.i18n import _
 from pyparsing import ParseException
-from sqlalchemy.orm import object_session
+from sqlalchemy import select, union
+from sqlalchemy.orm import object_session, subqueryload_all
 import sqlalchemy.exc as saexc
 
 import bauble
@@ -412,23 +414,12 @@ class CountResultsTask(threading.Thread):
 
     def run(self):
         session = db.Session()
-        klass = self.klass
-        d = {}
-        for ndx in self.ids:
-            item = session.query(klass).filter(klass.id == ndx).one()
-            if self.__cancel:  # check whether caller asks to cancel
-                break
-            for k, v in item.top_level_count().items():
-                if isinstance(v, set):
-                    d[k] = v.union(d.get(k, set()))
-                else:
-                    d[k] = v + d.get(k, 0)
+        d = db.count_top_level(session, self.klass, self.ids,
+                               is_cancelled=lambda: self.__cancel)
         result = []
-        for k, v in sorted(d.items()):
+        for k, v in sorted((d or {}).items()):
             if isinstance(k, tuple):
                 k = k[1]
-            if isinstance(v, set):
-                v = len(v)
             result.append("%s: %d" % (k, v))
             if self.__cancel:  # check whether caller asks to cancel
                 break
@@ -448,6 +439,401 @@ class CountResultsTask(threading.Thread):
         session.close()
 
 
+def sort_results(results):
+    """
+    return the results without duplicates, grouped by type and
+    naturally sorted within each group.
+    """
+    groups = []
+
+    # sort by type so that groupby works properly
+    results = sorted(results, key=lambda x: type(x))
+
+    for key, group in itertools.groupby(results, key=lambda x: type(x)):
+        # return groups by type and natural sort each of the
+        # groups by their strings
+        groups.append(db.natsorted(group, reverse=True))
+
+    # sort the groups by type so we more or less always get the
+    # results by type in the same order
+    groups = sorted(groups, key=lambda x: type(x[0]), reverse=True)
+
+    ordered = []
+    added = set()
+    for obj in reversed(list(itertools.chain(*groups))):
+        if obj in added:  # only add unique object
+            continue
+        added.add(obj)
+        ordered.append(obj)
+    return ordered
+
+
+class SearchTask(threading.Thread):
+    """
+    Run a search on its own session, off the gtk main loop.
+
+    When done, the task invokes callback(task) in the main loop, with
+    the outcome in the task attributes: `pairs`, the sorted (class, id)
+    pairs of the results, or for searches with more than `paged_above`
+    results, `query` and `extra` as in search.search_paged, with extra
+    as (class, id) pairs, and `total`.  `error` is the exception the
+    search raised, and `details` its traceback.
+
+    The outcome is kept in search.result_cache, and reused by the tasks
+    searching the same text, unless the cache_results_pref is False.
+
+    A cancelled task invokes nothing, and interrupts the statement it
+    might be waiting for.
+    """
+    def __init__(self, text, paged_above, callback,
+                 group=None, verbose=None, **kwargs):
+        super(SearchTask, self).__init__(
+            group=group, target=None, name=None, verbose=verbose)
+        self.daemon = True
+        self.text = text
+        self.paged_above = paged_above
+        self.callback = callback
+        self.pairs = []
+        self.query = self.extra = self.total = None
+        self.error = self.details = None
+        self.__cancel = False
+        self.__lock = threading.Lock()
+        self.__connection = None
+
+    def cancel(self):
+        with self.__lock:
+            self.__cancel = True
+            if self.__connection is not None:
+                db.cancel_statement(self.__connection)
+
+    def search(self, session):
+        if not prefs.prefs.get(search.cache_results_pref, True):
+            self.compute(session)
+            return
+        key = search.result_cache_key(self.text), self.paged_above
+        self.pairs, query, self.extra, self.total = search.result_cache.get(
+            key, lambda: self.compute(session))
+        # the cached query is not bound to any session
+        self.query = query and query.with_session(session)
+
+    def compute(self, session):
+        """search, set the outcome attributes, and return them with the
+        query unbound from session, for search.result_cache
+        """
+        paged = search.search_paged(self.text, session)
+        if paged is not None:
+            query, extra = paged
+            extra = self.outside(query, extra, session)
+            self.total = query.order_by(None).count() + len(extra)
+            if self.total > self.paged_above:
+                self.query = query
+                self.extra = [(type(i), i.id) for i in extra]
+                return [], query.with_session(None), self.extra, self.total
+            results = set(extra).union(query)
+        else:
+            results = search.search(self.text, session)
+        self.pairs = [(type(i), i.id) for i in sort_results(results)]
+        return self.pairs, None, None, self.total
+
+    @staticmethod
+    def outside(query, extra, session):
+        """return the objects of extra that query does not return"""
+        klass = query.column_descriptions[0]['type']
+        ids = query.with_entities(klass.id).order_by(None)
+        inside = set()
+        for chunk in db.in_clause_chunks(
+                [i.id for i in extra if type(i) is klass], session.bind):
+            inside.update(id for (id, ) in ids.filter(klass.id.in_(chunk)))
+        return [i for i in extra if type(i) is not klass or
+                i.id not in inside]
+
+    def run(self):
+        session = db.Session()
+        try:
+            with self.__lock:
+                if self.__cancel:
+                    return
+                self.__connection = session.connection().connection
+            self.search(session)
+        except Exception, e:
+            self.error = e
+            self.details = traceback.format_exc()
+        finally:
+            with self.__lock:
+                self.__connection = None
+            session.close()
+        if not self.__cancel:
+            gobject.idle_add(self.callback, self)
+
+
+class ResultRow(object):
+    """a row in a ResultsModel
+
+    rows of mapped objects hold the class and id of the object, other
+    rows (like the placeholder children) hold their value.  `children`
+    is None until the children of the row are asked for.
+    """
+    __slots__ = ('cls', 'id', 'value', 'parent', 'index', 'children')
+
+    def __init__(self, cls=None, id=None, value=None, parent=None, index=0,
+                 children=None):
+        self.cls = cls
+        self.id = id
+        self.value = value
+        self.parent = parent
+        self.index = index
+        self.children = children
+
+
+class ResultsModel(gtk.GenericTreeModel):
+    """
+    The tree model of the search results, holding (class, id) pairs.
+
+    Objects are loaded when the view asks for the value of their row, a
+    batch of neighbouring rows at a time, and kept in a bounded cache
+    per class, so that the session can release the others.  Rows of a
+    class with children (see SearchView.row_meta) show a placeholder
+    child, until the view replaces it with the real children, on
+    expansion.
+
+    Besides the gtk.TreeModel interface, the model offers the subset of
+    gtk.TreeStore used by the SearchView: append, remove and clear.
+    """
+
+    cache_size = 500
+    batch_size = 50
+
+    def __init__(self, session, row_meta):
+        gtk.GenericTreeModel.__init__(self)
+        # the model keeps its ResultRow objects alive
+        self.props.leak_references = False
+        self.session = session
+        self.row_meta = row_meta
+        self.rows = []
+        self.caches = {}
+
+    def _cache(self, cls):
+        try:
+            return self.caches[cls]
+        except KeyError:
+            return self.caches.setdefault(cls, utils.Cache(self.cache_size))
+
+    def _siblings(self, row):
+        if row.parent is None:
+            return self.rows
+        return row.parent.children
+
+    def _children(self, row):
+        if row.children is None:
+            has_child = self.on_iter_has_child(row)
+            row.children = []
+            if has_child:
+                row.children.append(ResultRow(value='-', parent=row,
+                                              children=[]))
+        return row.children
+
+    def _new_row(self, obj, parent, index):
+        if isinstance(obj, db.Base) and obj.id is not None:
+            self._cache(type(obj)).get(obj.id, lambda: obj)
+            return ResultRow(type(obj), obj.id, parent=parent, index=index)
+        return ResultRow(value=obj, parent=parent, index=index)
+
+    def get_object(self, row):
+        """return the value of row, loading it if needed"""
+        if row.cls is None:
+            return row.value
+        cache = self._cache(row.cls)
+        if row.id not in cache.storage:
+            # load the next rows of the same class along with this one
+            siblings = self._siblings(row)
+            ids = [i.id for i in siblings[row.index:
+                                          row.index + self.batch_size]
+                   if i.cls is row.cls and i.id not in cache.storage]
+            query = self.session.query(row.cls).options(
+                *self.row_meta[row.cls].loader_options()).filter(
+                row.cls.id.in_(ids))
+            for obj in query:
+                cache.get(obj.id, lambda: obj)
+        return cache.get(row.id,
+                         lambda: self.session.query(row.cls).get(row.id))
+
+    def loaded(self):
+        """return the objects currently loaded by the model"""
+        return [value for cache in self.caches.values()
+                for timestamp, value in cache.storage.values()
+                if value is not None]
+
+    def find(self, obj):
+        """return the iters to the rows holding obj, without loading"""
+        from sqlalchemy import inspect
+        key = None
+        if isinstance(obj, db.Base) and inspect(obj).identity:
+            key = type(obj), inspect(obj).identity[0]
+        result = []
+        stack = list(self.rows)
+        while stack:
+            row = stack.pop()
+            if ((key and (row.cls, row.id) == key) or
+                    (row.cls is None and row.value == obj)):
+                result.append(self.create_tree_iter(row))
+            stack.extend(row.children or [])
+        return result
+
+    def append_pairs(self, pairs, parent=None):
+        """append rows holding the (class, id) pairs, at top level or
+        to the children of parent"""
+        if parent is None:
+            parent_row, siblings = None, self.rows
+        else:
+            parent_row = self.get_user_data(parent)
+            siblings = self._children(parent_row)
+        for cls, id in pairs:
+            row = ResultRow(cls, id, parent=parent_row, index=len(siblings))
+            siblings.append(row)
+            path = self.on_get_path(row)
+            self.row_inserted(path, self.get_iter(path))
+            if parent_row is not None and len(siblings) == 1:
+                self.row_has_child_toggled(path[:-1], parent)
+
+    def append(self, parent, values):
+        """append a row holding values[0] to the children of parent"""
+        if parent is None:
+            parent_row, siblings = None, self.rows
+        else:
+            parent_row = self.get_user_data(parent)
+            siblings = self._children(parent_row)
+        row = self._new_row(values[0], parent_row, len(siblings))
+        row.children = []
+        siblings.append(row)
+        path = self.on_get_path(row)
+        treeiter = self.get_iter(path)
+        self.row_inserted(path, treeiter)
+        if parent_row is not None and len(siblings) == 1:
+            self.row_has_child_toggled(path[:-1], parent)
+        return treeiter
+
+    def remove(self, treeiter):
+        """remove the row at treeiter, with its children"""
+        row = self.get_user_data(treeiter)
+        path = self.on_get_path(row)
+        siblings = self._siblings(row)
+        del siblings[row.index]
+        for i in siblings[row.index:]:
+            i.index -= 1
+        self.row_deleted(path)
+        if row.parent is not None and not siblings:
+            self.row_has_child_toggled(
+                path[:-1], self.create_tree_iter(row.parent))
+        return False
+
+    def refresh(self, changed):
+        """forget the objects of the rows whose (table name, id) is in
+        changed, and of their ancestors, and tell the view these rows
+        changed.  return the forgotten objects.
+        """
+        marked = {}
+        stack = list(self.rows)
+        while stack:
+            row = stack.pop()
+            stack.extend(row.children or [])
+            if (row.cls is None or
+                    (row.cls.__table__.name, row.id) not in changed):
+                continue
+            while row is not None and id(row) not in marked:
+                marked[id(row)] = row
+                row = row.parent
+        result = []
+        for row in marked.values():
+            if row.cls is None:
+                continue
+            timestamp, obj = self._cache(row.cls).storage.pop(
+                row.id, (None, None))
+            if obj is not None:
+                result.append(obj)
+            path = self.on_get_path(row)
+            self.row_changed(path, self.get_iter(path))
+        return result
+
+    def stale_children(self, tables):
+        """return the paths of the rows whose children come from one of
+        tables, as these may have new children.  rows below one of the
+        returned rows are not returned.
+        """
+        result = []
+        stack = list(self.rows)
+        while stack:
+            row = stack.pop()
+            children = [i for i in row.children or [] if i.cls is not None]
+            if any(i.cls.__table__.name in tables for i in children):
+                result.append(self.on_get_path(row))
+            else:
+                stack.extend(children)
+        return sorted(result)
+
+    def clear(self):
+        """forget all rows, to be used when detached from the view"""
+        self.rows = []
+        self.caches = {}
+
+    def on_get_flags(self):
+        return gtk.TREE_MODEL_ITERS_PERSIST
+
+    def on_get_n_columns(self):
+        return 1
+
+    def on_get_column_type(self, index):
+        return gobject.TYPE_PYOBJECT
+
+    def on_get_iter(self, path):
+        rows = self.rows
+        row = None
+        for i in path:
+            if i >= len(rows):
+                return None
+            row = rows[i]
+            rows = self._children(row)
+        return row
+
+    def on_get_path(self, row):
+        path = []
+        while row is not None:
+            path.append(row.index)
+            row = row.parent
+        return tuple(reversed(path))
+
+    def on_get_value(self, row, column):
+        return self.get_object(row)
+
+    def on_iter_next(self, row):
+        siblings = self._siblings(row)
+        if row.index + 1 < len(siblings):
+            return siblings[row.index + 1]
+        return None
+
+    def on_iter_children(self, row):
+        return self.on_iter_nth_child(row, 0)
+
+    def on_iter_has_child(self, row):
+        if row.children is not None:
+            return len(row.children) > 0
+        return (row.cls is not None and
+                self.row_meta[row.cls].children is not None)
+
+    def on_iter_n_children(self, row):
+        if row is None:
+            return len(self.rows)
+        return len(self._children(row))
+
+    def on_iter_nth_child(self, row, n):
+        rows = self.rows if row is None else self._children(row)
+        if n < len(rows):
+            return rows[n]
+        return None
+
+    def on_iter_parent(self, row):
+        return row.parent
+
+
 class SearchView(pluginmgr.View):
     """
     The SearchView is the main view for Ghini.  It manages the search
@@ -464,16 +850,25 @@ class SearchView(pluginmgr.View):
         class Meta(object):
             def __init__(self):
                 self.children = None
+                self.children_loader = None
                 self.infobox = None
                 self.markup_func = None
+                self.prefetch = []
                 self.actions = []
 
             def set(self, children=None, infobox=None, context_menu=None,
-                    markup_func=None):
+                    markup_func=None, prefetch=None, children_loader=None):
                 '''
                 :param children: where to find the children for this type,
                     can be a callable of the form C{children(row)}
 
+                :param children_loader: a callable of the form
+                    C{children_loader(row)}, returning the (class, id)
+                    pairs of the children, in the order they are shown,
+                    from one query.  when given, it is used instead of
+                    children on expansion, and the children objects are
+                    only loaded when their rows are drawn.
+
                 :param infobox: the infobox for this type
 
                 :param context_menu: a dict describing the context menu used
@@ -484,16 +879,30 @@ class SearchView(pluginmgr.View):
                 the instances __str__() function is called...the
                 strings returned by this function should escape any
                 non markup characters
+
+                :param prefetch: the relationship paths, like
+                'plants.location', used by the search_view_markup_pair
+                of this type.  they are loaded along with each batch
+                of rows, so that drawing the rows does not lazy load
+                them one object at a time.
                 '''
                 self.children = children
+                self.children_loader = children_loader
                 self.infobox = infobox
                 self.markup_func = markup_func
+                self.prefetch = prefetch or []
                 self.context_menu = context_menu
                 self.actions = []
                 if self.context_menu:
                     self.actions = filter(lambda x: isinstance(x, Action),
                                           self.context_menu)
 
+            def loader_options(self):
+                '''
+                the query options loading the prefetch relationships
+                '''
+                return [subqueryload_all(path) for path in self.prefetch]
+
             def get_children(self, obj):
                 '''
                 :param obj: get the children from obj according to
@@ -547,6 +956,18 @@ class SearchView(pluginmgr.View):
         self.add_notes_page_to_bottom_notebook()
         self.running_threads = []
 
+        # the not yet shown results of a paged search, see populate_pages
+        self.pending_results = None
+
+        # the running search, see search
+        self.search_task = None
+
+        # the database generation the results reflect, see update
+        self.refreshed = db.generation
+
+        # the rendered rows, see cell_data_func
+        self.markup_cache = utils.Cache(self.markup_cache_size)
+
     def add_notes_page_to_bottom_notebook(self):
         '''add notebook page for notes
 
@@ -766,95 +1187,122 @@ class SearchView(pluginmgr.View):
 
     nresults_statusbar_context = 'searchview.nresults'
 
+    # searches resolving to one domain with more results than this are
+    # shown in pages of `page_size` rows, as the user scrolls down
+    page_size = 200
+    paged_above = 1000
+
+    # number of rendered rows kept by the markup cache
+    markup_cache_size = 1000
+
     def search(self, text):
         """
         search the database using text
+
+        the search runs in a SearchTask, on_search_done shows its results.
+        a search still running is cancelled.
         """
         # set the text in the entry even though in most cases the entry already
         # has the same text in it, this is in case this method was called from
         # outside the class so the entry and search results match
         logger.debug('SearchView.search(%s)' % text)
-        error_msg = None
-        error_details_msg = None
-        # stop whatever it might still be doing
+        # stop whatever it might still be doing, without waiting for
+        # the previous search: its results will be ignored
+        if self.search_task is not None:
+            self.search_task.cancel()
         self.cancel_threads()
-        if False:
-            # create a new session for each search...
-            self.session.close()
-            self.session = db.Session()
-        else:
-            # reuse session, but undo all that has not been committed
-            self.session.rollback()
-        bold = '<b>%s</b>'
-        results = []
-        try:
-            results = search.search(text, self.session)
-        except ParseException, err:
-            error_msg = _('Error in search string at column %s') % err.column
-        except (BaubleError, AttributeError, Exception, SyntaxError), e:
-            logger.debug(traceback.format_exc())
-            error_msg = _('** Error: %s') % utils.xml_safe(e)
-            error_details_msg = utils.xml_safe(traceback.format_exc())
+        self.pending_results = None
+        # reuse session, but undo all that has not been committed
+        self.session.rollback()
+        statusbar = bauble.gui.widgets.statusbar
+        sbcontext_id = statusbar.get_context_id('searchview.nresults')
+        statusbar.pop(sbcontext_id)
+        statusbar.push(sbcontext_id, _('searching...'))
+        self.refreshed = db.generation
+        self.search_task = SearchTask(text, self.paged_above,
+                                      self.on_search_done)
+        self.search_task.start()
 
-        if error_msg:
-            bauble.gui.show_error_box(error_msg, error_details_msg)
-            return
+    def on_search_done(self, task):
+        """
+        show the results of a SearchTask, unless a newer search started.
+        """
+        if task is not self.search_task:
+            return False
+        self.search_task = None
+        statusbar = bauble.gui.widgets.statusbar
+        sbcontext_id = statusbar.get_context_id('searchview.nresults')
+        statusbar.pop(sbcontext_id)
+
+        if isinstance(task.error, ParseException):
+            bauble.gui.show_error_box(
+                _('Error in search string at column %s') % task.error.column)
+            return False
+        elif task.error is not None:
+            logger.debug(task.details)
+            bauble.gui.show_error_box(
+                _('** Error: %s') % utils.xml_safe(task.error),
+                utils.xml_safe(task.details))
+            return False
 
         # not error
+        bold = '<b>%s</b>'
         utils.clear_model(self.results_view)
         self.update_infobox()
-        statusbar = bauble.gui.widgets.statusbar
-        sbcontext_id = statusbar.get_context_id('searchview.nresults')
-        statusbar.pop(sbcontext_id)
-        if len(results) == 0:
+        pairs = task.pairs
+        if task.query is not None:
+            query = task.query.with_session(self.session)
+            extra = task.extra
+            self.populate_pages(query, extra)
+            statusbar.push(sbcontext_id, _('counting results'))
+            klass = query.column_descriptions[0]['type']
+            if all(cls is klass for cls, id in extra):
+                dots_thread = self.start_thread(AddOneDot())
+                ids = query.with_entities(klass.id).order_by(None).statement
+                if extra:
+                    ids = union(ids, select([klass.id]).where(
+                        klass.id.in_([id for cls, id in extra])))
+                self.start_thread(CountResultsTask(klass, ids, dots_thread))
+            else:
+                statusbar.push(sbcontext_id,
+                               _('size of non homogeneous result: %s') %
+                               task.total)
+            self.results_view.set_cursor(0)
+            gobject.idle_add(lambda: self.results_view.scroll_to_cell(0))
+        elif len(pairs) == 0:
             model = gtk.ListStore(str)
             msg = bold % cgi.escape(
-                _('Couldn\'t find anything for search: "%s"') % text)
+                _('Couldn\'t find anything for search: "%s"') % task.text)
             model.append([msg])
             self.results_view.set_model(model)
         else:
-            if len(results) > 5000:
+            if len(pairs) > 5000:
                 msg = _('This query returned %s results.  It may take a '
                         'long time to get all the data. Are you sure you '
-                        'want to continue?') % len(results)
+                        'want to continue?') % len(pairs)
                 if not utils.yes_no_dialog(msg):
-                    return
-            statusbar.push(sbcontext_id, _("Retrieving %s search "
-                                           "results...") % len(results))
-            try:
-                # don't bother with a task if the results are small,
-                # this keeps the screen from flickering when the main
-                # window is set to a busy state
-                import time
-                start = time.time()
-                if len(results) > 1000:
-                    self.populate_results(results)
-                else:
-                    task = self._populate_worker(results)
-                    while True:
-                        try:
-                            task.next()
-                        except StopIteration:
-                            break
-                logger.debug(time.time() - start)
-            except StopIteration:
-                return
+                    return False
+            # the model loads the objects when they are shown
+            model = ResultsModel(self.session, self.row_meta)
+            model.append_pairs(pairs)
+            self.results_view.freeze_child_notify()
+            self.results_view.set_model(model)
+            self.results_view.thaw_child_notify()
+            statusbar.push(sbcontext_id, _('counting results'))
+            classes = set(cls for cls, id in pairs)
+            if len(classes) == 1:
+                dots_thread = self.start_thread(AddOneDot())
+                self.start_thread(CountResultsTask(
+                    classes.pop(), [id for cls, id in pairs], dots_thread))
             else:
-                statusbar.pop(sbcontext_id)
-                statusbar.push(sbcontext_id, _('counting results'))
-                if len(set(item.__class__ for item in results)) == 1:
-                    dots_thread = self.start_thread(AddOneDot())
-                    self.start_thread(CountResultsTask(
-                        results[0].__class__, [i.id for i in results],
-                        dots_thread))
-                else:
-                    statusbar.push(sbcontext_id,
-                                   _('size of non homogeneous result: %s') %
-                                   len(results))
-                self.results_view.set_cursor(0)
-                gobject.idle_add(lambda: self.results_view.scroll_to_cell(0))
+                statusbar.push(sbcontext_id,
+                               _('size of non homogeneous result: %s') %
+                               len(pairs))
+            self.results_view.set_cursor(0)
+            gobject.idle_add(lambda: self.results_view.scroll_to_cell(0))
 
         self.update_bottom_notebook()
+        return False
 
     def remove_children(self, model, parent):
         """
@@ -876,13 +1324,18 @@ class SearchView(pluginmgr.View):
         view.collapse_row(path)
         self.remove_children(model, treeiter)
         try:
-            kids = self.row_meta[type(row)].get_children(row)
+            meta = self.row_meta[type(row)]
+            if (meta.children_loader is not None and
+                    isinstance(model, ResultsModel)):
+                kids = meta.children_loader(row)
+            else:
+                kids = db.natsorted(meta.get_children(row))
             if len(kids) == 0:
                 return True
         except saexc.InvalidRequestError, e:
             logger.debug(utils.utf8(e))
             model = self.results_view.get_model()
-            for found in utils.search_tree_model(model, row):
+            for found in model.find(row):
                 model.remove(found)
             return True
         except Exception, e:
@@ -890,8 +1343,7 @@ class SearchView(pluginmgr.View):
             logger.debug(traceback.format_exc())
             return True
         else:
-            self.append_children(
-                model, treeiter, sorted(kids, key=utils.natsort_key))
+            self.append_children(model, treeiter, kids)
             return False
 
     def populate_results(self, results, check_for_kids=False):
@@ -909,47 +1361,20 @@ class SearchView(pluginmgr.View):
         model. This method is usually called by self.populate_results()
         """
         nresults = len(results)
-        model = gtk.TreeStore(object)
-        model.set_default_sort_func(lambda *args: -1)
-        model.set_sort_column_id(-1, gtk.SORT_ASCENDING)
+        model = ResultsModel(self.session, self.row_meta)
         utils.clear_model(self.results_view)
 
-        groups = []
-
-        # sort by type so that groupby works properly
-        results = sorted(results, key=lambda x: type(x))
-
-        for key, group in itertools.groupby(results, key=lambda x: type(x)):
-            # return groups by type and natural sort each of the
-            # groups by their strings
-            groups.append(sorted(group, key=utils.natsort_key, reverse=True))
-
-        # sort the groups by type so we more or less always get the
-        # results by type in the same order
-        groups = sorted(groups, key=lambda x: type(x[0]), reverse=True)
-
         update_every = 200
         steps_so_far = 0
 
-        # iterate over slice of size "steps", yield after adding each
-        # slice to the model
-        #for obj in itertools.islice(itertools.chain(*groups), 0,None, steps):
-        #for obj in itertools.islice(itertools.chain(results), 0,None, steps):
-
-        added = set()
-        for obj in itertools.chain(*groups):
-            if obj in added:  # only add unique object
-                continue
-            else:
-                added.add(obj)
-            parent = model.prepend(None, [obj])
-            obj_type = type(obj)
+        for obj in sort_results(results):
             if check_for_kids:
-                kids = self.row_meta[obj_type].get_children(obj)
+                parent = model.append(None, [obj])
+                kids = self.row_meta[type(obj)].get_children(obj)
                 if len(kids) > 0:
-                    model.prepend(parent, ['-'])
-            elif self.row_meta[obj_type].children is not None:
-                model.prepend(parent, ['-'])
+                    model.append(parent, ['-'])
+            else:
+                model.append_pairs([(type(obj), obj.id)])
             #steps_so_far += chunk_size
             steps_so_far += 1
             if steps_so_far % update_every == 0:
@@ -961,16 +1386,77 @@ class SearchView(pluginmgr.View):
         self.results_view.set_model(model)
         self.results_view.thaw_child_notify()
 
+    def populate_pages(self, query, extra):
+        """
+        Show extra, then the first page of the results of query.
+
+        The query is read one page at a time, as the user scrolls down,
+        see on_results_scrolled, each page by its own keyset query, so
+        that no cursor stays open between pages.
+
+        :param query: an ordered query
+        :param extra: a list of (class, id) pairs, to show before the
+            query results
+        """
+        model = ResultsModel(self.session, self.row_meta)
+        shown = set(extra)
+        model.append_pairs(extra)
+        klass = query.column_descriptions[0]['type']
+        columns = search.get_strategy('MapperSearch').result_order(klass)
+        rows = query.with_entities(*columns)
+
+        def pending():
+            page = rows.limit(self.page_size).all()
+            while page:
+                for row in page:
+                    if (klass, row[-1]) not in shown:
+                        yield klass, row[-1]
+                if len(page) < self.page_size:
+                    return
+                page = rows.filter(db.keyset_after(
+                    columns, page[-1], self.session.bind)).\
+                    limit(self.page_size).all()
+        self.pending_results = pending()
+        self.append_page(model)
+        self.results_view.freeze_child_notify()
+        self.results_view.set_model(model)
+        self.results_view.thaw_child_notify()
+
+    def append_page(self, model):
+        """
+        Append the next page of the pending results to model.
+        """
+        if self.pending_results is None:
+            return
+        pairs = list(itertools.islice(self.pending_results, self.page_size))
+        model.append_pairs(pairs)
+        if len(pairs) < self.page_size:
+            self.pending_results = None
+
+    def on_results_scrolled(self, adjustment):
+        """
+        Append the next page of results when the user approaches the end.
+        """
+        if self.pending_results is None:
+            return
+        if adjustment.value + 2 * adjustment.page_size >= adjustment.upper:
+            self.append_page(self.results_view.get_model())
+
     def append_children(self, model, parent, kids):
         """
         append object to a parent iter in the model
 
         :param model: the model the append to
         :param parent:  the parent gtk.TreeIter
-        :param kids: a list of kids to append
+        :param kids: a list of kids to append, or of the (class, id)
+            pairs returned by a children_loader
         @return: the model with the kids appended
         """
         check(parent is not None, "append_children(): need a parent")
+        if kids and isinstance(kids[0], tuple):
+            # the rows are loaded, a batch at a time, when drawn
+            model.append_pairs(kids, parent)
+            return model
         for k in kids:
             i = model.append(parent, [k])
             if self.row_meta[type(k)].children is not None:
@@ -988,7 +1474,16 @@ class SearchView(pluginmgr.View):
         value = model[treeiter][0]
         #logger.debug('TBR: far too detailed, please do not keep us here')
         #logger.debug('TBR: %s' % value)
-        if isinstance(value, basestring):
+        if value is None:
+            # the object has been deleted since the search
+            cell.set_property('markup', '')
+            ref = gtk.TreeRowReference(model, path)
+
+            def remove_deleted():
+                if ref.valid():
+                    model.remove(model.get_iter(ref.get_path()))
+            gobject.idle_add(remove_deleted)
+        elif isinstance(value, basestring):
             cell.set_property('markup', value)
         else:
             # if the value isn't part of a session then add it to the
@@ -1004,17 +1499,13 @@ class SearchView(pluginmgr.View):
                 else:
                     self.session.merge(value)
             try:
-                r = value.search_view_markup_pair()
-                #logger.debug('TBR: %s' % str(r))
-                try:
-                    main, substr = r
-                except:
-                    main = r
-                    substr = '(%s)' % type(value).__name__
-                cell.set_property(
-                    'markup', '%s\n%s' %
-                    (_mainstr_tmpl % utils.utf8(main),
-                     _substr_tmpl % utils.utf8(substr)))
+                if isinstance(value, db.Base) and value.id is not None:
+                    key = type(value), value.id, value._last_updated
+                    markup = self.markup_cache.get(
+                        key, lambda: self.markup(value))
+                else:
+                    markup = self.markup(value)
+                cell.set_property('markup', markup)
 
             except (saexc.InvalidRequestError, TypeError), e:
                 logger.warning(
@@ -1023,10 +1514,8 @@ class SearchView(pluginmgr.View):
 
                 def remove():
                     model = self.results_view.get_model()
-                    self.results_view.set_model(None)  # detach model
-                    for found in utils.search_tree_model(model, value):
+                    for found in model.find(value):
                         model.remove(found)
-                    self.results_view.set_model(model)
                 gobject.idle_add(remove)
 
             except Exception, e:
@@ -1035,6 +1524,22 @@ class SearchView(pluginmgr.View):
                     (type(e), e))
                 raise
 
+    def markup(self, value):
+        """
+        return the markup of the row holding value
+
+        cell_data_func caches the result by class, id and last update
+        of value, update() empties the cache.
+        """
+        r = value.search_view_markup_pair()
+        try:
+            main, substr = r
+        except:
+            main = r
+            substr = '(%s)' % type(value).__name__
+        return '%s\n%s' % (_mainstr_tmpl % utils.utf8(main),
+                            _substr_tmpl % utils.utf8(substr))
+
     def get_expanded_rows(self):
         '''
         return all the rows in the model that are expanded
@@ -1130,11 +1635,24 @@ class SearchView(pluginmgr.View):
 
     def update(self):
         """
-        Expire all the children in the model, collapse everything,
-        reexpand the rows to the previous state where possible and
-        update the infobox.
+        Redraw the rows changed since the previous update, and update
+        the infobox.
+
+        The changes are the rows recorded by the HistoryExtension, see
+        db.changed_rows: their objects are expired, the rows holding
+        them and their ancestors are redrawn, and the expanded rows
+        with children from a changed table are expanded again.  When
+        the changes are not known, expire all the objects, collapse
+        everything and reexpand the rows to the previous state where
+        possible.
         """
         logger.debug('SearchView::update')
+        changed = db.changed_rows(self.refreshed)
+        self.refreshed = db.generation
+        model = self.results_view.get_model()
+        if changed is not None and isinstance(model, ResultsModel):
+            self.update_rows(model, changed)
+            return
         model, paths = self.results_view.get_selection().get_selected_rows()
         ref = None
         try:
@@ -1145,16 +1663,19 @@ class SearchView(pluginmgr.View):
             pass
 
         self.session.expire_all()
+        # the markup also depends on related objects, which do not
+        # change the _last_updated of the row object
+        self.markup_cache.clear()
 
         # the invalidate_str_cache() method are specific to Species
         # and Accession right now....it's a bit of a hack since there's
         # no real interface that the method complies to...but it does
         # fix our string caching issues
-        def invalidate_cache(model, path, treeiter, data=None):
-            obj = model[path][0]
-            if hasattr(obj, 'invalidate_str_cache'):
-                obj.invalidate_str_cache()
-        model.foreach(invalidate_cache)
+        if isinstance(model, ResultsModel):
+            # objects that are not loaded have no cached strings
+            for obj in model.loaded():
+                if hasattr(obj, 'invalidate_str_cache'):
+                    obj.invalidate_str_cache()
         expanded_rows = self.get_expanded_rows()
         self.results_view.collapse_all()
         # expand_to_all_refs will invalidate the ref so get the path first
@@ -1166,6 +1687,33 @@ class SearchView(pluginmgr.View):
         self.expand_to_all_refs(expanded_rows)
         self.results_view.set_cursor(path)
 
+    def update_rows(self, model, changed):
+        """
+        Redraw the rows of model holding the changed (table name, id)
+        pairs, see update.
+        """
+        if not changed:
+            return
+        stale = model.refresh(changed)
+        stale.extend(obj for obj in self.session.identity_map.values()
+                     if isinstance(obj, db.Base) and
+                     (obj.__table__.name, obj.id) in changed)
+        for obj in stale:
+            if obj in self.session:
+                self.session.expire(obj)
+            if hasattr(obj, 'invalidate_str_cache'):
+                obj.invalidate_str_cache()
+        # the markup also depends on related objects, which do not
+        # change the _last_updated of the row object
+        self.markup_cache.clear()
+        tables = set(table for table, id in changed)
+        for path in model.stale_children(tables):
+            if self.results_view.row_expanded(path):
+                self.results_view.collapse_row(path)
+                self.results_view.expand_row(path, False)
+        self.results_view.queue_draw()
+        self.update_infobox()
+
     def on_view_row_activated(self, view, path, column, data=None):
         '''
         expand the row on activation
@@ -1225,6 +1773,8 @@ class SearchView(pluginmgr.View):
 
         self.results_view.connect("row-activated",
                                   self.on_view_row_activated)
+        self.results_view.get_vadjustment().connect(
+            "value-changed", self.on_results_scrolled)
 
         # this group doesn't need to be added to the main window with
         # gtk.Window.add_accel_group since the group will be added
@@ -1273,46 +1823,15 @@ class Note:
             return []
 
 
-class AppendThousandRows(threading.Thread):
-
-    def callback(self, rows):
-        for row in rows:
-            self.view.add_row(row)
-
-    def cancel_callback(self):
-        row = ['---'] * 6
-        row[4] = '** ' + _('interrupted') + ' **'
-        self.view.liststore.append(row)
-
-    def __init__(self, view, group=None, verbose=None, **kwargs):
-        super(AppendThousandRows, self).__init__(
-            group=group, target=None, name=None, verbose=verbose)
-        self.__stopped = threading.Event()
-        self.view = view
-
-    def cancel(self):
-        self.__stopped.set()
-
-    def run(self):
-        session = db.Session()
-        q = session.query(db.History).order_by(db.History.timestamp.desc())
-        # add rows in small batches
-        offset = 0
-        step = 200
-        count = q.count()
-        while offset < count and not self.__stopped.isSet():
-            rows = q.offset(offset).limit(step).all()
-            gobject.idle_add(self.callback, rows)
-            offset += step
-        session.close()
-        if offset < count:
-            gobject.idle_add(self.cancel_callback)
-
-
 class HistoryView(pluginmgr.View):
     """Show the tables row in the order they were last updated
+
+    The entries are read a page at a time, as the user scrolls down,
+    each page following the (timestamp, id) of the last entry shown.
     """
 
+    page_size = 200
+
     TVC_TIMESTAMP = 0
     TVC_OPERATION = 1
     TVC_USER = 2
@@ -1327,6 +1846,13 @@ class HistoryView(pluginmgr.View):
             root_widget_name='history_window')
         self.view.connect_signals(self)
         self.liststore = self.view.widgets.history_ls
+        # the history_query arguments selecting the entries shown
+        self.filters = {}
+        # the (timestamp, id) of the last entry shown, None once all
+        # the entries are shown
+        self.last_key = None
+        self.view.widgets.history_sv.get_vadjustment().connect(
+            'value-changed', self.on_history_scrolled)
         self.update()
 
     @staticmethod
@@ -1337,9 +1863,9 @@ class HistoryView(pluginmgr.View):
             return -1
         if kb == 'id':
             return 1
-        if va == 'None' and vb != 'None':
+        if va is None and vb is not None:
             return 1
-        if vb == 'None' and va != 'None':
+        if vb is None and va is not None:
             return -1
         if a < b:
             return -1
@@ -1349,14 +1875,12 @@ class HistoryView(pluginmgr.View):
 
     @staticmethod
     def show_typed_value(v):
-        try:
-            eval(v)
-            return v
-        except:
+        if isinstance(v, basestring):
             return u"»%s«" % v
+        return u"%s" % (v, )
 
     def add_row(self, item):
-        d = eval(item.values)
+        d = db.history_values(item.values, item.table_name)
         del d['_created']
         del d['_last_updated']
         friendly = ', '.join(u"%s: %s" % (k, self.show_typed_value(v))
@@ -1369,8 +1893,8 @@ class HistoryView(pluginmgr.View):
 
     def on_row_activated(self, tree, path, column):
         row = self.liststore[path]
-        dic = eval(row[self.TVC_DICT])
         table = row[self.TVC_TABLE]
+        dic = db.history_values(row[self.TVC_DICT], table)
         obj_id = int(dic['id'])
         for table_name, equivalent, key in [
                 ('genus_note', 'genus', 'genus_id'),
@@ -1393,15 +1917,85 @@ class HistoryView(pluginmgr.View):
             bauble.gui.widgets.main_comboentry.child.set_text(query)
             bauble.gui.widgets.go_button.emit("clicked")
 
-    def update(self):
+    def update(self, filters=None):
         """
-        Add the history items to the view.
+        Show the first page of the history items matching filters, or
+        the previous filters, see db.history_query.
         """
+        if filters is not None:
+            self.filters = filters
         self.liststore.clear()
-        self.start_thread(AppendThousandRows(self))
+        self.last_key = None
+        self.append_page()
+
+    def append_page(self):
+        """
+        Append the history items following the last one shown.
+        """
+        session = db.Session()
+        try:
+            items = db.history_query(
+                session, after=self.last_key, **self.filters).\
+                limit(self.page_size).all()
+        finally:
+            session.close()
+        for item in items:
+            self.add_row(item)
+        self.last_key = None
+        if len(items) == self.page_size:
+            self.last_key = items[-1].timestamp, items[-1].id
+
+    def on_history_scrolled(self, adjustment):
+        """
+        Append the next page when the user approaches the end.
+        """
+        if self.last_key is None:
+            return
+        if adjustment.value + 2 * adjustment.page_size >= adjustment.upper:
+            self.append_page()
+
+
+history_archive_age_pref = 'bauble.history.archive_age'
+"""
+The preferences key to the age, in days, of the history entries moved
+out of the history table by `:history=archive`.
+
+Values: a number of days (Default: 730)
+"""
+
+history_archive_tables_pref = 'bauble.history.archive_tables'
+"""
+The preferences key to archive the history entries to yearly tables in
+the database, rather than to gzipped JSON lines files in the history
+directory of the user directory.
+
+Values: True, False (Default: False)
+"""
+
+
+def history_archive_directory():
+    """return where the history is archived to, None for the tables"""
+    if prefs.prefs.get(history_archive_tables_pref, False):
+        return None
+    return os.path.join(paths.user_dir(), 'history')
 
 
 class HistoryCommandHandler(pluginmgr.CommandHandler):
+    """`:history` shows the history of the changes, `:history=migrate`
+    first converts the entries of old to JSON, see db.migrate_history.
+
+    `:history=archive` moves the entries older than the archive age out
+    of the history table, `:history=restore:2015` copies back the
+    entries archived for 2015, see db.archive_history.
+
+    the entries can be filtered in the database, like in
+    `:history=table:plant operation:update since:2016-01-01`, by table,
+    id, user, operation, since and until.
+    """
+
+    filter_names = {'table': 'table_name', 'id': 'table_id',
+                    'user': 'user', 'operation': 'operation',
+                    'since': 'since', 'until': 'until'}
 
     command = 'history'
     view = None
@@ -1415,12 +2009,92 @@ class HistoryCommandHandler(pluginmgr.CommandHandler):
         return self.view
 
     def __call__(self, cmd, arg):
-        self.view.update()
+        filters = {}
+        for word in (arg or '').split():
+            if word == 'migrate':
+                db.migrate_history()
+                continue
+            if word == 'archive':
+                age = prefs.prefs.get(history_archive_age_pref, 730)
+                db.archive_history(
+                    datetime.datetime.now() - datetime.timedelta(days=age),
+                    history_archive_directory())
+                continue
+            name, sep, value = word.partition(':')
+            if name == 'restore' and value.isdigit():
+                db.restore_history(int(value), history_archive_directory())
+                continue
+            if name not in self.filter_names or not value:
+                raise BaubleError(_('Unknown history filter: %s') % word)
+            value = utils.utf8(value)
+            if name == 'id':
+                try:
+                    value = int(value)
+                except ValueError:
+                    raise BaubleError(_('Not a history id: %s') % word)
+            filters[self.filter_names[name]] = value
+        self.view.update(filters)
 
 
 pluginmgr.register_command(HistoryCommandHandler)
 
 
+class DiagnosticsView(pluginmgr.View):
+    """
+    The DiagnosticsView shows the statistics of the connection pool of
+    the database, see db.pool_stats.
+    """
+
+    labels = {'pool': _('Pool class'),
+              'size': _('Pool size'),
+              'checkedin': _('Connections in the pool'),
+              'checkedout': _('Connections in use'),
+              'overflow': _('Connections in overflow'),
+              'connect': _('Connections made'),
+              'checkout': _('Checkouts'),
+              'checkin': _('Checkins'),
+              'invalidate': _('Connections invalidated')}
+
+    def __init__(self):
+        super(DiagnosticsView, self).__init__()
+        self.stats_ls = gtk.ListStore(str, str)
+        tree = gtk.TreeView(self.stats_ls)
+        for index, title in enumerate((_('Statistic'), _('Value'))):
+            tree.append_column(gtk.TreeViewColumn(
+                title, gtk.CellRendererText(), text=index))
+        scrolled = gtk.ScrolledWindow()
+        scrolled.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        scrolled.add(tree)
+        self.pack_start(scrolled)
+        self.show_all()
+
+    def update(self):
+        self.stats_ls.clear()
+        for name, value in db.pool_stats().items():
+            self.stats_ls.append((self.labels.get(name, name),
+                                  utils.utf8(value)))
+
+
+class DiagnosticsCommandHandler(pluginmgr.CommandHandler):
+    """`:diagnostics` shows the statistics of the connection pool, taken
+    when the command is given.
+    """
+
+    command = 'diagnostics'
+    view = None
+
+    def get_view(self):
+        if not self.view:
+            self.__class__.view = DiagnosticsView()
+        return self.view
+
+    def __call__(self, cmd, arg):
+        self.view.update()
+
+
+pluginmgr.register_command(DiagnosticsCommandHandler)
+
+
 def select_in_search_results(obj):
     """
     :param obj: the object the select
@@ -1438,7 +2112,11 @@ def select_in_search_results(obj):
     logger.debug("select_in_search_results %s is in session %s" %
                  (obj, obj in view.session))
     model = view.results_view.get_model()
-    found = utils.search_tree_model(model, obj)
+    if not isinstance(model, ResultsModel):
+        # nothing was found, or nothing was searched yet
+        model = ResultsModel(view.session, view.row_meta)
+        view.results_view.set_model(model)
+    found = model.find(obj)
     row_iter = None
     if len(found) > 0:
         row_iter = found[0]
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""
+time aggregate searches on a generated collection
+
+the collection has 100k plants, in 25k accessions of 2500 species, in
+an in memory SQLite database unless a database uri is given.  each
+search is run compiled to a single statement (aggregates as correlated
+subqueries) and on the INTERSECT/UNION/EXCEPT path (aggregates as
+GROUP BY/HAVING).
+
+usage: benchmark_aggregates.py [uri [plants]]
+"""
+import random
+import sys
+import time
+
+import bauble.db as db
+import bauble.pluginmgr as pluginmgr
+import bauble.prefs as prefs
+import bauble.search as search
+
+uri = len(sys.argv) > 1 and sys.argv[1] or 'sqlite:///:memory:'
+nplants = len(sys.argv) > 2 and int(sys.argv[2]) or 100000
+
+queries = [
+    'accession where sum(plants.quantity)>0',
+    'accession where count(plants.id)>3 and species.genus.genus=Ficus',
+    'species where avg(accessions.plants.quantity)>=2',
+    'genus where count(distinct species.accessions.plants.location_id)>5',
+    'family where sum(genera.species.accessions.plants.quantity)>100',
+    ]
+
+db.open(uri, verify=False)
+prefs.prefs.init()
+prefs.testing = True
+pluginmgr.load()
+db.create(False)
+pluginmgr.init(force=True)
+
+from bauble.plugins.plants import Family, Genus, Species
+from bauble.plugins.garden import Accession, Location, Plant
+
+
+def insert(cls, rows):
+    if rows:
+        db.engine.execute(cls.__table__.insert(), rows)
+
+random.seed(0)
+start = time.time()
+nacc = nplants // 4
+nsp = nacc // 10
+ngen = nsp // 10
+insert(Family, [{'id': i, 'family': u'Family%d' % i}
+                for i in range(1, ngen // 10 + 2)])
+insert(Genus, [{'id': i, 'genus': i == 1 and u'Ficus' or u'Genus%d' % i,
+                'family_id': (i - 1) // 10 + 1}
+               for i in range(1, ngen + 1)])
+insert(Species, [{'id': i, 'sp': u'sp%d' % i,
+                  'genus_id': (i - 1) // 10 + 1}
+                 for i in range(1, nsp + 1)])
+insert(Location, [{'id': i, 'code': u'LOC%d' % i} for i in range(1, 51)])
+insert(Accession, [{'id': i, 'code': u'2016.%05d' % i,
+                    'species_id': random.randint(1, nsp)}
+                   for i in range(1, nacc + 1)])
+insert(Plant, [{'id': i, 'code': u'%d' % i,
+                'accession_id': random.randint(1, nacc),
+                'location_id': random.randint(1, 50),
+                'quantity': random.randint(0, 3)}
+               for i in range(1, nplants + 1)])
+print 'generated %d plants in %.1f s' % (nplants, time.time() - start)
+
+session = db.Session()
+mapper_search = search.get_strategy('MapperSearch')
+for q in queries:
+    timings = []
+    for compiled in (True, False):
+        prefs.prefs[search.compile_queries_pref] = compiled
+        session.expunge_all()
+        start = time.time()
+        n = len(mapper_search.search(q, session))
+        timings.append(time.time() - start)
+    print '%-70s %6d results %8.3f s compiled %8.3f s set algebra' % (
+        q, n, timings[0], timings[1])
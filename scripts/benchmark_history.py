@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+"""
+time the creation of plants through the ORM, history included
+
+all plants are added in one session and committed at once, in an in
+memory SQLite database unless a database uri is given.  the number of
+statements sent to the database is counted along with the time.
+
+usage: benchmark_history.py [uri [plants]]
+"""
+import sys
+import time
+
+from sqlalchemy import event
+
+import bauble.db as db
+import bauble.pluginmgr as pluginmgr
+import bauble.prefs as prefs
+
+uri = len(sys.argv) > 1 and sys.argv[1] or 'sqlite:///:memory:'
+nplants = len(sys.argv) > 2 and int(sys.argv[2]) or 20000
+
+db.open(uri, verify=False)
+prefs.prefs.init()
+prefs.testing = True
+pluginmgr.load()
+db.create(False)
+pluginmgr.init(force=True)
+
+from bauble.plugins.plants import Family, Genus, Species
+from bauble.plugins.garden import Accession, Location, Plant
+
+statements = []
+
+
+def count(conn, cursor, statement, *args):
+    statements.append(statement)
+event.listen(db.engine, 'before_cursor_execute', count)
+
+session = db.Session()
+family = Family(family=u'Cactaceae')
+genus = Genus(family=family, genus=u'Echinocactus')
+species = Species(genus=genus, sp=u'grusonii')
+location = Location(code=u'LOC')
+accessions = [Accession(species=species, code=u'2016.%05d' % i)
+              for i in range(nplants // 4)]
+session.add_all([family, genus, species, location] + accessions)
+session.commit()
+del statements[:]
+
+start = time.time()
+session.add_all([Plant(accession=accessions[i % len(accessions)],
+                       location=location, code=u'%d' % i, quantity=1)
+                 for i in range(nplants)])
+session.commit()
+elapsed = time.time() - start
+history = sum(1 for s in statements if s.startswith('INSERT INTO history'))
+print 'created %d plants in %.2f s, %d statements, %d for history' % (
+    nplants, elapsed, len(statements), history)
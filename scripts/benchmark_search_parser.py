@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+"""
+time SearchParser.parse_string on a set of typical queries
+
+three configurations are measured: the plain grammar, the grammar with
+pyparsing packrat memoization (what bauble.search uses), and the parse
+results cache on top of it.
+
+usage: benchmark_search_parser.py [repetitions]
+"""
+import sys
+import timeit
+
+from pyparsing import ParserElement
+
+import bauble.search as search
+
+queries = [
+    'Ficus',
+    'Ficus carica',
+    'plant=*',
+    'genus like Fic%',
+    'loc=GH1 GH2 GH3',
+    'species where genus.family.family=Moraceae',
+    'plant where accession.species.genus.genus=Ficus and quantity>0',
+    'accession where code between "2010" and "2012" or not private=1',
+    'genus where count(species.id) > 3',
+    'plant where accession.species.genus.family.family in '
+    'Moraceae,Rutaceae,Musaceae and (quantity > 1 or location.code=GH1)',
+    ]
+
+repetitions = len(sys.argv) > 1 and int(sys.argv[1]) or 100
+
+
+def measure(label, parser_factory):
+    parser = parser_factory()
+
+    def run():
+        for q in queries:
+            parser.parse_string(q)
+    elapsed = min(timeit.repeat(run, number=repetitions, repeat=3))
+    print '%-24s %8.3f ms/query' % (
+        label, 1000.0 * elapsed / repetitions / len(queries))
+
+
+def uncached():
+    parser = search.SearchParser(cache_size=1)
+    parser.parse_string = lambda text: parser.statement.parseString(text)
+    return parser
+
+ParserElement._parse = ParserElement._parseNoCache
+measure('plain grammar', uncached)
+ParserElement._parse = ParserElement._parseCache
+measure('packrat', uncached)
+measure('packrat and cache', search.SearchParser)